@@ -0,0 +1,564 @@
+"""
+A columnar arena for storing large sets of statements compactly. Instead of a Token object and an
+args tuple for every term, the arena keeps a few flat arrays of ints: the symbol of every node (its
+id in prototypes.SYMBOL_TABLE), its arity and where its children start in a shared array of child
+offsets. Every node is stored once: adding a token whose function name and args the arena already
+has gives the node it has, so a subterm used all over a knowledge base is stored once, and two
+nodes are the same exactly when they are written the same way.
+
+Nodes are added children first, so every child has a lower offset than its parent. Scans over the
+whole arena, such as the depth, width or sort of every node, are then a single loop over the
+arrays that never builds a Token. ArenaTerm gives a Token-like view of a node for callers that
+still want objects.
+
+A DCECContainer keeps its statements in a TermArena, and its checkMap in an ArenaCheckMap.
+"""
+
+from __future__ import print_function
+from array import array
+from six import string_types
+
+try:
+    from collections.abc import MutableMapping, Sequence
+except ImportError:
+    from collections import MutableMapping, Sequence
+
+# We need to use the first type of import if running this script directly and the second type of
+# import if we're using it in a package (such as for within Talos)
+try:
+    import high_level_parsing
+    import prototypes
+except ImportError:
+    import DCEC_Library.high_level_parsing as high_level_parsing
+    import DCEC_Library.prototypes as prototypes
+
+# Arity of the nodes that hold atomics rather than tokens
+ATOMIC = -1
+
+# Hashes are kept in arrays of C ints, so only their low bits are kept
+HASH_BITS = 0x7fffffff
+
+# What render has left to write after the args of a node, and between them
+CLOSE = -1
+SEPARATOR = -2
+
+
+class TermArena(Sequence):
+    """
+    Flat storage for a list of statements. The arena is the list of its statements, each a view
+    of its node (or the atomic, for an atomic), in the order they were added.
+
+    >>> token = high_level_parsing.Token("and", [high_level_parsing.Token("P", ["x"]), "x"])
+    >>> terms = TermArena([token, "y", high_level_parsing.Token("P", ["x"])])
+    >>> len(terms), terms.node_count()
+    (3, 4)
+    >>> [terms.render(root) for root in terms.roots]
+    ['(and (P x) x)', 'y', '(P x)']
+    >>> terms[2] == terms[0].args[0], terms[1]
+    (True, 'y')
+    >>> list(terms.depths())
+    [0, 1, 2, 0]
+    >>> terms[0].args[0].create_f_expression()
+    'P(x)'
+    """
+    def __init__(self, statements=None):
+        # One entry per node
+        self.symbol = array("i")
+        self.arity = array("i")
+        self.first = array("i")
+        # The child offsets of every node, one run per node
+        self.children = array("i")
+        # The node of each statement, in the order they were added
+        self.roots = array("i")
+        # Open addressing table of the nodes by the hash of their symbol, arity and args, as the
+        # offset of the node plus one, or 0 for a free slot. Never more than half full.
+        self.table = array("i", [0]) * 8
+        if statements is not None:
+            self.extend(statements)
+
+    def __len__(self):
+        return len(self.roots)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.view(self.roots[place]) for place in range(*index.indices(len(self)))]
+        return self.view(self.roots[index])
+
+    def node_count(self):
+        """
+        :return: number of nodes in the arena
+        """
+        return len(self.symbol)
+
+    def find_slot(self, symbol, arity, args):
+        """
+        Find the slot of the table a node is in, or the free slot it would go in.
+
+        :param symbol: id of the function name or atomic
+        :param arity: number of args, or ATOMIC
+        :param args: array of the offsets of the nodes of the args
+        :return: the slot, and the offset of the node, or -1 if the arena does not have it
+        """
+        mask = len(self.table) - 1
+        slot = hash((symbol, arity) + tuple(args)) & mask
+        while True:
+            node = self.table[slot] - 1
+            if node < 0 or (self.symbol[node] == symbol and self.arity[node] == arity and
+                            (arity <= 0 or self.args_of(node) == args)):
+                return slot, node
+            slot = (slot + 1) & mask
+
+    def add_node(self, symbol, arity, args):
+        """
+        Get the node for a symbol and args, adding it if the arena does not have it yet.
+
+        :param symbol: id of the function name or atomic in prototypes.SYMBOL_TABLE
+        :param arity: number of args, or ATOMIC
+        :param args: offsets of the nodes of the args
+        :return: offset of the node
+        """
+        args = array("i", args)
+        slot, node = self.find_slot(symbol, arity, args)
+        if node >= 0:
+            return node
+        node = len(self.symbol)
+        self.symbol.append(symbol)
+        self.arity.append(arity)
+        self.first.append(len(self.children))
+        self.children.extend(args)
+        self.table[slot] = node + 1
+        if 2 * len(self.symbol) > len(self.table):
+            self.grow()
+        return node
+
+    def grow(self):
+        """
+        Double the size of the table of nodes.
+        """
+        self.table = array("i", [0]) * (2 * len(self.table))
+        for node in range(0, len(self.symbol)):
+            slot = self.find_slot(self.symbol[node], self.arity[node], self.args_of(node))[0]
+            self.table[slot] = node + 1
+
+    def intern(self, statement):
+        """
+        Get the node of a statement, adding the nodes it needs that the arena does not have yet.
+        Each token is added after its args using an explicit stack.
+
+        :param statement: Token, ArenaTerm or atomic
+        :return: offset of the node
+        """
+        if isinstance(statement, string_types):
+            return self.add_node(prototypes.SYMBOL_TABLE.id_of(statement), ATOMIC, ())
+        if isinstance(statement, ArenaTerm) and statement.arena is self:
+            return statement.node
+        # Tokens compare by identity and views of another arena by node, so a token shared in
+        # the statement is only looked at once
+        nodes = {}
+        stack = [(statement, False)]
+        while stack:
+            token, expanded = stack.pop()
+            if token in nodes:
+                continue
+            if not expanded:
+                stack.append((token, True))
+                stack.extend((arg, False) for arg in token.args
+                             if not isinstance(arg, string_types))
+                continue
+            args = [self.intern(arg) if isinstance(arg, string_types) else nodes[arg]
+                    for arg in token.args]
+            nodes[token] = self.add_node(token.symbol, len(args), args)
+        return nodes[statement]
+
+    def append(self, statement):
+        """
+        Add a statement to the end of the arena.
+
+        :param statement: Token, ArenaTerm or atomic
+        """
+        self.roots.append(self.intern(statement))
+
+    def extend(self, statements):
+        """
+        Add statements to the end of the arena.
+
+        :param statements: Tokens, ArenaTerms or atomics
+        :return: list of the nodes of the statements
+        """
+        added = []
+        for statement in statements:
+            added.append(self.intern(statement))
+            self.roots.append(added[-1])
+        return added
+
+    def name_of(self, node):
+        """
+        :param node: offset of a node
+        :return: function name or atomic of the node
+        """
+        return prototypes.SYMBOL_TABLE.name_of(self.symbol[node])
+
+    def is_atomic(self, node):
+        """
+        :param node: offset of a node
+        :return: True if the node is an atomic rather than a token
+        """
+        return self.arity[node] == ATOMIC
+
+    def args_of(self, node):
+        """
+        :param node: offset of a node
+        :return: offsets of the args of the node
+        """
+        if self.arity[node] <= 0:
+            return self.children[0:0]
+        return self.children[self.first[node]:self.first[node] + self.arity[node]]
+
+    def view(self, node):
+        """
+        :param node: offset of a node
+        :return: the atomic of the node, or a Token-like view of it
+        """
+        if self.arity[node] == ATOMIC:
+            return prototypes.SYMBOL_TABLE.name_of(self.symbol[node])
+        return ArenaTerm(self, node)
+
+    def subtree(self, node):
+        """
+        List every node below a node, and the node itself, args before the tokens that use them.
+
+        :param node: offset of a node
+        :return: sorted list of offsets
+        """
+        arity, first, children = self.arity, self.first, self.children
+        seen = set([node])
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if arity[item] > 0:
+                for arg in children[first[item]:first[item] + arity[item]]:
+                    if arg not in seen:
+                        seen.add(arg)
+                        stack.append(arg)
+        return sorted(seen)
+
+    def depths(self):
+        """
+        Get the depth of every node, as Token.depth_of would give it. Atomics have a depth of 0.
+
+        :return: array of depths, by node
+        """
+        depths = array("i", [0]) * len(self.symbol)
+        for node in range(0, len(self.symbol)):
+            if self.arity[node] != ATOMIC:
+                depths[node] = 1 + max([depths[arg] for arg in self.args_of(node)] or [0])
+        return depths
+
+    def widths(self):
+        """
+        Get the width of every node, as Token.width_of would give it. Atomics have a width of 1.
+
+        :return: array of widths, by node
+        """
+        widths = array("i", [1]) * len(self.symbol)
+        for node in range(0, len(self.symbol)):
+            if self.arity[node] != ATOMIC:
+                widths[node] = sum([widths[arg] for arg in self.args_of(node)])
+        return widths
+
+    def sorts(self, container, nodes=None, atomics=None):
+        """
+        Get the sort of nodes, as DCECContainer.sort_of would give it.
+
+        :param container: DCECContainer whose namespace gives the sorts
+        :param nodes: sorted offsets of the nodes, which have to have their args among them (such
+                      as from subtree), or None for every node
+        :param atomics: sorts of atomics the namespace does not have yet
+        :return: dict of sorts by node, or list of them if nodes is None, with None where the sort
+                 is unknown
+        """
+        namespace_atomics = container.namespace.atomics
+        match_prototype = container.match_prototype
+        names = prototypes.SYMBOL_TABLE.names
+        symbol, arity, first, children = self.symbol, self.arity, self.first, self.children
+        if nodes is None:
+            nodes = range(0, len(symbol))
+            sorts = [None] * len(symbol)
+        else:
+            sorts = {}
+        for node in nodes:
+            name = names[symbol[node]]
+            count = arity[node]
+            if count == ATOMIC:
+                sort = namespace_atomics.get(name)
+                if sort is None and atomics:
+                    sort = atomics.get(name)
+                sorts[node] = sort
+                continue
+            start = first[node]
+            prototype = match_prototype(name, [sorts[arg] for arg in
+                                               children[start:start + count]])
+            sorts[node] = None if prototype is None else prototype[0]
+        return sorts
+
+    def sort_of(self, node, container, atomics=None):
+        """
+        :param node: offset of a node
+        :param container: DCECContainer whose namespace gives the sorts
+        :param atomics: sorts of atomics the namespace does not have yet
+        :return: the sort of the node, as DCECContainer.sort_of would give it
+        """
+        return self.sorts(container, self.subtree(node), atomics)[node]
+
+    def render(self, node, expression_type="S"):
+        """
+        Write out a node in S or F form, as create_s_expression and create_f_expression would.
+
+        :param node: offset of a node
+        :param expression_type: "S" or "F"
+        :return: expression representing the node
+        """
+        s_form = expression_type == "S"
+        separator = " " if s_form else ","
+        names = prototypes.SYMBOL_TABLE.names
+        symbol, arity, first, children = self.symbol, self.arity, self.first, self.children
+        pieces = []
+        append = pieces.append
+        # S expressions have a separator before every arg, F expressions only between them
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if item == CLOSE:
+                append(")")
+            elif item == SEPARATOR:
+                append(separator)
+            elif arity[item] == ATOMIC:
+                append(names[symbol[item]])
+            else:
+                count = arity[item]
+                append("(" + names[symbol[item]] if s_form else names[symbol[item]] + "(")
+                stack.append(CLOSE)
+                for arg in reversed(children[first[item]:first[item] + count]):
+                    stack.append(arg)
+                    stack.append(SEPARATOR)
+                if count and not s_form:
+                    stack.pop()
+        return "".join(pieces)
+
+    def to_token(self, node):
+        """
+        Build the Token for a node. Nodes that are shared in the arena are shared in the tokens.
+
+        :param node: offset of a node
+        :return: Token, or the atomic of the node
+        """
+        tokens = {}
+        for item in self.subtree(node):
+            name = prototypes.SYMBOL_TABLE.name_of(self.symbol[item])
+            if self.arity[item] == ATOMIC:
+                tokens[item] = name
+            else:
+                tokens[item] = high_level_parsing.Token.from_symbol(
+                    name, self.symbol[item], tuple(tokens[arg] for arg in self.args_of(item)))
+        return tokens[node]
+
+
+class ArenaTerm(object):
+    """
+    Token-like view of a node of a TermArena. It only holds the arena and the offset of the node,
+    and works out everything else from the arena when asked. Views of the same node are equal.
+    """
+    __slots__ = ["arena", "node"]
+
+    def __init__(self, arena, node):
+        self.arena = arena
+        self.node = node
+
+    def __eq__(self, other):
+        return isinstance(other, ArenaTerm) and self.arena is other.arena and \
+            self.node == other.node
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.arena), self.node))
+
+    @property
+    def function_name(self):
+        return self.arena.name_of(self.node)
+
+    @property
+    def symbol(self):
+        return self.arena.symbol[self.node]
+
+    @property
+    def args(self):
+        return tuple(self.arena.view(arg) for arg in self.arena.args_of(self.node))
+
+    def preorder(self):
+        """
+        :return: generator of views of this term and all of the tokens below it, each before its
+                 args, as Token.preorder gives them
+        """
+        arena = self.arena
+        stack = [self.node]
+        while stack:
+            node = stack.pop()
+            yield ArenaTerm(arena, node)
+            stack.extend(arg for arg in reversed(arena.args_of(node)) if not arena.is_atomic(arg))
+
+    def postorder(self):
+        """
+        :return: generator of views of this term and all of the tokens below it, each after its
+                 args, as Token.postorder gives them
+        """
+        arena = self.arena
+        stack = [(self.node, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                yield ArenaTerm(arena, node)
+                continue
+            stack.append((node, True))
+            stack.extend((arg, False) for arg in reversed(arena.args_of(node))
+                         if not arena.is_atomic(arg))
+
+    def depth_of(self):
+        """
+        :return: max depth of the term
+        """
+        depths = {}
+        for node in self.arena.subtree(self.node):
+            if not self.arena.is_atomic(node):
+                depths[node] = 1 + max([depths.get(arg, 0) for arg in self.arena.args_of(node)]
+                                       or [0])
+        return depths[self.node]
+
+    def width_of(self):
+        """
+        :return: width of the term
+        """
+        widths = {}
+        for node in self.arena.subtree(self.node):
+            if self.arena.is_atomic(node):
+                widths[node] = 1
+            else:
+                widths[node] = sum([widths[arg] for arg in self.arena.args_of(node)])
+        return widths[self.node]
+
+    def create_s_expression(self):
+        """
+        :return: S expression representing the term
+        """
+        return self.arena.render(self.node, "S")
+
+    def create_f_expression(self):
+        """
+        :return: F expression representing the term
+        """
+        return self.arena.render(self.node, "F")
+
+    def to_token(self):
+        """
+        :return: Token for the term
+        """
+        return self.arena.to_token(self.node)
+
+
+class ArenaCheckMap(MutableMapping):
+    """
+    The checkMap of a container that keeps its statements in a TermArena, from the S expression
+    of each statement to the statement. Only a hash of each S expression is kept, next to the node
+    of its statement, and a lookup writes out the nodes with the same hash to compare them. The
+    keys have to be the S expressions of the statements.
+
+    >>> terms = TermArena([high_level_parsing.Token("holds", ["f", "t1"])])
+    >>> check_map = ArenaCheckMap(terms)
+    >>> check_map["(holds f t1)"] = terms[0]
+    >>> "(holds f t1)" in check_map, "(holds f t2)" in check_map
+    (True, False)
+    >>> check_map["(holds f t1)"] == terms[0], len(check_map)
+    (True, 1)
+    """
+    def __init__(self, arena):
+        self.arena = arena
+        # Open addressing table of the hash of each key and the node of its statement plus one,
+        # or 0 for a free slot. Never more than half full.
+        self.hashes = array("i", [0]) * 8
+        self.nodes = array("i", [0]) * 8
+        self.size = 0
+
+    def find_slot(self, key):
+        """
+        :param key: S expression
+        :return: the slot of the table the key is in, or the free slot it would go in, and the
+                 hash of the key
+        """
+        code = hash(key) & HASH_BITS
+        mask = len(self.nodes) - 1
+        slot = code & mask
+        while self.nodes[slot] and (self.hashes[slot] != code or
+                                    self.arena.render(self.nodes[slot] - 1) != key):
+            slot = (slot + 1) & mask
+        return slot, code
+
+    def __getitem__(self, key):
+        slot = self.find_slot(key)[0]
+        if not self.nodes[slot]:
+            raise KeyError(key)
+        return self.arena.view(self.nodes[slot] - 1)
+
+    def __contains__(self, key):
+        return self.nodes[self.find_slot(key)[0]] != 0
+
+    def __setitem__(self, key, value):
+        node = self.arena.intern(value)
+        slot, code = self.find_slot(key)
+        if not self.nodes[slot]:
+            self.size += 1
+        self.hashes[slot] = code
+        self.nodes[slot] = node + 1
+        if 2 * self.size > len(self.nodes):
+            hashes, nodes = self.hashes, self.nodes
+            self.hashes = array("i", [0]) * (2 * len(nodes))
+            self.nodes = array("i", [0]) * (2 * len(nodes))
+            mask = len(self.nodes) - 1
+            for code, node in zip(hashes, nodes):
+                if node:
+                    slot = code & mask
+                    while self.nodes[slot]:
+                        slot = (slot + 1) & mask
+                    self.hashes[slot] = code
+                    self.nodes[slot] = node
+
+    def __delitem__(self, key):
+        hole = self.find_slot(key)[0]
+        if not self.nodes[hole]:
+            raise KeyError(key)
+        # Move back the keys after it that would no longer be found past the free slot
+        mask = len(self.nodes) - 1
+        slot = (hole + 1) & mask
+        while self.nodes[slot]:
+            home = self.hashes[slot] & mask
+            if (slot - home) & mask >= (slot - hole) & mask:
+                self.hashes[hole] = self.hashes[slot]
+                self.nodes[hole] = self.nodes[slot]
+                hole = slot
+            slot = (slot + 1) & mask
+        self.hashes[hole] = 0
+        self.nodes[hole] = 0
+        self.size -= 1
+
+    def __iter__(self):
+        # In the order the statements were first added to the arena
+        for node in sorted(node - 1 for node in self.nodes if node):
+            yield self.arena.render(node)
+
+    def __len__(self):
+        return self.size
+
+if __name__ == "__main__":
+    # pylint: disable=wrong-import-position
+    import doctest
+    doctest.testmod()
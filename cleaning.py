@@ -3,6 +3,51 @@ Functions based around manipulating and parsing expressions as they come into th
 """
 
 
+class ParenIndex:
+    """
+    Matches up all of the parentheses of an expression in one pass, so the matching close paren of
+    any open paren can be looked up without scanning the expression again. The expression can be a
+    string or a list of tokens from the lexer. Close parens that do not have an open paren are
+    skipped, so every open paren gets the same match get_matching_close_paren would find for it.
+
+    >>> parens = ParenIndex("(a (b) c)")
+    >>> parens.close_of(0), parens.close_of(3), parens.balanced
+    (8, 5, True)
+    >>> parens = ParenIndex(")(a(b)")
+    >>> parens.close_of(1), parens.close_of(3), parens.balanced
+    (False, 5, False)
+    >>> ParenIndex(["(", "B", ",", "(", "K", ")", ")"]).close_of(3)
+    5
+    """
+    def __init__(self, expression):
+        # Index of the matching close paren for every open paren, -1 everywhere else
+        self.closes = [-1] * len(expression)
+        self.balanced = True
+        opens = []
+        for index in range(0, len(expression)):
+            if expression[index] == "(":
+                opens.append(index)
+            elif expression[index] == ")":
+                if opens:
+                    self.closes[opens.pop()] = index
+                else:
+                    self.balanced = False
+        if opens:
+            self.balanced = False
+
+    def close_of(self, open_paren_index):
+        """
+        Get the index of the close paren matching the open paren at the given index
+
+        :param open_paren_index: index of an open paren
+        :return: index of the matching close paren, or False if there is none
+        """
+        close_index = self.closes[open_paren_index]
+        if close_index == -1:
+            return False
+        return close_index
+
+
 def tuck_functions(expression):
     """
     This function given an expression in functional form moves the function inside its
@@ -25,9 +70,20 @@ def tuck_functions(expression):
     :return: the transformed expression
     """
     expression = str(expression)
+    parens = ParenIndex(expression)
+    # Close parens of "not" and "negate" calls, each of these is written out twice
+    doubled = set()
+    pieces = []
     first_paren = 0
     new_index = 0
-    temp = ""
+
+    def copy(start, end):
+        segment = expression[start:end]
+        if doubled and ")" in segment:
+            segment = "".join(")" + char if start + place in doubled else char
+                              for place, char in enumerate(segment))
+        pieces.append(segment)
+
     # Find the parentheses
     while first_paren < len(expression):
         first_paren = expression.find("(", first_paren)
@@ -42,20 +98,19 @@ def tuck_functions(expression):
                 func_start -= 1
             if func_start == -1:
                 func_start = 0
-            funcname = expression[func_start:first_paren]
-            if funcname in ["not", "negate"]:
-                adder = expression[new_index:func_start] + "(" + funcname + ",("
-                close_paren_place = get_matching_close_paren(expression, func_start + len(funcname))
-                expression = expression[:func_start] + expression[func_start:close_paren_place] + \
-                    "))" + expression[close_paren_place+1:]
-                temp += adder
-                new_index += len(adder)-2
-            else:
-                adder = expression[new_index:func_start] + "(" + funcname + ","
-                temp += adder
-                new_index += len(adder)-1
+            copy(new_index, func_start)
+            pieces.append("(")
+            copy(func_start, first_paren)
+            pieces.append(",")
+            if expression[func_start:first_paren] in ["not", "negate"]:
+                pieces.append("(")
+                close_paren_place = parens.close_of(first_paren)
+                if close_paren_place is not False:
+                    doubled.add(close_paren_place)
+            new_index = first_paren + 1
         first_paren += 1
-    returner = temp + expression[new_index:]
+    copy(new_index, len(expression))
+    returner = "".join(pieces)
     returner = returner.replace("``", "`")
     returner = returner.replace(",,", ",")
     returner = returner.replace("`", " ")
@@ -133,8 +188,9 @@ def consolidate_parens(expression):
     """
     expression = str(expression)
     temp = "(" + expression + ")"
-    # list of indexes to delete
-    delete_list = []
+    parens = ParenIndex(temp)
+    # set of indexes to delete
+    delete_list = set()
     # location of first paren
     first_paren_a = 0
     # looks through entire expression
@@ -145,28 +201,24 @@ def consolidate_parens(expression):
         if first_paren_a == -1:
             break
         # Get the matching close parens.
-        second_paren_a = get_matching_close_paren(temp, first_paren_a)
-        second_paren_b = get_matching_close_paren(temp, first_paren_b)
+        second_paren_a = parens.close_of(first_paren_a)
+        second_paren_b = parens.close_of(first_paren_b)
         # If both the open parens and the close parens match one set of parens is uneccesary,
         # so delete them
-        if second_paren_a == second_paren_b + 1:
-            delete_list.append(first_paren_a)
-            delete_list.append(second_paren_a)
+        if second_paren_a is not False and second_paren_b is not False and \
+                second_paren_a == second_paren_b + 1:
+            delete_list.add(first_paren_a)
+            delete_list.add(second_paren_a)
         first_paren_a += 1
     # Make the string to return
-    returner = ""
-    for i in range(0, len(temp)):
-        if i in delete_list:
-            continue
-        returner += temp[i]
-    return returner
+    return "".join(temp[i] for i in range(0, len(temp)) if i not in delete_list)
 
 
 def check_parens(expression):
     """
-    This function checks to see if the expression has the right number of parentheses.
-    It returns true if there are an equal amount of left and right parentheses, and false if
-    there are not.
+    This function checks to see if the parentheses of the expression match up.
+    It returns true if every left parenthesis has a matching right parenthesis after it, and
+    false if not.
 
     >>> check_parens("")
     True
@@ -176,18 +228,21 @@ def check_parens(expression):
     True
     >>> check_parens("(a(b(c))")
     False
+    >>> check_parens("a)(b")
+    False
 
     :param expression:
-    :return: boolean on whether equal amount of parentheses
+    :return: boolean on whether the parentheses match
     """
     expression = str(expression)
-    return expression.count("(") == expression.count(")")
+    return ParenIndex(expression).balanced
 
 
-def get_matching_close_paren(input_str, open_paren_index=0):
+def get_matching_close_paren(input_str, open_paren_index=0, parens=None):
     """
     Given a string, parse through it to find the index of the closing parenthesis that matches
-    the open parentheses given at some index
+    the open parentheses given at some index. Callers that look up many parentheses of the same
+    string should build a ParenIndex once and pass it in, which makes each lookup constant time.
 
     >>> get_matching_close_paren("(a b c)")
     6
@@ -195,11 +250,16 @@ def get_matching_close_paren(input_str, open_paren_index=0):
     8
     >>> get_matching_close_paren("(a (b) c)", 3)
     5
+    >>> get_matching_close_paren("(a (b) c)", 3, ParenIndex("(a (b) c)"))
+    5
 
     :param input_str:
     :param open_paren_index:
+    :param parens: ParenIndex of input_str
     :return:
     """
+    if parens is not None and open_paren_index != -1 and input_str[open_paren_index] == "(":
+        return parens.close_of(open_paren_index)
     paren_counter = 1
     current_index = open_paren_index
     if current_index == -1:
@@ -1,50 +1,173 @@
 from __future__ import print_function
+import io
+import itertools
+import math
+import os
 import pickle
-from six import string_types
+from array import array
+from six import PY2, string_types
 from six.moves import input
 
+try:
+    from collections.abc import Mapping, Sequence
+except ImportError:
+    from collections import Mapping, Sequence
+
 # We need to use the first type of import if running this script directly and the second type of
 # import if we're using it in a package (such as for within Talos)
 try:
+    import arena
     import high_level_parsing
+    import lexer
+    import messages
+    import parallel
     import prototypes
+    import snapshot
+    import symbol_index
 except ImportError:
+    import DCEC_Library.arena as arena
     import DCEC_Library.high_level_parsing as high_level_parsing
+    import DCEC_Library.lexer as lexer
+    import DCEC_Library.messages as messages
+    import DCEC_Library.parallel as parallel
     import DCEC_Library.prototypes as prototypes
+    import DCEC_Library.snapshot as snapshot
+    import DCEC_Library.symbol_index as symbol_index
 
+# What add_statements did with each statement. Errors are negative.
+ACCEPTED = high_level_parsing.ACCEPTED
+DUPLICATE = high_level_parsing.DUPLICATE
+EMPTY = high_level_parsing.EMPTY
+MALFORMED = high_level_parsing.MALFORMED
+WRONG_TYPE = high_level_parsing.WRONG_TYPE
+CONFLICT = high_level_parsing.CONFLICT
 
-class DCECContainer:
-    def __init__(self):
-        self.namespace = prototypes.Namespace()
-        self.statements = []
-        self.checkMap = {}
+# The fewest additions a version of the namespace keeps on top of its frozen copy before the copy
+# is made again, see Versions
+VERSION_CHANGES = 1024
 
-    def save(self, filename):
-        """
-        Saves a given container to file, saving both the prototypes (namespace) within the
-        container as well as the statements that have been added to it.
 
-        :param filename:
-        :return:
-        """
-        namespace_out = open(filename + ".namespace", "w")
-        statements_out = open(filename + ".statements", "w")
-        pickle.dump(self.namespace, namespace_out)
-        pickle.dump(self.checkMap, statements_out)
-
-    def load(self, filename):
-        name_in = open(filename + ".namespace", "r")
-        state_in = open(filename + ".statements", "r")
-        namespace_in = pickle.load(name_in)
-        statements_in = pickle.load(state_in)
-        if isinstance(namespace_in, prototypes.Namespace):
-            self.namespace = statements_in
-        else:
+def read_statements(source):
+    """
+    Reads statements, one to a line, as they are needed rather than all at once. Anything after a
+    ';' or a '#' is a comment, as for remove_comments and strip_comments, and lines with nothing
+    else are skipped.
+
+    :param source: name of a file, a file object (such as sys.stdin, which can be a pipe), or any
+                   iterable of strings or Tokens
+    :return: iterator of the line number and the statement of each statement, counting from 1
+    """
+    if isinstance(source, string_types):
+        with io.open(source, "r", encoding="utf-8") as lines:
+            for item in read_statements(lines):
+                yield item
+        return
+    for number, line in enumerate(source, 1):
+        if isinstance(line, bytes) and not isinstance(line, string_types):
+            line = line.decode("utf-8")
+        if isinstance(line, string_types):
+            for mark in ";#":
+                line = line.split(mark, 1)[0]
+            line = line.strip()
+            if not line:
+                continue
+        yield number, line
+
+
+class PickledObject(object):
+    """
+    Stands in for the Namespaces and Tokens of a container pickled by an older version, whatever
+    their classes were called then, so that their attributes can be read back into the classes
+    of this one. See DCECContainer.load.
+    """
+
+
+class PickleReader(pickle.Unpickler):
+    """
+    Reads a pickle written by an older version, with its Namespaces and Tokens as PickledObjects.
+    """
+    def find_class(self, module, name):
+        if name in ["Namespace", "NAMESPACE", "Token"]:
+            return PickledObject
+        return pickle.Unpickler.find_class(self, module, name)
+
+
+def read_pickle(filename):
+    """
+    :param filename: name of a file pickled by an older version
+    :return: what was pickled, see PickleReader
+    """
+    with open(filename, "rb") as pickled:
+        if PY2:
+            return PickleReader(pickled).load()
+        # Strings pickled by Python 2 are read as text
+        return PickleReader(pickled, encoding="utf-8").load()
+
+
+def rebuild_namespace(pickled):
+    """
+    Makes a Namespace out of one pickled by an older version. Its sorts, functions and atomics
+    are added again through add_code_*, so the namespace has everything a Namespace keeps now.
+
+    :param pickled: PickledObject of the namespace
+    :return: Namespace, or False if something in it could not be added
+    """
+    namespace = prototypes.Namespace()
+    sorts = dict(pickled.sorts)
+    # Each sort is added once the sorts it inherits from are
+    while sorts:
+        ready = sorted(name for name in sorts
+                       if all(parent in namespace.sorts for parent in sorts[name]))
+        if not ready:
+            messages.report("ERROR: the sorts " + ", ".join(sorted(sorts)) + " inherit from "
+                            "sorts that are not defined.")
             return False
-        if isinstance(statements_in, dict):
-            self.statements = statements_in.keys()
-            self.checkMap = statements_in
+        for name in ready:
+            if not namespace.add_code_sort(name, list(sorts.pop(name))):
+                return False
+    for name, items in pickled.functions.items():
+        for return_type, args_types in items:
+            if not namespace.add_code_function(name, return_type, list(args_types)):
+                return False
+    for name, sort in pickled.atomics.items():
+        if not namespace.add_code_atomic(name, sort):
+            return False
+    namespace.quant_map = dict(pickled.quant_map)
+    return namespace
+
+
+def rebuild_statement(pickled, tokens):
+    """
+    Makes a statement out of one pickled by an older version, args first.
+
+    :param pickled: atomic, or PickledObject of a Token
+    :param tokens: dict of the Tokens made so far, by the id of their PickledObject, so that
+                   tokens shared in the pickle are shared in the statements
+    :return: Token or atomic
+    """
+    if isinstance(pickled, string_types):
+        return pickled
+    stack = [(pickled, False)]
+    while stack:
+        item, expanded = stack.pop()
+        if id(item) in tokens:
+            continue
+        if not expanded:
+            stack.append((item, True))
+            stack.extend((arg, False) for arg in item.args if not isinstance(arg, string_types))
+            continue
+        # The oldest versions kept the function name as funcName
+        name = item.__dict__.get("function_name", item.__dict__.get("funcName"))
+        tokens[id(item)] = high_level_parsing.Token(name, [
+            arg if isinstance(arg, string_types) else tokens[id(arg)] for arg in item.args])
+    return tokens[id(pickled)]
 
+
+class ContainerReader(object):
+    """
+    What can be asked of a container without changing it. Shared by DCECContainer and the
+    read-only versions it publishes, see DCECContainer.enable_versions.
+    """
     def print_statement(self, statement, expression_type="S"):
         if isinstance(statement, string_types):
             return statement
@@ -53,13 +176,187 @@ class DCECContainer:
         elif expression_type == "F":
             temp = statement.create_f_expression()
         else:
-            print("ERROR: invalid notation type")
+            messages.report("ERROR: invalid notation type")
             return False
         for quant in self.namespace.quant_map.keys():
             if 'QUANT' in quant:
                 temp = temp.replace(quant, self.namespace.quant_map[quant])
         return temp
 
+    def to_arena(self):
+        """
+        Gets the statements of the container as a TermArena, which can be scanned (sorts, depths,
+        rendering) without building any Tokens. A DCECContainer keeps its statements in one, and
+        only containers loaded lazily and read-only versions get a copy.
+
+        >>> container = DCECContainer()
+        >>> container.namespace.add_basic_dcec()
+        >>> container.add_statement("B(Agent jack, t1, holds(f, t1))")
+        True
+        >>> statement = container.statements[0]
+        >>> container.to_arena() is container.statements, type(statement).__name__
+        (True, 'ArenaTerm')
+        >>> container.print_statement(statement), container.sort_of(statement.args[2])
+        ('(B jack t1 (holds f t1))', 'Boolean')
+
+        :return: TermArena of the statements, in the order they were added
+        """
+        if isinstance(self.statements, arena.TermArena):
+            return self.statements
+        return arena.TermArena(self.statements)
+
+    def match_prototype(self, function_name, arg_sorts):
+        return self.namespace.match_overload(function_name, arg_sorts)
+
+    def token_sorts(self, statement, atomics=None):
+        # Work up from the leaves, so that the sorts of the args are known before the function.
+        # atomics are sorts of atomics the namespace does not have yet, such as those a parse adds
+        sorts = {}
+        for token in statement.postorder():
+            tmp_types = []
+            for arg in token.args:
+                if isinstance(arg, string_types):
+                    sort = self.namespace.atomics.get(arg)
+                    if sort is None and atomics:
+                        sort = atomics.get(arg)
+                    tmp_types.append(sort)
+                else:
+                    tmp_types.append(sorts.get(id(arg)))
+            prototype = self.match_prototype(token.function_name, tmp_types)
+            sorts[id(token)] = None if prototype is None else prototype[0]
+        return sorts
+
+    def sort_of(self, statement, atomics=None):
+        if isinstance(statement, string_types):
+            sort = self.namespace.atomics.get(statement)
+            if sort is None and atomics:
+                sort = atomics.get(statement)
+            return sort
+        if statement is None:
+            return None
+        if isinstance(statement, arena.ArenaTerm):
+            # Worked out from the columns of the arena, without building any Tokens
+            return statement.arena.sort_of(statement.node, self, atomics)
+        return self.token_sorts(statement, atomics)[id(statement)]
+
+    def sorts_of_params(self, statement):
+        sorts = []
+        if isinstance(statement, string_types):
+            return sorts
+        if statement is None:
+            return None
+        if statement.function_name not in self.namespace.functions.keys():
+            return None
+        tmp_types = []
+        for arg in statement.args:
+            tmp_types.append(self.sort_of(arg))
+        prototype = self.match_prototype(statement.function_name, tmp_types)
+        return None if prototype is None else prototype[1]
+
+
+class DCECContainer(ContainerReader):
+    def __init__(self, namespace=None):
+        # Pass a Namespace made on top of prototypes.base_namespace() to start from the basic
+        # sorts and functions without adding them again
+        if namespace is None:
+            namespace = prototypes.Namespace()
+        self.namespace = namespace
+        # The statements are kept as the columns of an arena rather than as Tokens, and shared
+        # subterms of the statements are stored once. Reading a statement gives a view of it.
+        self.statements = arena.TermArena()
+        self.checkMap = arena.ArenaCheckMap(self.statements)
+        # Which statements each symbol is in, see find_all
+        self.symbols = symbol_index.SymbolIndex(self.statements)
+        # Statements that come up again are not parsed again
+        self.parses = high_level_parsing.ParseCache()
+        # Set to a SubexpressionMemo when statements are edited and added again, so that only the
+        # parts that changed are parsed
+        self.subexpressions = None
+        # The snapshot.Journal statements are recorded to as they are added, see open_journal
+        self.journal = None
+        self.journal_name = None
+        # Publishes the versions other threads read from, see enable_versions
+        self.versions = None
+        # The worker processes add_statements parses on, see close_workers
+        self.workers = None
+
+    def save(self, filename):
+        """
+        Saves a given container to file, saving both the prototypes (namespace) within the
+        container as well as the statements that have been added to it. The file is written in
+        the binary format of the snapshot module, to filename + ".dcec".
+
+        :param filename:
+        :return:
+        """
+        # Write the whole file before it replaces the old one, which may be mapped by a
+        # container that was loaded lazily
+        with open(filename + ".dcec.tmp", "wb") as container_out:
+            snapshot.dump(self, container_out)
+        if hasattr(os, "replace"):
+            os.replace(filename + ".dcec.tmp", filename + ".dcec")
+        else:
+            if os.path.exists(filename + ".dcec") and os.name == "nt":
+                os.remove(filename + ".dcec")
+            os.rename(filename + ".dcec.tmp", filename + ".dcec")
+
+    def load(self, filename, lazy=False):
+        """
+        Loads a container saved by save. Containers that were pickled to filename + ".namespace"
+        and filename + ".statements" by older versions are loaded as well. Their namespace is
+        made again from its sorts, functions and atomics, see rebuild_namespace.
+
+        >>> container = DCECContainer()
+        >>> container.load(os.path.join(os.path.dirname(__file__), "PICKLED"))
+        True
+        >>> sorted(container.print_statement(statement) for statement in container.statements)
+        ['(B jack t1 (holds f t1))', '(forAll x (holds x t1))', '(greet jack hello)', \
+'(happens (action jack wave) t2)', 'jill']
+        >>> container.add_statement("greet(jill, Greeting goodbye)")
+        True
+        >>> container.namespace.max_arity("greet"), container.namespace.atomics["goodbye"]
+        (2, 'Greeting')
+
+        :param filename:
+        :param lazy: if True, map the file and only decode each statement when it is first
+                     used, see snapshot.map_file
+        :return: True if the container was loaded, False otherwise
+        """
+        if os.path.exists(filename + ".dcec"):
+            if lazy:
+                loaded = snapshot.map_file(filename + ".dcec", self)
+            else:
+                with open(filename + ".dcec", "rb") as container_in:
+                    loaded = snapshot.load(container_in, self)
+            if loaded:
+                self.parses.clear()
+                if self.versions is not None:
+                    self.versions.publish()
+            return loaded
+        namespace_in = read_pickle(filename + ".namespace")
+        statements_in = read_pickle(filename + ".statements")
+        if not isinstance(namespace_in, PickledObject):
+            return False
+        namespace = rebuild_namespace(namespace_in)
+        if namespace is False:
+            return False
+        self.namespace = namespace
+        if isinstance(statements_in, dict):
+            tokens = {}
+            self.statements = arena.TermArena()
+            self.checkMap = arena.ArenaCheckMap(self.statements)
+            for statement in statements_in.values():
+                self.statements.append(rebuild_statement(statement, tokens))
+                statement = self.statements[-1]
+                if isinstance(statement, string_types):
+                    self.checkMap[statement] = statement
+                else:
+                    self.checkMap[statement.create_s_expression()] = statement
+        self.parses.clear()
+        if self.versions is not None:
+            self.versions.publish()
+        return True
+
     def add_statement(self, statement):
         """
         Given a statement, attempts to parse the statement into the DCEC*. If there's an issue,
@@ -68,128 +365,421 @@ class DCECContainer:
         :param statement:
         :return:
         """
-        add_atomics = {}
-        add_functions = {}
-        add_quants = {}
-        addee = statement
-        if isinstance(addee, string_types):
-            addee, add_quants, \
-             add_atomics, add_functions = high_level_parsing.tokenize_random_dcec(addee,
-                                                                                  self.namespace)
-            if isinstance(addee, bool) and not addee:
-                print("ERROR: the statement " + str(statement) + " was not correctly formed.")
-                return False
-            elif addee == "":
-                return True
-        elif isinstance(addee, high_level_parsing.Token):
-            pass
-        else:
-            print("ERROR: the input " + str(statement) + " was not of the correct type.")
+        code, parsed = self.parse_statement(statement)
+        if code == MALFORMED:
+            messages.report("ERROR: the statement " + str(statement) + " was not correctly formed.")
             return False
-        for atomic in add_atomics.keys():
-            # Tokens are not currently stored
-            if isinstance(atomic, high_level_parsing.Token):
-                continue
-            for potentialtype in range(0, len(add_atomics[atomic])):
-                if (not self.namespace.no_conflict(add_atomics[atomic][0],
-                                                   add_atomics[atomic][potentialtype], 0)[0]) and \
-                        (not self.namespace.no_conflict(add_atomics[atomic][potentialtype],
-                                                        add_atomics[atomic][0], 0)[0]):
-                    print("ERROR: The atomic " + atomic + " cannot be both " +
-                          add_atomics[atomic][potentialtype] + " and " + add_atomics[atomic][0] +
-                          ". (This is caused by assigning different sorts to two atomics inline. "
-                          "Did you rely on the parser for sorting?)")
-                    return False
+        elif code == WRONG_TYPE:
+            messages.report("ERROR: the input " + str(statement) + " was not of the correct type.")
+            return False
+        elif code == EMPTY:
+            return True
+        message = high_level_parsing.check_additions(self.namespace, parsed[2], parsed[3])
+        if message:
+            messages.report("ERROR: " + message)
+            return False
+        added = self.commit_statement(*parsed)
+        if self.versions is not None:
+            self.versions.publish()
+        return added
+
+    def parse_statement(self, statement):
+        """
+        Parses a statement for add_statement without changing the namespace.
+
+        :param statement: string, Token or ArenaTerm, such as a statement of another container
+        :return: the result code (ACCEPTED, EMPTY, MALFORMED or WRONG_TYPE) and, if the code is
+                 ACCEPTED, the tuple of the token, add_quants, add_atomics and add_functions
+        """
+        if isinstance(statement, string_types):
+            parsed = self.parses.tokenize(statement, self.namespace, None, self.subexpressions)
+            if isinstance(parsed[0], bool) and not parsed[0]:
+                return MALFORMED, None
+            elif parsed[0] == "":
+                return EMPTY, None
+            return ACCEPTED, parsed
+        elif isinstance(statement, (high_level_parsing.Token, arena.ArenaTerm)):
+            return ACCEPTED, (statement, {}, {}, {})
+        return WRONG_TYPE, None
+
+    def parse_captured(self, statement):
+        """
+        Parses a statement as parse_statement does, but keeps what the parser reports about it
+        rather than printing it.
+
+        :param statement: string or Token
+        :return: the result code and parse from parse_statement, and what was reported
+        """
+        captured = messages.Capture()
+        with captured:
+            code, parsed = self.parse_statement(statement)
+        return code, parsed, captured.getvalue()
+
+    def commit_statement(self, addee, add_quants, add_atomics, add_functions):
+        """
+        Adds a parsed statement and what it adds to the namespace to the container, once
+        check_additions has found no conflict.
+
+        :param addee: Token or atomic
+        :param add_quants: quantifiers from tokenize_random_dcec
+        :param add_atomics: atomics from tokenize_random_dcec
+        :param add_functions: inline functions from tokenize_random_dcec
+        :return: True if the statement was added, False if the namespace refused what it adds
+        """
+        if self.journal is not None:
+            self.journal.record_namespace(self.namespace)
+        version = self.namespace.version
+        new_atomics = []
+        new_quants = {}
         for function in add_functions.keys():
             for item in add_functions[function]:
-                if item[0] == "?":
-                    print("ERROR: please define the returntype of the inline function " + function)
+                if not self.namespace.add_code_function(function, item[0], item[1]):
                     return False
-                else:
-                    self.namespace.add_code_function(function, item[0], item[1])
         for atomic in add_atomics.keys():
             # Tokens are not currently stored
             if isinstance(atomic, high_level_parsing.Token):
                 continue
-            elif atomic in self.namespace.atomics.keys():
-                if not self.namespace.no_conflict(self.namespace.atomics[atomic],
-                                                  add_atomics[atomic][0], 0)[0] and \
-                        not self.namespace.no_conflict(add_atomics[atomic][0],
-                                                       self.namespace.atomics[atomic], 0)[0]:
-                    print("ERROR: The atomic "+atomic+" cannot be both " + add_atomics[atomic][0] +
-                          " and " + self.namespace.atomics[atomic] + ".")
+            elif atomic not in self.namespace.atomics.keys():
+                if not self.namespace.add_code_atomic(atomic, add_atomics[atomic][0]):
                     return False
-            else:
-                self.namespace.add_code_atomic(atomic, add_atomics[atomic][0])
+                new_atomics.append((atomic, add_atomics[atomic][0]))
         for quant in add_quants.keys():
             if 'QUANT' in quant:
                 self.namespace.quant_map[quant] = add_quants[quant]
+                new_quants[quant] = add_quants[quant]
         self.statements.append(addee)
+        # The statement as the container keeps it, such as a view of its node in the arena
+        stored = self.statements[-1]
         if not isinstance(addee, string_types):
-            self.checkMap[addee.create_s_expression()] = addee
+            self.checkMap[addee.create_s_expression()] = stored
         else:
-            self.checkMap[addee] = addee
+            self.checkMap[addee] = stored
+        # Statements loaded since the index was last brought up to date are left to find_all
+        if self.symbols.source is self.statements and \
+                len(self.symbols) == len(self.statements) - 1:
+            self.symbols.add(addee)
+        if self.versions is not None:
+            self.versions.record(version, add_functions, new_atomics, new_quants)
+        if self.workers is not None:
+            self.workers.record(self.namespace, version,
+                                [name for name, _ in new_atomics] + list(add_functions))
+        if self.journal is not None:
+            self.journal.record_statement(self, addee, add_functions, new_atomics, new_quants)
+            if self.journal.size() > self.journal.limit:
+                self.checkpoint()
         return True
 
-    def sort_of(self, statement):
-        if isinstance(statement, string_types):
-            return self.namespace.atomics.get(statement)
-        if statement is None:
-            return None
-        if statement.function_name not in self.namespace.functions.keys():
-            return None
-        tmp_func = statement.function_name
-        tmp_args = statement.args
-        tmp_types = []
-        for arg in tmp_args:
-            tmp_types.append(self.sort_of(arg))
-        for x in self.namespace.functions[tmp_func]:
-            if len(x[1]) != len(tmp_types):
-                continue
+    def add_statements(self, statements, errors=None, processes=None, chunksize=256,
+                       warnings=None):
+        """
+        Adds many statements at once. Unlike add_statement, nothing is printed: the reason a
+        statement cannot be added is put in errors, and what the parser warns about in warnings.
+        A statement that is already in the container is not added again.
+
+        What the statements add to the namespace is only added when a later statement needs it,
+        or at the end. A statement that uses a name an earlier statement of the batch adds is
+        parsed again once that name is in the namespace, so the statements end up as they would
+        if they were added one by one.
+
+        With processes, the statements are parsed on a pool of that many processes, which is
+        kept for the next batch (see parallel.WorkerPool and close_workers). The workers parse
+        against the namespace as it was when they were started. A statement that uses a name
+        added since keeps its parse only if it gave the name the sort the name was added with,
+        and is parsed again here otherwise.
+
+        >>> container = DCECContainer()
+        >>> container.namespace.add_basic_dcec()
+        >>> errors = {}
+        >>> list(container.add_statements(["Agent jack", "Moment jack", "Agent jack"], errors))
+        [0, -3, 1]
+        >>> errors[1]
+        'The atomic jack cannot be both Moment and Agent.'
+        >>> errors, warnings = {}, {}
+        >>> list(container.add_statements(["(Agent jack)", "B(jack,t,P(", "bad(jill)",
+        ...                                "B(jack, Time t2, holds(f, t1))"], errors,
+        ...                               warnings=warnings))
+        [1, -1, -1, 0]
+        >>> errors[1], errors[2]
+        ('parentheses mismatch error.', 'token "jill" is of an unknown type. Please type it.')
+        >>> warnings
+        {3: ['replaced the common mispelling Time with the correct name of Moment']}
+
+        :param statements: iterable of strings or Tokens
+        :param errors: dict to put the error message of every statement that was not added in,
+                       by its position in statements
+        :param processes: number of processes to parse on, or None to parse in this one
+        :param chunksize: number of statements sent to a process at a time
+        :param warnings: dict to put the list of warnings the parser gave about each statement
+                         in, by its position in statements
+        :return: array of a result code (ACCEPTED, DUPLICATE, EMPTY, MALFORMED, WRONG_TYPE or
+                 CONFLICT) for each statement
+        """
+        results = array("b")
+        # Parsed statements whose additions are not in the namespace yet, and the names they add
+        pending = []
+        pending_names = set()
+        pending_keys = set()
+        if processes is None:
+            parses = self.parse_each(statements)
+            # Only the names of the pending statements were not there when a statement was parsed
+            stale_names = pending_names
+        else:
+            if self.workers is None:
+                self.workers = parallel.WorkerPool()
+            # The names added since the workers were started were not there either
+            stale_names = self.workers.start(self.namespace, processes)
+            parses = self.workers.parse_statements(self, statements, chunksize)
+        for index, (statement, counter, code, parsed, checked, output) in enumerate(parses):
+            if not stale_names:
+                used = ()
+            elif code == ACCEPTED:
+                used = stale_names.intersection(parsed[2]) | stale_names.intersection(parsed[3])
+            elif isinstance(statement, string_types):
+                used = stale_names.intersection(lexer.lex(statement, self.namespace.operators) or
+                                                [])
             else:
-                returner = True
-                for r in range(0, len(x[1])):
-                    if not tmp_types[r] is None and self.namespace.no_conflict(tmp_types[r], x[1][r], 0)[0]:
-                        continue
-                    else:
-                        returner = False
-                        break
-                if returner:
-                    return x[0]
+                used = ()
+            if used:
+                # It was parsed without names that earlier statements of the batch add
+                self.commit_pending(pending, results, errors, warnings)
+                pending_names.clear()
+                pending_keys.clear()
+                atomics = self.namespace.atomics
+                if processes is None or code != ACCEPTED or \
+                        not all(name not in parsed[3] and
+                                all(sort == atomics.get(name) for sort in parsed[2].get(name, []))
+                                for name in used):
+                    if counter is not None:
+                        self.namespace.quant_map["TEMP"] = counter
+                    code, parsed, output = self.parse_captured(statement)
+                checked = False
+            if warnings is not None:
+                found = messages.find(output, "WARNING")
+                if found:
+                    warnings[index] = found
+            if code == ACCEPTED:
+                key = parsed[0]
+                if not isinstance(key, string_types):
+                    key = key.create_s_expression()
+                # A statement that uses what a pending statement adds was parsed again above, once
+                # that was in the namespace, so it is checked against it here. Only a statement
+                # without conflicts is a duplicate, as add_statement would have refused it too.
+                message = ""
+                if not checked:
+                    message = high_level_parsing.check_additions(self.namespace, parsed[2],
+                                                                  parsed[3])
+                if message:
+                    code = CONFLICT
+                    if errors is not None:
+                        errors[index] = message
+                elif key in self.checkMap or key in pending_keys:
+                    code = DUPLICATE
                 else:
-                    continue
-        return None
+                    pending.append((index, parsed))
+                    pending_keys.add(key)
+                    names = [atomic for atomic in parsed[2]
+                             if not isinstance(atomic, high_level_parsing.Token) and
+                             atomic not in self.namespace.atomics]
+                    names.extend(parsed[3])
+                    pending_names.update(names)
+                    if processes is not None:
+                        stale_names.update(names)
+            elif errors is not None and code == MALFORMED:
+                # The first error the parser found is the reason
+                found = messages.find(output)
+                errors[index] = found[0] if found else \
+                    "the statement " + str(statement) + " was not correctly formed."
+            elif errors is not None and code == WRONG_TYPE:
+                errors[index] = "the input " + str(statement) + " was not of the correct type."
+            results.append(code)
+        self.commit_pending(pending, results, errors, warnings)
+        if self.versions is not None:
+            self.versions.publish()
+        return results
 
-    def sorts_of_params(self, statement):
-        sorts = []
-        if isinstance(statement, string_types):
-            return sorts
-        if statement is None:
-            return None
-        if statement.function_name not in self.namespace.functions.keys():
-            return None
-        tmp_func = statement.function_name
-        tmp_args = statement.args
-        tmp_types = []
-        for arg in tmp_args:
-            tmp_types.append(self.sort_of(arg))
-        for x in self.namespace.functions[tmp_func]:
-            if len(x[1]) != len(tmp_types):
+    def commit_pending(self, pending, results, errors, warnings=None):
+        """
+        Adds the statements add_statements has held back. A statement whose additions the
+        namespace refuses is not added, and its result becomes CONFLICT.
+
+        :param pending: list of the position of each statement and its parse, emptied here
+        :param results: array of the result codes of add_statements
+        :param errors: dict of error messages by position, or None
+        :param warnings: dict of lists of warnings by position, or None
+        """
+        for index, parsed in pending:
+            captured = messages.Capture()
+            with captured:
+                added = self.commit_statement(*parsed)
+            output = captured.getvalue()
+            if warnings is not None and messages.find(output, "WARNING"):
+                warnings.setdefault(index, []).extend(messages.find(output, "WARNING"))
+            if added:
                 continue
-            else:
-                returner = True
-                for r in range(0, len(x[1])):
-                    if not tmp_types[r] is None and \
-                            self.namespace.no_conflict(tmp_types[r], x[1][r], 0)[0]:
-                        continue
-                    else:
-                        returner = False
-                        break
-                if returner:
-                    return x[1]
-                else:
-                    continue
-        return None
+            results[index] = CONFLICT
+            if errors is not None:
+                errors[index] = " ".join(messages.find(output))
+        del pending[:]
+
+    def parse_each(self, statements):
+        """
+        Parses statements one after another, for add_statements.
+
+        :param statements: iterable of strings or Tokens
+        :return: iterator of a tuple for each statement of the statement, the quantifier counter
+                 before it was parsed, its result code and parse from parse_statement, False,
+                 since what it adds still has to be checked, and what the parser reported
+        """
+        for statement in statements:
+            counter = self.namespace.quant_map.get("TEMP")
+            code, parsed, output = self.parse_captured(statement)
+            yield statement, counter, code, parsed, False, output
+
+    def ingest(self, source, chunksize=1024, processes=None):
+        """
+        Adds the statements of a file or iterable as add_statements does, a chunk at a time, as
+        they are read. Only one chunk of statements is held at once, however long the source is.
+        Nothing is read or added until the iterator is iterated, and each chunk is added before
+        its progress is given.
+
+        :param source: name of a file of statements, a file object or an iterable, see
+                       read_statements
+        :param chunksize: number of statements added at a time
+        :param processes: number of processes each chunk is parsed on, see add_statements. The
+                          same processes parse every chunk, until close_workers.
+        :return: iterator of a tuple for each chunk of the line number of its last statement, the
+                 result code of each of its statements, and a list of the line number,
+                 statement, result code and error message of each statement that was not added
+        """
+        statements = read_statements(source)
+        while True:
+            chunk = list(itertools.islice(statements, chunksize))
+            if not chunk:
+                return
+            failed = {}
+            codes = self.add_statements([statement for _, statement in chunk], failed,
+                                        processes)
+            errors = [(chunk[index][0], chunk[index][1], codes[index], failed[index])
+                      for index in sorted(failed)]
+            yield chunk[-1][0], codes, errors
+
+    def find_all(self, symbols):
+        """
+        Finds the statements that have every one of the symbols, looking only at the statements
+        that have the rarest of them.
+
+        :param symbols: iterable of names of agents, atomics or functions, or of tuples of a name,
+                        the function it is an arg of and which arg it is (see
+                        symbol_index.SymbolIndex.places), such as ("james", "B", 0)
+        :return: list of the statements, in the order they were added
+        """
+        self.symbols.update(self.statements)
+        return [self.statements[place] for place in self.symbols.match_all(symbols)]
+
+    def find_any(self, symbols):
+        """
+        Finds the statements that have any of the symbols.
+
+        :param symbols: iterable of symbols, as for find_all
+        :return: list of the statements, in the order they were added
+        """
+        self.symbols.update(self.statements)
+        return [self.statements[place] for place in self.symbols.match_any(symbols)]
+
+    def enable_versions(self):
+        """
+        Starts publishing read-only versions of the container, so that other threads can read it
+        while this one adds statements. A version is published after every add_statement,
+        add_statements and load, and pin gets the latest one. Changes made straight to the
+        namespace are in the versions published after the next statement, or after publish.
+
+        :return: the first ContainerVersion
+        """
+        if self.versions is None:
+            self.versions = Versions(self)
+        return self.versions.publish()
+
+    def publish(self):
+        """
+        Publishes a version of the container as it is now, see enable_versions.
+
+        :return: the new ContainerVersion, or False if versions are not enabled
+        """
+        if self.versions is None:
+            messages.report("ERROR: the container does not publish versions, see enable_versions.")
+            return False
+        return self.versions.publish()
+
+    def pin(self):
+        """
+        Gets the latest version of the container. The version never changes, so it can be read
+        without locks, and getting it never waits for the thread that adds statements.
+
+        :return: ContainerVersion, or None if versions are not enabled
+        """
+        versions = self.versions
+        if versions is None:
+            return None
+        return versions.current
+
+    def open_journal(self, filename, sync=False):
+        """
+        Keeps the container on disk as it grows: the container saved to filename + ".dcec", and
+        every statement added since in the journal filename + ".journal". Adding a statement only
+        appends it to the journal, and once the journal is larger than the saved container the
+        container is saved again and the journal emptied. Whatever was saved and journaled is
+        loaded first, so opening the same filename again picks up where the last container left off,
+        even if it crashed.
+
+        :param filename:
+        :param sync: if True, every statement is forced to disk before add_statement returns
+        :return: True if the journal was opened, False otherwise
+        """
+        saved = os.path.exists(filename + ".dcec")
+        if saved and not self.load(filename):
+            return False
+        journal = snapshot.Journal(filename + ".journal", sync)
+        if journal.replay(self) is False:
+            return False
+        self.parses.clear()
+        self.journal = journal
+        self.journal_name = filename
+        if saved:
+            journal.limit = max(journal.limit, os.path.getsize(filename + ".dcec"))
+        else:
+            self.checkpoint()
+        return True
+
+    def checkpoint(self):
+        """
+        Saves the container and empties its journal.
+
+        :return: True if the container was saved, False otherwise
+        """
+        if self.journal is None:
+            messages.report("ERROR: the container has no journal, see open_journal.")
+            return False
+        self.save(self.journal_name)
+        self.journal.reset(self.namespace, os.path.getsize(self.journal_name + ".dcec"))
+        return True
+
+    def close_journal(self):
+        """
+        Records any changes made to the namespace since the last statement and closes the journal.
+        """
+        if self.journal is not None:
+            self.journal.record_namespace(self.namespace)
+            self.journal.close()
+            self.journal = None
+
+    def close_workers(self):
+        """
+        Stops the worker processes add_statements started to parse on, see parallel.WorkerPool.
+        They are started again by the next add_statements with processes.
+        """
+        if self.workers is not None:
+            self.workers.close()
+            self.workers = None
 
     def stupid_sort_define(self, sort, old_container):
         if sort in self.namespace.sorts.keys():
@@ -199,68 +789,76 @@ class DCECContainer:
                 self.stupid_sort_define(x, old_container)
             self.namespace.add_code_sort(sort, old_container.namespace.sorts[sort])
 
-    # TODO replace with iterator
     def stupid_loop(self, token, functions, atomics, old_container):
-        if isinstance(token, string_types):
-            if old_container.sort_of(token) is None:
-                self.stupid_sort_define(atomics[token][0], old_container)
-                self.namespace.add_code_atomic(token, atomics[token][0])
-            else:
-                self.stupid_sort_define(old_container.sort_of(token), old_container)
-                self.namespace.add_code_atomic(token, old_container.sort_of(token))
-        else:
-            if token.function_name in ["forAll", "exists"]:
-                pass
-            elif old_container.sort_of(token) is None:
-                arg_types = []
-                for arg in token.args:
-                    arg_types.append(atomics[arg][0])
-                if token in atomics.keys():
+        # Walk the tokens in pre-order with an explicit stack, so any depth works
+        stack = [token]
+        if not isinstance(token, string_types):
+            sorts = old_container.token_sorts(token)
+        while stack:
+            token = stack.pop()
+            if isinstance(token, string_types):
+                if old_container.sort_of(token) is None:
                     self.stupid_sort_define(atomics[token][0], old_container)
-                    for arg in arg_types:
-                        self.stupid_sort_define(arg, old_container)
-                    poss = []
-                    mapping = {}
-                    for func in old_container.namespace.functions[token.function_name]:
-                        deep = 0
-                        compat, depth = old_container.namespace.no_conflict(func[0],
-                                                                            atomics[token][0], 0)
-                        if not compat:
-                            continue
-                        else:
-                            deep += depth
-                        args = [atomics[arg][0] for arg in token.args]
-                        if len(args) != len(func[1]):
-                            continue
-                        for y in range(0, len(func[1])):
-                            compat, depth = old_container.namespace.no_conflict(args[y],
-                                                                                func[1][y], 0)
-                            deep += depth
-                        poss.append(deep)
-                        mapping[deep] = func
-                    final = mapping[min(poss)]
-                    self.namespace.add_code_function(token.function_name, final[0], final[1])
+                    self.namespace.add_code_atomic(token, atomics[token][0])
                 else:
-                    # This should never happen, but if it does make a new function
-                    for x in functions[token.function_name]:
-                        self.stupid_sort_define(x[0], old_container)
-                        for y in x[1]:
-                            self.stupid_sort_define(y, old_container)
-                        self.namespace.add_code_function(token.function_name, x[0], x[1])
+                    self.stupid_sort_define(old_container.sort_of(token), old_container)
+                    self.namespace.add_code_atomic(token, old_container.sort_of(token))
             else:
-                self.stupid_sort_define(old_container.sort_of(token), old_container)
-                for x in old_container.sorts_of_params(token):
-                    self.stupid_sort_define(x, old_container)
-                self.namespace.add_code_function(token.function_name, old_container.sort_of(token),
-                                                 old_container.sorts_of_params(token))
-            for arg in token.args:
-                self.stupid_loop(arg, functions, atomics, old_container)
+                if token.function_name in ["forAll", "exists"]:
+                    pass
+                elif sorts[id(token)] is None:
+                    arg_types = []
+                    for arg in token.args:
+                        arg_types.append(atomics[arg][0])
+                    if token in atomics.keys():
+                        self.stupid_sort_define(atomics[token][0], old_container)
+                        for arg in arg_types:
+                            self.stupid_sort_define(arg, old_container)
+                        poss = []
+                        mapping = {}
+                        for func in old_container.namespace.functions[token.function_name]:
+                            deep = 0
+                            compat, depth = old_container.namespace.no_conflict(func[0],
+                                                                                atomics[token][0], 0)
+                            if not compat:
+                                continue
+                            else:
+                                deep += depth
+                            args = [atomics[arg][0] for arg in token.args]
+                            if len(args) != len(func[1]):
+                                continue
+                            for y in range(0, len(func[1])):
+                                compat, depth = old_container.namespace.no_conflict(args[y],
+                                                                                    func[1][y], 0)
+                                deep += depth
+                            poss.append(deep)
+                            mapping[deep] = func
+                        final = mapping[min(poss)]
+                        self.namespace.add_code_function(token.function_name, final[0], final[1])
+                    else:
+                        # This should never happen, but if it does make a new function
+                        for x in functions[token.function_name]:
+                            self.stupid_sort_define(x[0], old_container)
+                            for y in x[1]:
+                                self.stupid_sort_define(y, old_container)
+                            self.namespace.add_code_function(token.function_name, x[0], x[1])
+                else:
+                    params = old_container.match_prototype(token.function_name, [
+                        old_container.sort_of(arg) if isinstance(arg, string_types)
+                        else sorts[id(arg)] for arg in token.args])[1]
+                    self.stupid_sort_define(sorts[id(token)], old_container)
+                    for x in params:
+                        self.stupid_sort_define(x, old_container)
+                    self.namespace.add_code_function(token.function_name, sorts[id(token)], params)
+                stack.extend(reversed(token.args))
 
     def tokenize(self, statement):
         if not isinstance(statement, string_types):
             return False
-        dcec_container = DCECContainer()
-        stuff = high_level_parsing.tokenize_random_dcec(statement, self.namespace)
+        # The new container starts from the same base, so the sorts and atomics already in the
+        # base are not defined in it again
+        dcec_container = DCECContainer(prototypes.Namespace(self.namespace.base))
+        stuff = self.parses.tokenize(statement, self.namespace, None, self.subexpressions)
         if isinstance(stuff[0], bool) and not stuff[0]:
             return False
         elif stuff[0] == "":
@@ -269,6 +867,193 @@ class DCECContainer:
         dcec_container.add_statement(statement)
         return dcec_container
 
+
+class ContainerVersion(ContainerReader):
+    """
+    A read-only version of a container, published by Versions. Nothing in it changes after it is
+    published, so any number of threads can read it while statements are added to the container.
+    """
+    def __init__(self, number, namespace, statements, checkMap):
+        # Versions of a container are numbered from 0, in the order they were published
+        self.number = number
+        self.namespace = namespace
+        self.statements = statements
+        self.checkMap = checkMap
+
+
+class StatementsView(Sequence):
+    """
+    The statements of a container up to a length. Statements are only ever appended to the list
+    the view reads, so the statements in the view stay as they are.
+    """
+    def __init__(self, statements, length):
+        self.statements = statements
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.statements[place] for place in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError("statement index out of range")
+        return self.statements[index]
+
+
+class CheckMapView(Mapping):
+    """
+    The checkMap of a version of a container, from the S expression of each statement to the
+    first place it was added at. Statements added after the version are left out.
+    """
+    def __init__(self, statements, first_index, length, distinct):
+        self.statements = statements
+        self.first_index = first_index
+        self.length = length
+        self.distinct = distinct
+
+    def __getitem__(self, key):
+        index = self.first_index.get(key)
+        if index is None or index >= self.length:
+            raise KeyError(key)
+        return self.statements[index]
+
+    def __contains__(self, key):
+        index = self.first_index.get(key)
+        return index is not None and index < self.length
+
+    def __iter__(self):
+        # Copied in one step, since the container may be adding keys
+        for key, index in list(self.first_index.items()):
+            if index < self.length:
+                yield key
+
+    def __len__(self):
+        return self.distinct
+
+
+class Versions(object):
+    """
+    Publishes read-only versions of a container, see DCECContainer.enable_versions.
+
+    The namespace of a version is made on top of a frozen copy of the namespace of the container,
+    with what statements added since the copy was made set on top of it. Publishing costs as much
+    as those additions, and the copy is made again once there are more than VERSION_CHANGES of
+    them (or the square root of twice the size of the copy, if that is more), or when the
+    namespace was changed other than by adding statements.
+    """
+    def __init__(self, container):
+        self.container = container
+        self.current = None
+        self.number = -1
+        # The frozen copy, the namespace it was copied from and the version the changes are up to
+        self.base = None
+        self.source = None
+        self.namespace_version = None
+        self.limit = VERSION_CHANGES
+        # What statements added to the namespace since the copy was made
+        self.functions = set()
+        self.atomics = {}
+        self.quants = {}
+        # The overloads the versions have resolved, shared by versions with the same functions
+        self.resolutions = {}
+        # The statements the versions read from, the first index of each S expression in them,
+        # how many different ones there are and how many statements the last version had
+        self.statements = None
+        self.first_index = {}
+        self.distinct = 0
+        self.length = 0
+
+    def record(self, version, functions, atomics, quants):
+        """
+        Note what adding a statement added to the namespace of the container.
+
+        :param version: version of the namespace before the statement was added
+        :param functions: names of the inline functions of the statement
+        :param atomics: list of the atomics the statement added, as pairs of name and sort
+        :param quants: quantifier names the statement added to the quant_map
+        """
+        if version != self.namespace_version:
+            # Changed some other way, so the next version needs a new copy
+            self.source = None
+            return
+        if functions:
+            self.functions.update(functions)
+            self.resolutions = {}
+        for name, sort in atomics:
+            self.atomics[name] = sort
+        self.quants.update(quants)
+        self.namespace_version = self.container.namespace.version
+
+    def copy_namespace(self, namespace):
+        """
+        Make the frozen copy of the namespace that versions are made on top of.
+
+        :param namespace: namespace of the container
+        """
+        self.base = namespace.copy().freeze()
+        self.source = namespace
+        self.namespace_version = namespace.version
+        self.functions = set()
+        self.atomics = {}
+        self.quants = {}
+        self.resolutions = {}
+        size = len(prototypes.local_dict(namespace.atomics)) + len(namespace.quant_map)
+        self.limit = max(VERSION_CHANGES, int(math.sqrt(2 * size)))
+
+    def publish(self):
+        """
+        Make a version of the container as it is now the current one.
+
+        :return: the new ContainerVersion
+        """
+        container = self.container
+        namespace = container.namespace
+        if namespace is not self.source or namespace.version != self.namespace_version or \
+                len(self.functions) + len(self.atomics) + len(self.quants) > self.limit:
+            self.copy_namespace(namespace)
+        version = prototypes.Namespace(self.base)
+        for name in self.functions:
+            version.functions.local[name] = list(namespace.functions[name])
+            version.overloads.local[name] = dict((arity, list(items)) for arity, items
+                                                 in namespace.overloads[name].items())
+            version.signatures.local[name] = set(namespace.signatures[name])
+        version.atomics.local.update(self.atomics)
+        version.quant_map = prototypes.Layer(self.base.quant_map)
+        version.quant_map.local.update(self.quants)
+        version.quant_map.local["TEMP"] = namespace.quant_map.get("TEMP", 0)
+        version.resolutions = self.resolutions
+        version.freeze()
+        statements = container.statements
+        if statements is not self.statements:
+            # The versions before keep the index of the old statements
+            self.statements = statements
+            self.first_index = {}
+            self.distinct = 0
+            self.length = 0
+        saved = len(statements.starts) if isinstance(statements, snapshot.SavedStatements) else 0
+        for index in range(self.length, len(statements)):
+            if index < saved:
+                # Read from the file rather than decoding the statement
+                key = statements.expressions[index]
+            else:
+                key = statements[index]
+                if not isinstance(key, string_types):
+                    key = key.create_s_expression()
+            if key not in self.first_index:
+                self.first_index[key] = index
+                self.distinct += 1
+        self.length = len(statements)
+        self.number += 1
+        self.current = ContainerVersion(self.number, version,
+                                        StatementsView(statements, self.length),
+                                        CheckMapView(statements, self.first_index, self.length,
+                                                     self.distinct))
+        return self.current
+
+
 if __name__ == "__main__":
     test = DCECContainer()
     test.namespace.add_basic_dcec()
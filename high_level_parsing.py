@@ -1,4 +1,10 @@
 from __future__ import print_function
+from collections import deque
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6 has no OrderedDict, the backport is installed there (see requirements.txt)
+    from ordereddict import OrderedDict
 from six import string_types
 from six.moves import input  # pylint: disable=locally-disabled,redefined-builtin
 
@@ -7,24 +13,158 @@ from six.moves import input  # pylint: disable=locally-disabled,redefined-builti
 try:
     import prototypes
     import cleaning
+    import lexer
+    import messages
 except ImportError:
     import DCEC_Library.prototypes as prototypes
     import DCEC_Library.cleaning as cleaning
+    import DCEC_Library.lexer as lexer
+    import DCEC_Library.messages as messages
+
+
+# Common spelling errors and the names they are replaced with
+SYNONYM_MAP = {
+    "ifAndOnlyIf": "iff",
+    "if": "implies",
+    "Time": "Moment",
+    "forall": "forAll",
+    "Forall": "forAll",
+    "ForAll": "forAll",
+    "Exists": "exists",
+}
 
+# Keywords the parser turns into functions on its own, even if the namespace does not define them
+INFIX_KEYWORDS = ["not", "and", "or", "xor", "implies", "iff", "negate", "exponent", "multiply",
+                  "divide", "add", "sub", "*", "-", "&", "|"]
 
-class Token:
+# How far validate_dcec checks a statement
+SYNTAX = "syntax"
+SYMBOLS = "symbols"
+SORTS = "sorts"
+
+# What adding a statement to a container did with it, see DCECContainer.add_statements. Errors are
+# negative. They are kept here so that the modules the container uses can give them too.
+ACCEPTED = 0
+DUPLICATE = 1
+EMPTY = 2
+MALFORMED = -1
+WRONG_TYPE = -2
+CONFLICT = -3
+
+
+class Token(object):
     """
     Parsed representation of a formal logic statement given its function name and then
     a list of arguments that make up the Token. We then use this for parsing as well as
-    for displaying representations of the formula in S and F form.
+    for displaying representations of the formula in S and F form. Tokens cannot be changed once
+    they are made, so their depth, width, hash and S and F expressions are worked out at most
+    once and then reused, by the token itself and by any token that has it as an arg. The
+    function name is kept in prototypes.SYMBOL_TABLE, and symbol is its id there.
+
+    >>> token = Token("and", [Token("P", ["x"]), "y"])
+    >>> isinstance(token.args, tuple)
+    True
+    >>> prototypes.SYMBOL_TABLE.name_of(token.symbol)
+    'and'
+    >>> token.create_s_expression()
+    '(and (P x) y)'
+    >>> token.args = []
+    Traceback (most recent call last):
+        ...
+    AttributeError: Token objects cannot be changed
     """
+    __slots__ = ["function_name", "symbol", "args", "depth", "width", "structural_hash",
+                 "s_expression", "f_expression"]
+
     def __init__(self, funcname, args):
-        self.function_name = funcname
-        self.args = args
-        self.depth = None
-        self.width = None
-        self.s_expression = None
-        self.f_expression = None
+        symbol = prototypes.SYMBOL_TABLE.id_of(funcname)
+        object.__setattr__(self, "function_name", prototypes.SYMBOL_TABLE.name_of(symbol))
+        object.__setattr__(self, "symbol", symbol)
+        object.__setattr__(self, "args", tuple(args))
+        for slot in ["depth", "width", "structural_hash", "s_expression", "f_expression"]:
+            object.__setattr__(self, slot, None)
+
+    @classmethod
+    def from_symbol(cls, function_name, symbol, args):
+        """
+        Make a token for a name that is already in prototypes.SYMBOL_TABLE without looking it up
+        again, for code that makes many tokens at once such as snapshot.load.
+
+        >>> symbol = prototypes.SYMBOL_TABLE.id_of("holds")
+        >>> Token.from_symbol("holds", symbol, ("f", "t1")).create_s_expression()
+        '(holds f t1)'
+
+        :param function_name: the name as kept in prototypes.SYMBOL_TABLE
+        :param symbol: id of the name in prototypes.SYMBOL_TABLE
+        :param args: tuple of args
+        :return: Token
+        """
+        token = object.__new__(cls)
+        # The slots are set through their descriptors, which is quicker than object.__setattr__
+        _SET_FUNCTION_NAME(token, function_name)
+        _SET_SYMBOL(token, symbol)
+        _SET_ARGS(token, args)
+        _SET_DEPTH(token, None)
+        _SET_WIDTH(token, None)
+        _SET_STRUCTURAL_HASH(token, None)
+        _SET_S_EXPRESSION(token, None)
+        _SET_F_EXPRESSION(token, None)
+        return token
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Token objects cannot be changed")
+
+    def __delattr__(self, name):
+        raise AttributeError("Token objects cannot be changed")
+
+    def __reduce__(self):
+        return Token, (self.function_name, self.args)
+
+    def preorder(self):
+        """
+        Iterate over this token and all of the tokens below it, each token before its args.
+        This uses an explicit stack, so it works on formulas of any depth.
+
+        :return: generator of tokens
+        """
+        stack = [self]
+        while stack:
+            token = stack.pop()
+            yield token
+            stack.extend(arg for arg in reversed(token.args) if not isinstance(arg, string_types))
+
+    def postorder(self, cached=None):
+        """
+        Iterate over this token and all of the tokens below it, each token after its args.
+        This uses an explicit stack, so it works on formulas of any depth.
+
+        :param cached: name of a cached attribute. If given, tokens that already have it are
+            left out, along with everything below them
+        :return: generator of tokens
+        """
+        stack = [(self, False)]
+        while stack:
+            token, expanded = stack.pop()
+            if expanded:
+                yield token
+                continue
+            if cached is not None and getattr(token, cached) is not None:
+                continue
+            stack.append((token, True))
+            stack.extend((arg, False) for arg in reversed(token.args)
+                         if not isinstance(arg, string_types))
+
+    def level_order(self):
+        """
+        Iterate over this token and all of the tokens below it, one level of depth at a time.
+
+        :return: generator of tokens
+        """
+        queue = deque([self])
+        while queue:
+            token = queue.popleft()
+            yield token
+            queue.extend(arg for arg in token.args if not isinstance(arg, string_types))
 
     def depth_of(self):
         """
@@ -33,14 +173,12 @@ class Token:
 
         :return: max depth of token
         """
-        temp = []
-        for arg in self.args:
-            if isinstance(arg, Token):
-                temp.append(arg)
-        if len(temp) == 0:
-            self.depth = 1
-        else:
-            self.depth = 1+max([x.depth_of() for x in temp])
+        for token in self.postorder("depth"):
+            temp = [arg.depth for arg in token.args if isinstance(arg, Token)]
+            if len(temp) == 0:
+                object.__setattr__(token, "depth", 1)
+            else:
+                object.__setattr__(token, "depth", 1+max(temp))
         return self.depth
 
     def width_of(self):
@@ -50,51 +188,96 @@ class Token:
 
         :return: width of token
         """
-        temp = 0
-        for arg in self.args:
-            if isinstance(arg, string_types):
-                temp += 1
-            else:
-                temp += arg.width_of()
-        self.width = temp
+        for token in self.postorder("width"):
+            temp = 0
+            for arg in token.args:
+                if isinstance(arg, string_types):
+                    temp += 1
+                else:
+                    temp += arg.width
+            object.__setattr__(token, "width", temp)
         return self.width
 
+    def hash_of(self):
+        """
+        Get a hash of the structure of this token, which is the same for any two tokens with the
+        same function name and args. Tokens still compare by identity, as the parser assigns
+        sorts to each use of a token on its own.
+
+        :return: hash of token
+        """
+        for token in self.postorder("structural_hash"):
+            temp = [token.symbol]
+            for arg in token.args:
+                if isinstance(arg, string_types):
+                    temp.append(arg)
+                else:
+                    temp.append(arg.structural_hash)
+            object.__setattr__(token, "structural_hash", hash(tuple(temp)))
+        return self.structural_hash
+
     def create_s_expression(self):
         """
-        Recursively create the S expression for this token. S expressions are of the
-        form (func_name arg1 arg2) where args could then be additional S expressions
+        Create the S expression for this token. S expressions are of the form
+        (func_name arg1 arg2) where args could then be additional S expressions
 
         :return: S expression representing this token
         """
-        self.s_expression = "(" + self.function_name + " "
-        for arg in self.args:
-            if isinstance(arg, string_types):
-                self.s_expression += arg + " "
-            else:
-                arg.create_s_expression()
-                self.s_expression += arg.s_expression + " "
-        self.s_expression = self.s_expression.strip()
-        self.s_expression += ")"
+        if self.s_expression is None:
+            object.__setattr__(self, "s_expression", self._render("S"))
         return self.s_expression
 
     def create_f_expression(self):
         """
-        Recursively create the F(unctional) expression for this token. F expressions are
-        of the form func_name(arg1, arg2) where args could be additional F expressions
+        Create the F(unctional) expression for this token. F expressions are of the form
+        func_name(arg1, arg2) where args could be additional F expressions
 
         :return: F expression representing this token
         """
-        self.f_expression = self.function_name + "("
-        for arg in self.args:
-            if isinstance(arg, string_types):
-                self.f_expression += arg + ","
-            else:
-                arg.create_f_expression()
-                self.f_expression += arg.f_expression + ","
-        self.f_expression = self.f_expression.strip(",")
-        self.f_expression += ")"
+        if self.f_expression is None:
+            object.__setattr__(self, "f_expression", self._render("F"))
         return self.f_expression
 
+    def _render(self, expression_type):
+        """
+        Write out this token in S or F form in one pass over the tree, joining the pieces once at
+        the end. Args that already have the expression are copied in whole. The expressions of
+        the other args are not kept, as keeping one for every token below this one would take
+        memory quadratic in the depth of the tree.
+
+        :param expression_type: "S" or "F"
+        :return: expression representing this token
+        """
+        if expression_type == "S":
+            separator, strip, cached = " ", None, "s_expression"
+        else:
+            separator, strip, cached = ",", ",", "f_expression"
+        pieces = []
+        # None marks the end of the args of a token
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, string_types):
+                pieces.append(item)
+            elif item is None:
+                # Drop the separators trailing the last arg
+                text = pieces.pop().rstrip(strip)
+                while not text:
+                    text = pieces.pop().rstrip(strip)
+                pieces.append(text + ")")
+            elif item is not self and getattr(item, cached) is not None:
+                pieces.append(getattr(item, cached))
+            else:
+                if expression_type == "S":
+                    pieces.append("(" + item.function_name + " ")
+                else:
+                    pieces.append(item.function_name + "(")
+                stack.append(None)
+                for arg in reversed(item.args):
+                    stack.append(separator)
+                    stack.append(arg)
+        return "".join(pieces)
+
     def print_tree(self):
         """
         Generate the S and F expression for the token, then print the F expression out
@@ -104,6 +287,115 @@ class Token:
         print(self.f_expression)
 
 
+_SET_FUNCTION_NAME = Token.function_name.__set__
+_SET_SYMBOL = Token.symbol.__set__
+_SET_ARGS = Token.args.__set__
+_SET_DEPTH = Token.depth.__set__
+_SET_WIDTH = Token.width.__set__
+_SET_STRUCTURAL_HASH = Token.structural_hash.__set__
+_SET_S_EXPRESSION = Token.s_expression.__set__
+_SET_F_EXPRESSION = Token.f_expression.__set__
+
+
+class TermStore(object):
+    """
+    Hash-consing store of tokens. Tokens with the same function name and args are kept once, so
+    a subterm used all over a knowledge base is one shared token, and tokens from the same store
+    are equal exactly when they are the same object. Tokens that are only being looked at, such
+    as those of a statement that was parsed but not added, can be made without keep, which
+    shares the tokens the store has but does not keep new ones.
+
+    >>> terms = TermStore()
+    >>> first = terms.make("action", ["jack", "heal"])
+    >>> first is terms.make("action", ["jack", "heal"])
+    True
+    >>> tree = Token("happens", [Token("action", ["jack", "heal"]), "t1"])
+    >>> terms.intern(tree).args[0] is first
+    True
+    >>> len(terms)
+    2
+    >>> terms.make("action", ["jill", "heal"], keep=False) in terms, len(terms)
+    (False, 2)
+    """
+    def __init__(self):
+        self.terms = {}
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, token):
+        return isinstance(token, Token) and \
+            self.terms.get((token.function_name,) + token.args) is token
+
+    def make(self, funcname, args, keep=True):
+        """
+        Get the token for a function name and args, making it if the store does not have it yet.
+
+        :param funcname: function name of the token
+        :param args: args of the token, which are strings or tokens from this store
+        :param keep: if False, a token the store does not have is made but not kept
+        :return: token from this store
+        """
+        key = (funcname,) + tuple(args)
+        token = self.terms.get(key)
+        if token is None:
+            token = Token(funcname, args)
+            if keep:
+                self.terms[key] = token
+        return token
+
+    def update(self, tokens):
+        """
+        Keep tokens that were made without the store, such as those read from a file, in place
+        of any the store has with the same structure. Their args have to be strings or tokens from
+        the store or from tokens, and no two of them can have the same structure.
+
+        :param tokens: iterable of tokens
+        """
+        self.terms.update(((token.function_name,) + token.args, token) for token in tokens)
+
+    def intern(self, token, mapping=None, keep=True):
+        """
+        Swap every token in a tree for the one this store has with the same structure, adding
+        the ones it does not have yet. Tokens that are new to the store are kept rather than
+        copied when their args are already from the store.
+
+        :param token: token to intern, or a string, which is returned as is
+        :param mapping: dict to fill in with the token from the store for each token in the tree
+        :param keep: if False, tokens the store does not have are not added to it, though they
+                     are still made of the tokens it does have
+        :return: token from this store
+        """
+        if isinstance(token, string_types):
+            return token
+        if mapping is None:
+            mapping = {}
+        # Work up from the leaves with an explicit stack, so that args are interned first
+        stack = [(token, False)]
+        while stack:
+            item, expanded = stack.pop()
+            if item in mapping:
+                continue
+            if item in self:
+                mapping[item] = item
+                continue
+            if not expanded:
+                stack.append((item, True))
+                stack.extend((arg, False) for arg in item.args
+                             if not isinstance(arg, string_types))
+                continue
+            args = tuple(arg if isinstance(arg, string_types) else mapping[arg]
+                         for arg in item.args)
+            key = (item.function_name,) + args
+            interned = self.terms.get(key)
+            if interned is None:
+                interned = item if args == item.args else Token(item.function_name, args)
+                if keep:
+                    self.terms[key] = interned
+            mapping[item] = interned
+        return mapping[token]
+
+
 def remove_comments(expression):
     """
     Remove any comments from an expression. This is defined as anything after a ';' mark in the
@@ -120,36 +412,24 @@ def remove_comments(expression):
     return expression
 
 
-def functorize_symbols(expression):
+def functorize_symbols(expression, operators=None):
     """
     This function replaces all symbols with the appropreate internal funciton name.
     Some symbols are left untouched, these symbols have multiple interpretations in the DCEC
     syntax. For example, the symbol * can represent both multiplication and the self operator.
+    The symbols come from the operator table of a namespace, which is scanned once over the
+    expression, always taking the longest symbol that matches.
+
+    >>> functorize_symbols("(a <-> b) -> c")
+    '(a  ifAndOnlyIf  b)  implies  c'
+
+    :param expression: expression to replace the symbols of
+    :param operators: lexer.OperatorTable to use, defaults to the DCEC* symbols
+    :return: the expression with every symbol replaced by its function name
     """
-    symbols = ["^", "*", "/", "+", "<->", "->", "-", "&", "|", "~", ">=", "==", "<=", "===", "=",
-               ">", "<"]
-    symbol_map = {
-        "^": "exponent",
-        "*": "*",
-        "/": "divide",
-        "+": "add",
-        "-": "-",
-        "&": "&",
-        "|": "|",
-        "~": "not",
-        "->": "implies",
-        "<->": "ifAndOnlyIf",
-        ">": "greater",
-        "<": "less",
-        ">=": "greaterOrEqual",
-        "<=": "lessOrEqual",
-        "=": "equals",
-        "==": "equals",
-        "===": "tautology",
-    }
-    returner = expression
-    for symbol in symbols:
-        returner = returner.replace(symbol, " " + symbol_map[symbol] + " ")
+    if operators is None:
+        operators = lexer.DEFAULT_OPERATORS
+    returner = operators.replace(expression)
     returner = returner.replace("( ", "(")
     return returner
 
@@ -176,35 +456,70 @@ def replace_synonyms(args):
     :param args: either a list of arguments to convert or a string to convert based on synomyn map
     :return: parsed args that has all common mispellings replaced
     """
-    synonym_map = {
-        "ifAndOnlyIf": "iff",
-        "if": "implies",
-        "Time": "Moment",
-        "forall": "forAll",
-        "Forall": "forAll",
-        "ForAll": "forAll",
-        "Exists": "exists",
-    }
+    synonym_map = SYNONYM_MAP
     if not isinstance(args, list):
         args = str(args)
         if args in synonym_map:
-            print("WARNING: replaced the common mispelling %s with the correct name of %s" %
-                  (args, synonym_map[args]))
+            messages.report(
+                "WARNING: replaced the common mispelling %s with the correct name of %s" %
+                (args, synonym_map[args]))
             args = synonym_map[args]
     else:
         args = [str(arg) for arg in args]
         for arg in range(0, len(args)):
             if args[arg] in synonym_map:
-                print("WARNING: replaced the common mispelling %s with the correct "
-                      "name of %s" % (args[arg], synonym_map[args[arg]]))
+                messages.report("WARNING: replaced the common mispelling %s with the correct "
+                                "name of %s" % (args[arg], synonym_map[args[arg]]))
                 args[arg] = synonym_map[args[arg]]
     return args
 
 
+def fold_infix(args, word, sort, add_atomics):
+    """
+    Tucks every infix use of a binary keyword into a token in one left-to-right pass, giving
+    the args of the token the sort the keyword takes. Stops at the first use of the keyword
+    that has nothing to its left, as that is prefix notation anyway. Returns False if a use of
+    the keyword has nothing to its right.
+
+    >>> fold_infix(["a", "and", "b", "and", "c"], "and", "Boolean", {})[0].create_s_expression()
+    '(and (and a b) c)'
+    """
+    folded = []
+    index = 0
+    while index < len(args):
+        if args[index] != word:
+            folded.append(args[index])
+            index += 1
+            continue
+        # If the thing is actually prefix anyway > twitch <
+        if not folded:
+            return args[index:]
+        if index + 1 == len(args):
+            messages.report("ERROR: \"" + word + "\" is missing the argument to its right.")
+            return False
+        # Tucks the expression into a token
+        in1 = folded.pop()
+        in2 = args[index+1]
+        new_token = Token(word, [in1, in2])
+        # Assign sorts to the atomics used
+        if in1 in add_atomics.keys():
+            add_atomics[in1].append(sort)
+        else:
+            add_atomics[in1] = [sort]
+        if in2 in add_atomics.keys():
+            add_atomics[in2].append(sort)
+        else:
+            add_atomics[in2] = [sort]
+        # Replace the args used in the token with the token
+        folded.append(new_token)
+        index += 2
+    return folded
+
+
 def prefix_logical_functions(args, add_atomics):
     """
     This function turns infix notation into prefix notation. It assumes standard
-    logical order of operations.
+    logical order of operations. Returns False if an operation is missing an argument.
     """
     logic_keywords = ["not", "and", "or", "xor", "implies", "iff"]
     # Checks for infix notation
@@ -218,12 +533,16 @@ def prefix_logical_functions(args, add_atomics):
     # left-to-right throughout the parser.
     for arg in range(0, len(args)):
         if args[arg] == "not" and arg+2 < len(args) and not args[arg+1] in logic_keywords:
-            print("WARNING: ambiguous not statement. This parser assumes standard order of "
-                  "logical operations. Please use prefix notation or parentheses to resolve "
-                  "this ambiguity.")
+            messages.report(
+                "WARNING: ambiguous not statement. This parser assumes standard order of "
+                "logical operations. Please use prefix notation or parentheses to resolve "
+                "this ambiguity.")
     for word in logic_keywords:
         while word in args:
             index = args.index(word)
+            if index + 1 == len(args):
+                messages.report("ERROR: \"" + word + "\" is missing the argument to its right.")
+                return False
             if word == "not":
                 new_token = Token(word, [args[index+1]])
                 # Assign sorts to the atomics used
@@ -235,32 +554,17 @@ def prefix_logical_functions(args, add_atomics):
                 args = args[:index+1]+args[index+2:]
                 args[index] = new_token
                 break
-            in1 = index-1
-            in2 = index+1
-            # If the thing is actually prefix anyway > twitch <
-            if in1 < 0:
-                break
-            # Tucks the arithmetic expression into a token
-            new_token = Token(word, [args[in1], args[in2]])
-            # Assign sorts to the atomics used
-            if args[in1] in add_atomics.keys():
-                add_atomics[args[in1]].append("Boolean")
-            else:
-                add_atomics[args[in1]] = ["Boolean"]
-            if args[in2] in add_atomics.keys():
-                add_atomics[args[in2]].append("Boolean")
-            else:
-                add_atomics[args[in2]] = ["Boolean"]
-            # Replace the args used in the token with the token
-            args = args[:in1]+args[in2:]
-            args[in1] = new_token
+            args = fold_infix(args, word, "Boolean", add_atomics)
+            if args is False:
+                return False
+            break
     return args
 
 
 def prefix_emdas(args, add_atomics):
     """
     This function turns infix notation into a tokenized prefix notation using the standard
-    PEMDAS order of operations.
+    PEMDAS order of operations. Returns False if an operation is missing an argument.
     """
     arithmetic_keywords = ["negate", "exponent", "multiply", "divide", "add", "sub"]
     # Checks for infix notation
@@ -274,6 +578,9 @@ def prefix_emdas(args, add_atomics):
     for word in arithmetic_keywords:
         while word in args:
             index = args.index(word)
+            if index + 1 == len(args):
+                messages.report("ERROR: \"" + word + "\" is missing the argument to its right.")
+                return False
             if word == "negate":
                 new_token = Token(word, [args[index+1]])
                 # Assign sorts to the atomics used
@@ -285,25 +592,10 @@ def prefix_emdas(args, add_atomics):
                 args = args[:index+1]+args[index+2:]
                 args[index] = new_token
                 continue
-            in1 = index-1
-            in2 = index+1
-            # If it mixes both forms > twitch <
-            if in1 < 0:
-                break
-            # Tucks the arithmetic expression into a token
-            new_token = Token(word, [args[in1], args[in2]])
-            # Assign sorts to the atomics used
-            if args[in1] in add_atomics.keys():
-                add_atomics[args[in1]].append("Numeric")
-            else:
-                add_atomics[args[in1]] = ["Numeric"]
-            if args[in2] in add_atomics.keys():
-                add_atomics[args[in2]].append("Numeric")
-            else:
-                add_atomics[args[in2]] = ["Numeric"]
-            # Replace the args used in the token with the token
-            args = args[:in1] + args[in2:]
-            args[in1] = new_token
+            args = fold_infix(args, word, "Numeric", add_atomics)
+            if args is False:
+                return False
+            break
     return args
 
 
@@ -316,16 +608,18 @@ def assign_types(args, namespace, add_atomics, add_functions):
     for arg in range(0, len(args)):
         if args[arg] in namespace.sorts.keys():
             if arg+1 == len(args):
-                print("ERROR: Cannot find something to attach the sort \""+args[arg]+"\". "
-                      "Cannot overload sorts.")
+                messages.report(
+                    "ERROR: Cannot find something to attach the sort \""+args[arg]+"\". "
+                    "Cannot overload sorts.")
                 return False
             elif args[arg+1] in namespace.sorts.keys() or \
                             args[arg+1] in namespace.functions.keys():
-                print("ERROR: Cannot assign inline types to basicTypes, keywords, or function "
-                      "names")
+                messages.report(
+                    "ERROR: Cannot assign inline types to basicTypes, keywords, or function "
+                    "names")
                 return False
             elif isinstance(args[arg+1], Token):
-                name = args[arg+1].funcName
+                name = args[arg+1].function_name
                 inargs = []
                 for x in args[arg+1].args:
                     if x in namespace.atomics.keys():
@@ -333,24 +627,21 @@ def assign_types(args, namespace, add_atomics, add_functions):
                     elif x in add_atomics.keys():
                         inargs.append(add_atomics[x][0])
                     else:
-                        print("ERROR: token \""+str(x)+"\" has an unknown type. Please type it.")
+                        messages.report(
+                            "ERROR: token \""+str(x)+"\" has an unknown type. Please type it.")
                         return False
                 if name in add_functions.keys():
                     for item in add_functions[name]:
                         if inargs == item[1]:
                             if item[0] == "?":
                                 item[0] = args[arg]
-                            elif item[0] == args[arg]:
-                                continue
-                            else:
-                                print("ERROR: A function cannot have two different returntypes")
+                            elif item[0] != args[arg]:
+                                messages.report(
+                                    "ERROR: A function cannot have two different returntypes")
                                 return False
-                        else:
-                            new_item = [name, inargs]
-                            if name in add_functions.keys():
-                                add_functions[name].append(new_item)
-                            else:
-                                add_functions[name] = [new_item]
+                            break
+                    else:
+                        add_functions[name].append([args[arg], inargs])
             else:
                 add_atomics[args[arg + 1]] = [args[arg]]
     # Remove the types from the expression
@@ -388,8 +679,8 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
                 elif namespace.atomics[args[arg-1]] == "Numeric":
                     args[arg] = "multiply"
                 else:
-                    print("ERROR: keyword * does not take atomic arguments of type: " +
-                          namespace.atomics[args[arg-1]])
+                    messages.report("ERROR: keyword * does not take atomic arguments of type: " +
+                                    namespace.atomics[args[arg-1]])
                     return False
             elif args[arg-1] in add_atomics.keys():
                 if add_atomics[args[arg-1]][0] == "Agent":
@@ -398,12 +689,13 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
                 elif add_atomics[args[arg-1]][0] == "Numeric":
                     args[arg] = "multiply"
                 else:
-                    print("ERROR: keyword * does not take atomic arguments of type: " +
-                          add_atomics[args[arg - 1]][0])
+                    messages.report("ERROR: keyword * does not take atomic arguments of type: " +
+                                    add_atomics[args[arg - 1]][0])
                     return False
             else:
-                print("ERROR: ambiguous keyword * can be either self or multiply, please set the "
-                      "types of your atomics and use parentheses.")
+                messages.report(
+                    "ERROR: ambiguous keyword * can be either self or multiply, please set the "
+                    "types of your atomics and use parentheses.")
                 return False
         if args[arg] == "-":
             if arg == 0:
@@ -413,8 +705,9 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
                     args[arg] = "negate"
                 elif len(args) > arg+1 and args[arg+1] in namespace.atomics.keys():
                     if namespace.atomics[args[arg+1]] != "Numeric":
-                        print("ERROR: - keyword does not take " + namespace.atomics[args[arg+1]] +
-                              " arguments.")
+                        messages.report(
+                            "ERROR: - keyword does not take " + namespace.atomics[args[arg+1]] +
+                            " arguments.")
                         return False
                     else:
                         args[arg] = "sub"
@@ -423,8 +716,9 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
                     args[arg] = "negate"
                 elif len(args) > arg+1 and args[arg+1] in add_atomics.keys():
                     if add_atomics[args[arg+1]][0] != "Numeric":
-                        print("ERROR: - keyword does not take " + add_atomics[args[arg + 1]][0] +
-                              " arguments.")
+                        messages.report(
+                            "ERROR: - keyword does not take " + add_atomics[args[arg + 1]][0] +
+                            " arguments.")
                         return False
                     else:
                         args[arg] = "sub"
@@ -433,8 +727,9 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
             elif args[arg-1] in add_functions.keys():
                 args[arg] = "negate"
             else:
-                print("ERROR: keyword - can be either sub or negate, please add types, or use "
-                      "the sub or negate keywords")
+                messages.report(
+                    "ERROR: keyword - can be either sub or negate, please add types, or use "
+                    "the sub or negate keywords")
                 return False
         if args[arg] == "&":
             if arg+1 < len(args) and args[arg+1] in namespace.atomics.keys():
@@ -443,8 +738,9 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
                 elif namespace.atomics[args[arg+1]] == "Set":
                     args[arg] = "union"
                 else:
-                    print("ERROR: keyword & does not take "+namespace.atomics[args[arg+1]] +
-                          " arguments")
+                    messages.report(
+                        "ERROR: keyword & does not take "+namespace.atomics[args[arg+1]] +
+                        " arguments")
                     return False
             elif arg+1 < len(args) and args[arg+1] in add_atomics.keys():
                 if add_atomics[args[arg+1]][0] == "Boolean":
@@ -452,12 +748,14 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
                 elif add_atomics[args[arg+1]][0] == "Set":
                     args[arg] = "union"
                 else:
-                    print("ERROR: keyword & does not take " + add_atomics[args[arg + 1]][0] +
-                          " arguments")
+                    messages.report(
+                        "ERROR: keyword & does not take " + add_atomics[args[arg + 1]][0] +
+                        " arguments")
                     return False
             else:
-                print("ERROR: keyword & can be either union or and, please add types, or use the "
-                      "and or union keyword.")
+                messages.report(
+                    "ERROR: keyword & can be either union or and, please add types, or use the "
+                    "and or union keyword.")
                 return False
         if args[arg] == "|":
             if arg+1 < len(args) and args[arg+1] in namespace.atomics.keys():
@@ -466,8 +764,9 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
                 elif namespace.atomics[args[arg+1]] == "Set":
                     args[arg] = "intersection"
                 else:
-                    print("ERROR: keyword | does not take "+namespace.atomics[args[arg+1]] +
-                          " arguments")
+                    messages.report(
+                        "ERROR: keyword | does not take "+namespace.atomics[args[arg+1]] +
+                        " arguments")
                     return False
             elif arg+1 < len(args) and args[arg+1] in add_atomics.keys():
                 if add_atomics[args[arg+1]][0] == "Boolean":
@@ -475,12 +774,13 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
                 elif add_atomics[args[arg+1]][0] == "Set":
                     args[arg] = "intersection"
                 else:
-                    print("ERROR: keyword | does not take " + add_atomics[args[arg + 1]][0] +
-                          " arguments")
+                    messages.report(
+                        "ERROR: keyword | does not take " + add_atomics[args[arg + 1]][0] +
+                        " arguments")
                     return False
             else:
-                print("ERROR: keyword | can be either union or and, please add types, or "
-                      "use the or or intersect keyword.")
+                messages.report("ERROR: keyword | can be either union or and, please add types, or "
+                                "use the or or intersect keyword.")
                 return False
     return True
 
@@ -488,8 +788,9 @@ def distinguish_functions(args, namespace, add_atomics, add_functions):
 def check_prenex(args, add_quants):
     for arg in args:
         if arg in add_quants.keys() and 'QUANT' not in arg:
-            print("WARNING: not using prenex form. This may cause an error if improperly handled. "
-                  "Use prenex form and make sure that your quantifiers are unique.")
+            messages.report(
+                "WARNING: not using prenex form. This may cause an error if improperly handled. "
+                "Use prenex form and make sure that your quantifiers are unique.")
 
 
 def next_internal(namespace):
@@ -511,7 +812,7 @@ def pop_quantifiers(args, highlevel, sublevel, namespace, quantifiers, add_quant
     """
     This function removes all quantifiers from the statement, and replaces quantified variables
     with thier internal representations. These representations are then stored in the namespace
-    atomics map.
+    atomics map. Returns False, False if a quantifier is not followed by its variables.
     """
     removelist = []
     place = 0
@@ -523,11 +824,15 @@ def pop_quantifiers(args, highlevel, sublevel, namespace, quantifiers, add_quant
         if args[arg] in ["forAll", "exists"]:
             # Move to the next argument
             arg += 1
+            if arg == len(args):
+                messages.report("ERROR: the quantifier " + args[arg-1] + " is not followed by a "
+                                "variable.")
+                return False, False
             # Check for args in parens
             if args[arg] == "":
                 removelist.append(arg-1)
                 removelist.append(arg)
-                new_args = highlevel[sublevel[0][0]:sublevel[0][1]][1:-1].split(",")
+                new_args = "".join(highlevel[sublevel[0][0]+1:sublevel[0][1]-1]).split(",")
                 place += 1
                 interned = next_internal(namespace)
                 for temp in new_args:
@@ -548,6 +853,10 @@ def pop_quantifiers(args, highlevel, sublevel, namespace, quantifiers, add_quant
                 if args[arg] in namespace.sorts.keys():
                     add_atomics[interned] = [args[arg]]
                     arg += 1
+                    if arg == len(args):
+                        messages.report("ERROR: the quantifier " + args[arg-2] + " is not "
+                                        "followed by a variable.")
+                        return False, False
                     removelist.append(arg)
                 add_quants[interned] = args[arg]
                 add_quants[args[arg]] = interned
@@ -559,6 +868,10 @@ def pop_quantifiers(args, highlevel, sublevel, namespace, quantifiers, add_quant
                 temp_quant = args[arg-1]
                 removelist.append(arg-1)
                 while True:
+                    if arg == len(args):
+                        messages.report("ERROR: the variable list of the quantifier " +
+                                        temp_quant + " is not closed.")
+                        return False, False
                     new_arg = args[arg].strip("[").strip("]")
                     args[arg] = args[arg].strip("[")
                     removelist.append(arg)
@@ -566,6 +879,10 @@ def pop_quantifiers(args, highlevel, sublevel, namespace, quantifiers, add_quant
                     if new_arg in namespace.sorts.keys():
                         add_atomics[interned] = [new_arg]
                         arg += 1
+                        if arg == len(args):
+                            messages.report("ERROR: the variable list of the quantifier " +
+                                            temp_quant + " is not closed.")
+                            return False, False
                         removelist.append(arg)
                         new_arg = args[arg].strip("[").strip("]")
                     add_quants[interned] = new_arg
@@ -584,134 +901,108 @@ def pop_quantifiers(args, highlevel, sublevel, namespace, quantifiers, add_quant
 def assign_args(func_name, args, namespace, add_atomics, add_functions):
     """
     This function attempts to assign sorts to the current function and all of its arguments.
-    It also attempts to differentiate between different overloaded functions.
+    It also attempts to differentiate between different overloaded functions. Functions nested in
+    the args are resolved with an explicit stack, so the args can be nested to any depth.
     """
     # Fluents are weird, this is as good as it gets
     fluents = ["action", "initially", "holds", "happens", "clipped", "initiates", "terminates",
                "prior", "interval", "self", "payoff"]
-    exceptions = []
     # This is more sane. Find the right set of arguments for overloaded functions.
     temp_args = args
     temp_args.remove(func_name)
-    real_types = []
-    arg = 0
-    # TODO: by assigning namespace.atomics and add_atomics to a variable, we should be able to
-    # condense this code as it's very duplicated (or use a function?)
-    if func_name in namespace.functions.keys():
-        while arg < len(temp_args) and \
-                        arg < max([len(x[1]) for x in namespace.functions[func_name]]):
-            if temp_args[arg] in namespace.atomics.keys():
-                real_types.append(namespace.atomics[temp_args[arg]])
-            elif temp_args[arg] in namespace.functions.keys():
-                if temp_args[arg] in fluents:
-                    exceptions.append(len(real_types))
-                new_tail, return_type = assign_args(temp_args[arg], temp_args[arg:], namespace,
-                                                    add_atomics, add_functions)
-                real_types.append(return_type)
-                temp_args = temp_args[:arg]+new_tail
-            elif temp_args[arg] in add_atomics.keys():
-                real_types.append(add_atomics[temp_args[arg]][0])
-            else:
-                real_types.append("?")
-            arg += 1
-    else:
-        while arg < len(temp_args) and arg < max([len(x[1]) for x in add_functions[func_name]]):
-            if temp_args[arg] in add_atomics.keys():
-                real_types.append(add_atomics[temp_args[arg]][0])
-            elif temp_args[arg] in namespace.functions.keys():
-                if temp_args[arg] in fluents:
-                    exceptions.append(len(real_types))
-                new_tail, return_type = assign_args(temp_args[arg], temp_args[arg:], namespace,
-                                                    add_atomics, add_functions)
-                real_types.append(return_type)
-                temp_args = temp_args[:arg]+new_tail
-            elif temp_args[arg] in add_functions.keys():
-                if temp_args[arg] in fluents:
+    # Each entry is a function being resolved, as its name, its args, the sorts of the args found
+    # so far, the places that take fluents, the index of the next arg and the max number of args
+    stack = [[func_name, temp_args, [], [], 0]]
+    while True:
+        func_name, temp_args, real_types, exceptions, arg = stack[-1]
+        in_namespace = func_name in namespace.functions.keys()
+        if in_namespace:
+            max_arity = namespace.max_arity(func_name)
+        else:
+            max_arity = max([len(x[1]) for x in add_functions[func_name]])
+        if arg < len(temp_args) and arg < max_arity:
+            item = temp_args[arg]
+            if in_namespace and item in namespace.atomics.keys():
+                real_types.append(namespace.atomics[item])
+            elif not in_namespace and item in add_atomics.keys():
+                real_types.append(add_atomics[item][0])
+            elif item in namespace.functions.keys() or \
+                    (not in_namespace and item in add_functions.keys()):
+                if item in fluents:
                     exceptions.append(len(real_types))
-                new_tail, return_type = assign_args(temp_args[arg], temp_args[arg:], namespace,
-                                                    add_atomics, add_functions)
-                real_types.append(return_type)
-                temp_args = temp_args[:arg]+new_tail
+                # Resolve the nested function before going on with this one
+                stack.append([item, temp_args[arg + 1:], [], [], 0])
+                continue
+            elif item in add_atomics.keys():
+                real_types.append(add_atomics[item][0])
             else:
                 real_types.append("?")
-            arg += 1
+            stack[-1][4] += 1
+            continue
+        return_args, return_type = pick_overload(func_name, temp_args, real_types, exceptions,
+                                                 namespace, add_atomics, add_functions)
+        stack.pop()
+        if not stack or not return_args:
+            return return_args, return_type
+        frame = stack[-1]
+        frame[2].append(return_type)
+        frame[1] = frame[1][:frame[4]] + return_args
+        frame[4] += 1
+
+
+def pick_overload(func_name, temp_args, real_types, exceptions, namespace, add_atomics,
+                  add_functions):
+    """
+    Picks the overload of a function that fits the sorts of its args best, and makes a token of
+    the function with the args it takes.
+
+    :return: the token followed by the args it did not use, and the sort of the token, or
+        False, [] if no one overload fits
+    """
     valid_items = []
-    # Find the right item
+    # Find the right item. The namespace keeps the overloads that fit each set of sorts.
     if func_name in namespace.functions.keys():
-        for item in namespace.functions[func_name]:
-            valid = True
-            levels = []
-            if not len(item[1]) <= len(real_types):
-                continue
-            for arg in range(0, len(item[1])):
-                returnthing = namespace.no_conflict(real_types[arg], item[1][arg], 0)
-                if returnthing[0]:
-                    levels.append(returnthing[1])
-                # Fluents are special, they can take bools, ect.
-                elif item[1][arg] == "Fluent":
-                    if arg in exceptions:
-                        pass
-                    else:
-                        valid = False
-                        break
-                else:
-                    valid = False
-                    break
-            if valid:
-                valid_items.append([item, levels])
+        for item, levels in namespace.resolve_overloads(func_name, real_types, exceptions):
+            valid_items.append([item, levels])
     if func_name in add_functions.keys():
         for item in add_functions[func_name]:
-            valid = True
-            levels = []
-            if not len(item[1]) <= len(real_types):
-                continue
-            for arg in range(0, len(item[1])):
-                returnthing = namespace.no_conflict(real_types[arg], item[1][arg], 0)
-                if returnthing[0]:
-                    levels.append(returnthing[1])
-                # Fluents are special, they can take bools, etc
-                elif item[1][arg] == "Fluent":
-                    if arg in exceptions:
-                        pass
-                    else:
-                        valid = False
-                        break
-                else:
-                    valid = False
-                    break
-            if valid:
-                valid_items.append([item, levels])
+            if len(item[1]) <= len(real_types):
+                levels = namespace.overload_levels(item, real_types, exceptions)
+                if levels is not None:
+                    valid_items.append([item, levels])
     if len(valid_items) > 1:
         # Sort by length first
         sorted_items = sorted(valid_items, key=lambda item: len(item[1]), reverse=True)
         if len(sorted_items[0][1]) == len(sorted_items[1][1]):
             sorted_items = sorted(valid_items, key=lambda item: sum(item[1]))
             if sum(sorted_items[0][1]) == sum(sorted_items[1][1]):
-                print("ERROR: more than one possible interpretation for function \"" + func_name +
-                      "\". Please type your atomics.")
-                print("   The interpretations are:")
+                messages.report(
+                    "ERROR: more than one possible interpretation for function \"" + func_name +
+                    "\". Please type your atomics.")
+                messages.report("   The interpretations are:")
                 for i in sorted_items:
-                    print("interpretation: ", i[0], " Constraining factor: ", sum(i[1]))
-                print("   you gave:")
-                print("  ", real_types)
+                    messages.report("interpretation: ", i[0], " Constraining factor: ", sum(i[1]))
+                messages.report("   you gave:")
+                messages.report("  ", real_types)
                 return False, []
             else:
                 valid_items = [sorted_items[0]]
         else:
             valid_items = [sorted_items[0]]
     elif len(valid_items) == 0:
-        print("ERROR: the function named \"" + func_name + "\" does not take arguments of the type "
-              "provided. You cannot overload inline. Use prototypes.")
-        print("   the possible inputs for \"" + func_name + "\" are:")
+        messages.report(
+            "ERROR: the function named \"" + func_name + "\" does not take arguments of the type "
+            "provided. You cannot overload inline. Use prototypes.")
+        messages.report("   the possible inputs for \"" + func_name + "\" are:")
         # Print the possible interpretations
         if func_name in namespace.functions.keys():
             for i in namespace.functions[func_name]:
-                print("  ", i[1])
+                messages.report("  ", i[1])
         if func_name in add_functions.keys():
             for i in add_functions[func_name]:
-                print("  ", i[1])
-        print("   you gave:")
-        print("  ", real_types)
+                messages.report("  ", i[1])
+        messages.report("   you gave:")
+        messages.report("  ", real_types)
         # Throw an error
         return False, []
     # Assign Types
@@ -730,56 +1021,130 @@ def assign_args(func_name, args, namespace, add_atomics, add_functions):
     return return_args, add_atomics[new_token][0]
 
 
-def token_tree(expression, namespace, quantifiers, add_quants, add_atomics, add_functions):
+def split_group(expression, start, parens, namespace, quantifiers, add_quants, add_atomics):
     """
-    This is the meat and potatoes function of the parser. It pulls together all of the
-    other utility functions and decides which words are function names, which are
-    arguments to the functions, and which are special keywords that define sorts, ect.
-    Most of the complexity of the parser comes from dealing with overloaded and inline
-    functions. Unfortunately, the users demand these features, so the parser must make
-    it easy to shoot oneself in the foot with it.
+    Finds the args of the group at the given offset of the token stream and rips out its
+    quantifiers. Nested groups show up as empty args, and are skipped over using the paren index.
+
+    :return: tuple of the args, the offsets of the nested groups and the index of the first nested
+        group that is not a quantifier's variables, "" for an empty group, or False
     """
-    # Strip the outer parens
-    temp = expression[1:-1].strip(",")
+    # Strip the outer parens and the separators inside them
+    end = parens.close_of(start)
+    start += 1
+    while start < end and expression[start] == ",":
+        start += 1
+    while end > start and expression[end - 1] == ",":
+        end -= 1
     # check for an empty string
-    if temp == "":
-        return temp
-    # Find the sub-level tokens at this level of parsing
-    level = 0
-    highlevel = ""
+    if start == end:
+        return ""
+    # Find the sub-level tokens at this level of parsing. These are the function components.
+    # One is the function name, the others are its args.
+    args = [""]
     sublevel = []
-    for index in range(0, len(temp)):
-        if temp[index] == "(":
-            level += 1
-            if level == 1:
-                sublevel.append([index, cleaning.get_matching_close_paren(temp, index) + 1])
-            continue
-        if temp[index] == ")":
-            level -= 1
+    index = start
+    while index < end:
+        if expression[index] == "(":
+            sublevel.append([index, parens.closes[index] + 1])
+            index = parens.closes[index] + 1
             continue
-        if level == 0:
-            highlevel = highlevel + temp[index]
-    # These are the function components. One is the function name, the others are its args.
-    args = highlevel.split(",")   
+        if expression[index] == ",":
+            args.append("")
+        else:
+            args[-1] += expression[index]
+        index += 1
     place = 0
     # Fix some common keyword mistakes
     replace_synonyms(args)
     if isinstance(args, bool):
         return False
     # Rip out quantified statements
-    args, offset = pop_quantifiers(args, temp, sublevel, namespace, quantifiers, add_quants,
+    args, offset = pop_quantifiers(args, expression, sublevel, namespace, quantifiers, add_quants,
                                    add_atomics)
     place += offset
     if isinstance(args, bool):
         return False
-    # Tokens can be nested, so this recurses thorough the tree
-    for index in range(0, len(args)):
-        if args[index] == "":
-            args[index] = token_tree(temp[sublevel[place][0]:sublevel[place][1]], namespace,
-                                     quantifiers, add_quants, add_atomics, add_functions)
-            if not args[index]:
-                return False
-            place += 1
+    return args, sublevel, place
+
+
+def token_tree(expression, namespace, quantifiers, add_quants, add_atomics, add_functions,
+               start=0, parens=None, memo=None):
+    """
+    This is the meat and potatoes function of the parser. It pulls together all of the
+    other utility functions and decides which words are function names, which are
+    arguments to the functions, and which are special keywords that define sorts, ect.
+    Most of the complexity of the parser comes from dealing with overloaded and inline
+    functions. Unfortunately, the users demand these features, so the parser must make
+    it easy to shoot oneself in the foot with it. The expression is the token stream produced
+    by lexer.lex and start is the offset of the open paren of the group to parse. Nested groups
+    are parsed by their offsets in the same stream, so no part of it is ever copied, and with an
+    explicit stack instead of recursion, so formulas of any depth can be parsed. If a
+    SubexpressionMemo is given, groups it has already seen in the same context are taken from it
+    instead of being parsed again.
+    """
+    if parens is None:
+        parens = cleaning.ParenIndex(expression)
+    # What gets reported is collected, so that the memo can report it again when it reuses a group
+    output = None
+    if memo is not None:
+        output = messages.Capture().__enter__()
+    try:
+        # Each entry is a group being parsed, as its args, the offsets of its nested groups, the
+        # index of the next nested group, the index of the next arg to look at and what the memo
+        # needs to know to keep the group
+        stack = []
+        offset = start
+        while True:
+            # Open the group at offset, unless the memo already has it
+            returner, watch = None, None
+            if memo is not None:
+                returner, watch = memo.recall(expression, offset, parens.closes[offset], namespace,
+                                              add_quants, add_atomics, add_functions, output)
+            if returner is None:
+                group = split_group(expression, offset, parens, namespace, quantifiers,
+                                    add_quants, add_atomics)
+                if not group:
+                    return group if not stack else False
+                stack.append(list(group) + [0, watch])
+            # Work back up through the groups that have all of their args, until one of them has
+            # a nested group left to open
+            while True:
+                if returner is not None:
+                    if not stack:
+                        return returner
+                    stack[-1][0][stack[-1][3]] = returner
+                    stack[-1][3] += 1
+                args, sublevel, place, index, watch = stack[-1]
+                # Tokens can be nested, so this goes down into the first arg that is a nested
+                # group
+                while index < len(args) and args[index] != "":
+                    index += 1
+                stack[-1][3] = index
+                if index < len(args):
+                    offset = sublevel[place][0]
+                    stack[-1][2] = place + 1
+                    break
+                # All of the nested groups are done, so this group can be tokenized
+                returner = tokenize_group(args, namespace, add_quants, add_atomics,
+                                          add_functions)
+                stack.pop()
+                if not returner:
+                    return returner if not stack else False
+                if watch is not None:
+                    memo.remember(watch, returner, add_atomics, add_functions, output)
+    finally:
+        if output is not None:
+            output.__exit__(None, None, None)
+            messages.write(output.getvalue())
+
+
+def tokenize_group(args, namespace, add_quants, add_atomics, add_functions):
+    """
+    Turns the args of a group, with its nested groups already tokenized, into a token.
+
+    :return: the token, the arg itself if the group has a single arg, or False
+    """
     # Assign inline types
     if not assign_types(args, namespace, add_atomics, add_functions):
         return False
@@ -790,8 +1155,12 @@ def token_tree(expression, namespace, quantifiers, add_quants, add_atomics, add_
     check_prenex(args, add_quants)
     # Prefix inline logical functions
     args = prefix_logical_functions(args, add_atomics)
+    if args is False:
+        return False
     # Prefix inline numeric functions
     args = prefix_emdas(args, add_atomics)
+    if args is False:
+        return False
     # If this is a basic argument, it does not need to be tokenized
     if len(args) == 1:
         return args[0]
@@ -813,9 +1182,10 @@ def token_tree(expression, namespace, quantifiers, add_quants, add_atomics, add_
             # Check if there is no function name. This will happen in postfix notation or if the
             # user is bad. We do not support this
             if isinstance(primary_token, Token):
-                print("ERROR: \"" + primary_token.create_s_expression() + "\" is not a valid "
-                      "function name. Postfix notation is not supported when defining inline "
-                      "functions.")
+                messages.report(
+                    "ERROR: \"" + primary_token.create_s_expression() + "\" is not a valid "
+                    "function name. Postfix notation is not supported when defining inline "
+                    "functions.")
                 return False
             # Attempt to define the inline function
             sub_types = []
@@ -825,7 +1195,8 @@ def token_tree(expression, namespace, quantifiers, add_quants, add_atomics, add_
                 elif arg in add_atomics.keys():
                     sub_types.append(add_atomics[arg][0])
                 else:
-                    print("ERROR: token \""+str(arg)+"\" is of an unknown type. Please type it.")
+                    messages.report(
+                        "ERROR: token \""+str(arg)+"\" is of an unknown type. Please type it.")
                     return False
             new_token = Token(primary_token, args[1:])
             if primary_token in add_functions.keys():
@@ -838,10 +1209,11 @@ def token_tree(expression, namespace, quantifiers, add_quants, add_atomics, add_
                 # this to happen.
                 if primary_token in add_atomics.keys():
                     add_functions[primary_token].append([add_atomics[primary_token][0], sub_types])
-                    print("WARNING: ambiguity in parsing. Assuming that the inline function \"%s\""
-                          " has returntype of %s. Please place inline return type definitions "
-                          "outside of the function definition, or use prototypes."
-                          % (primary_token, add_atomics[primary_token][0]))
+                    messages.report(
+                        "WARNING: ambiguity in parsing. Assuming that the inline function \"%s\""
+                        " has returntype of %s. Please place inline return type definitions "
+                        "outside of the function definition, or use prototypes."
+                        % (primary_token, add_atomics[primary_token][0]))
                     del add_atomics[primary_token]
                 else:
                     add_functions[primary_token].append(["?", sub_types])
@@ -853,10 +1225,11 @@ def token_tree(expression, namespace, quantifiers, add_quants, add_atomics, add_
             # will assume that the user meant for this to happen.
             elif primary_token in add_atomics.keys():
                 add_functions[primary_token] = [[add_atomics[primary_token][0], sub_types]]
-                print("WARNING: ambiguity in parsing. Assuming that the inline function \"%s\""
-                      " has returntype of %s. Please place inline return type definitions "
-                      "outside of the function definition, or use prototypes."
-                      % (primary_token, add_atomics[primary_token][0]))
+                messages.report(
+                    "WARNING: ambiguity in parsing. Assuming that the inline function \"%s\""
+                    " has returntype of %s. Please place inline return type definitions "
+                    "outside of the function definition, or use prototypes."
+                    % (primary_token, add_atomics[primary_token][0]))
                 del add_atomics[primary_token]
             else:
                 add_functions[primary_token] = [["?", sub_types]]
@@ -870,7 +1243,7 @@ def token_tree(expression, namespace, quantifiers, add_quants, add_atomics, add_
     if len(args) == 1:
         return args[0]
     else:
-        print("ERROR: Unspecified error, something went wrong")
+        messages.report("ERROR: Unspecified error, something went wrong")
         return False
 
 
@@ -888,15 +1261,17 @@ def tokenize_quantifiers(tokens_tree, quantifiers):
     return temp
 
 
-def tokenize_random_dcec(expression, namespace=None):
+def tokenize_random_dcec(expression, namespace=None, terms=None, memo=None):
     """
     This function creates a token representation of a random DCEC statement.
-    It returns the token as well as sorts of new atomics and functions.
+    It returns the token as well as sorts of new atomics and functions. If a TermStore is
+    given, the token shares the tokens the store has, but nothing is added to the store, since
+    the statement may never be added (see DCECContainer.commit_statement). If a SubexpressionMemo
+    is given, parts of the statement that were parsed before are reused.
     """
     # Default DCEC Functions
     if namespace is None:
-        namespace = prototypes.Namespace()
-        namespace.add_basic_dcec()
+        namespace = prototypes.Namespace(prototypes.base_namespace())
     else:
         namespace = namespace
     # Remove Comments
@@ -906,56 +1281,584 @@ def tokenize_random_dcec(expression, namespace=None):
         return "", {}, {}, {}
     # Check for a parentheses mismatch error
     if not cleaning.check_parens(expression):
-        print("ERROR: parentheses mismatch error.")
+        messages.report("ERROR: parentheses mismatch error.")
+        return False, False, False, False
+    # Break the expression into the stream of tokens the parser works on
+    temp = lexer.lex(temp, namespace.operators)
+    if not temp:
+        messages.report("ERROR: parentheses mismatch error.")
         return False, False, False, False
-    # Make symbols into functions
-    temp = functorize_symbols(temp)
-    # Strip comments
-    temp = cleaning.strip_comments(temp)
-    # Strip whitespace so you can do the rest of the parsing
-    temp = cleaning.strip_white_space(temp)
-    # Tuck the functions inside thier parentheses
-    temp = cleaning.tuck_functions(temp)
-    # Strip whitespace again
-    temp = cleaning.strip_white_space(temp)
-    # Consolidate Parentheses
-    temp = cleaning.consolidate_parens(temp)
     quantifiers = []
     # These are the tokens that should be added to the namespace
     add_atomics = {}
     add_functions = {}
     add_quants = {}
-    return_token = token_tree(temp, namespace, quantifiers, add_quants, add_atomics, add_functions)
+    return_token = token_tree(temp, namespace, quantifiers, add_quants, add_atomics, add_functions,
+                              memo=memo)
     # check for errors that occur in the lower level
     if isinstance(return_token, bool) and return_token is False:
         return False, False, False, False
     # Add quantifiers to the TokenTree
     return_token = tokenize_quantifiers(return_token, quantifiers)
+    # Share subterms with the rest of the knowledge base. The sorts found for each token are
+    # moved over to the token from the store that replaces it.
+    if terms is not None and isinstance(return_token, Token):
+        mapping = {}
+        return_token = terms.intern(return_token, mapping, keep=False)
+        for token, interned in mapping.items():
+            if token is not interned and token in add_atomics:
+                sorts = add_atomics.pop(token)
+                if interned not in add_atomics:
+                    add_atomics[interned] = sorts
     return return_token, add_quants, add_atomics, add_functions
 
+
+def copy_additions(parsed):
+    """
+    Copy what tokenize_random_dcec returns, so that changes to the dicts do not reach a cached
+    parse. Tokens cannot be changed, so they are shared rather than copied.
+
+    :param parsed: tuple of the token, add_quants, add_atomics and add_functions
+    :return: copy of the tuple
+    """
+    token, add_quants, add_atomics, add_functions = parsed
+    add_atomics = dict((key, list(value)) for key, value in add_atomics.items())
+    add_functions = dict((key, copy_items(value)) for key, value in add_functions.items())
+    return token, dict(add_quants), add_atomics, add_functions
+
+
+def copy_items(items):
+    """
+    Copy the list of [return sort, [arg sorts]] items kept for an inline function.
+
+    :param items: list of items
+    :return: copy of the list
+    """
+    return [[list(part) if isinstance(part, list) else part for part in item] for item in items]
+
+
+class ParseCache(object):
+    """
+    Bounded LRU cache around tokenize_random_dcec, keyed on the expression and the version of the
+    namespace, so a statement that shows up again costs a dict lookup rather than a parse. Any
+    warnings the parse printed are printed again on a hit. Parses that fail are not kept.
+
+    Quantified statements also depend on the counter the namespace uses to name quantified
+    variables. Those are kept under the value of the counter they started from, and a hit moves
+    the counter on just as the parse did.
+
+    >>> cache = ParseCache(2)
+    >>> namespace = prototypes.Namespace()
+    >>> namespace.add_basic_dcec()
+    >>> first = cache.tokenize("holds(f, t1)", namespace)
+    >>> cache.tokenize("holds(f, t1)", namespace)[0] is first[0]
+    True
+    >>> namespace.add_code_atomic("f", "Fluent")
+    True
+    >>> cache.tokenize("holds(f, t1)", namespace)[0] is first[0]
+    False
+    >>> cache.tokenize("happens(e, t1)", namespace)[0].create_s_expression()
+    '(happens e t1)'
+    >>> cache.hits, cache.misses, cache.evictions
+    (1, 3, 1)
+
+    Statements parsed without a namespace are each parsed in a new one over the frozen namespace
+    of base_namespace, so they are kept under the version of that namespace.
+
+    >>> first = cache.tokenize("holds(f, t1)")
+    >>> cache.tokenize("holds(f, t1)")[0] is first[0]
+    True
+    >>> cache.hits
+    2
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """
+        Drop every cached parse. The counters are kept.
+        """
+        self.entries.clear()
+
+    def tokenize(self, expression, namespace=None, terms=None, memo=None):
+        """
+        Same as tokenize_random_dcec, but reuses the result of an earlier parse of the same
+        expression in the same version of the namespace.
+
+        :param expression: statement to parse
+        :param namespace: namespace to parse it in, or None for a new one over base_namespace
+        :param terms: TermStore to make the token from
+        :param memo: SubexpressionMemo to reuse parts of earlier statements from
+        :return: tuple of the token, add_quants, add_atomics and add_functions
+        """
+        if namespace is None:
+            # Same namespace as tokenize_random_dcec would make. Every such namespace starts out
+            # the same as its base, so the parse is kept under the version of the base.
+            namespace = prototypes.Namespace(prototypes.base_namespace())
+            key = (expression, "base", namespace.base.version, terms)
+        else:
+            key = (expression, namespace.version, terms)
+        counter = namespace.quant_map.get("TEMP")
+        for lookup in [key, key + (counter,)]:
+            entry = self.entries.pop(lookup, None)
+            if entry is not None:
+                self.entries[lookup] = entry
+                self.hits += 1
+                parsed, output, moved_to = entry
+                messages.write(output)
+                if lookup is not key:
+                    namespace.quant_map["TEMP"] = moved_to
+                return copy_additions(parsed)
+        self.misses += 1
+        captured = messages.Capture()
+        try:
+            with captured:
+                parsed = tokenize_random_dcec(expression, namespace, terms, memo)
+        finally:
+            output = captured.getvalue()
+            messages.write(output)
+        if isinstance(parsed[0], bool) or self.maxsize <= 0:
+            return parsed
+        moved_to = namespace.quant_map.get("TEMP")
+        if moved_to != counter:
+            key += (counter,)
+        self.entries[key] = (copy_additions(parsed), output, moved_to)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return parsed
+
+
+class SubexpressionMemo(object):
+    """
+    Memo of parenthesized groups that token_tree has parsed, so that when a statement is edited
+    only the groups whose text changed are parsed again. Groups are keyed on their tokens from
+    lexer.lex and the version of the namespace.
+
+    How a group parses also depends on what the rest of the statement has already said about the
+    names in it, so an entry also keeps the first sort each of its names had (and what it was
+    quantified as) when it was parsed, and is only reused when those are the same. Reusing a
+    group replays what parsing it did: the sorts it added to names from earlier in the statement,
+    the atomics, tokens and inline functions it added, and anything it printed. Groups with
+    quantifiers, groups that use inline functions from earlier in the statement, groups that
+    replace a sort found earlier, and groups longer than max_group tokens are never kept.
+
+    Keeping the groups makes the first parse of a statement slower, so the memo is meant for
+    statements that are edited and parsed again, such as in an editor, rather than for loading.
+
+    >>> memo = SubexpressionMemo()
+    >>> namespace = prototypes.Namespace()
+    >>> namespace.add_basic_dcec()
+    >>> namespace.add_basic_logic()
+    >>> first = tokenize_random_dcec("and(holds(f, t1), holds(g, t2))", namespace, memo=memo)
+    >>> second = tokenize_random_dcec("or(holds(f, t1), holds(g, t2))", namespace, memo=memo)
+    >>> second[0].args[0] is first[0].args[0]
+    True
+    >>> memo.hits, memo.misses
+    (2, 4)
+    """
+    def __init__(self, maxsize=16384, max_group=512):
+        self.maxsize = maxsize
+        self.max_group = max_group
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        """
+        Drop every group. The counters are kept.
+        """
+        self.entries.clear()
+
+    def recall(self, expression, start, end, namespace, add_quants, add_atomics, add_functions,
+               output):
+        """
+        Look up the group between the given offsets of a token stream. If it can be reused, what
+        parsing it did is replayed.
+
+        :return: tuple of the token for the group, or None if it has to be parsed, and what
+            remember needs to keep the group once it is parsed, or None if it cannot be kept
+        """
+        if end - start + 1 > self.max_group:
+            return None, None
+        tokens = tuple(expression[start:end + 1])
+        names = []
+        seen = set(["(", ")", ","])
+        for name in tokens:
+            if name in seen:
+                continue
+            if name in ["forAll", "exists"] or name in add_functions:
+                return None, None
+            seen.add(name)
+            names.append(name)
+        context = tuple((add_quants.get(name), add_atomics[name][0] if name in add_atomics
+                         else None) for name in names)
+        key = (tokens, namespace.version)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.entries[key] = entry
+            returner, kept_context, appended, added, functions, printed = entry
+            if kept_context == context and \
+                    not any(isinstance(item, Token) and item in add_atomics for item, _ in added):
+                self.hits += 1
+                for name, sorts in appended:
+                    add_atomics[name].extend(sorts)
+                for item, sorts in added:
+                    add_atomics[item] = list(sorts)
+                for name, items in functions:
+                    add_functions[name] = copy_items(items)
+                output.write(printed)
+                return returner, None
+        self.misses += 1
+        before = [(name, add_atomics.get(name), len(add_atomics.get(name, []))) for name in names]
+        return None, (key, context, before, output.tell())
+
+    def remember(self, watch, returner, add_atomics, add_functions, output):
+        """
+        Keep a group that has just been parsed.
+
+        :param watch: what recall gave back when the group was opened
+        :param returner: token for the group
+        """
+        key, context, before, position = watch
+        appended = []
+        added = []
+        for name, sorts, length in before:
+            now = add_atomics.get(name)
+            if sorts is None:
+                if now is not None:
+                    added.append((name, list(now)))
+            elif now is sorts:
+                if len(now) > length:
+                    appended.append((name, now[length:]))
+            else:
+                # The group replaced or removed sorts from earlier in the statement
+                return
+        if isinstance(returner, Token):
+            for token in returner.preorder():
+                if token in add_atomics:
+                    added.append((token, list(add_atomics[token])))
+        functions = [(name, copy_items(add_functions[name]))
+                     for name, _, _ in before if name in add_functions]
+        printed = ""
+        if output.tell() != position:
+            printed = output.getvalue()[position:]
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = (returner, context, appended, added, functions, printed)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+def check_additions(namespace, add_atomics, add_functions):
+    """
+    Checks the sorts of the atomics and inline functions a statement would add to a namespace
+    against each other and against the atomics already in the namespace.
+
+    :param namespace: namespace the statement is added to
+    :param add_atomics: atomics from tokenize_random_dcec
+    :param add_functions: inline functions from tokenize_random_dcec
+    :return: the error message, or an empty string if there is no conflict
+    """
+    for atomic in add_atomics.keys():
+        # Tokens are not currently stored
+        if isinstance(atomic, Token):
+            continue
+        for potentialtype in range(0, len(add_atomics[atomic])):
+            if (not namespace.no_conflict(add_atomics[atomic][0],
+                                          add_atomics[atomic][potentialtype], 0)[0]) and \
+                    (not namespace.no_conflict(add_atomics[atomic][potentialtype],
+                                               add_atomics[atomic][0], 0)[0]):
+                return "The atomic " + atomic + " cannot be both " + \
+                    add_atomics[atomic][potentialtype] + " and " + add_atomics[atomic][0] + \
+                    ". (This is caused by assigning different sorts to two atomics inline. " \
+                    "Did you rely on the parser for sorting?)"
+    for function in add_functions.keys():
+        for item in add_functions[function]:
+            if item[0] == "?":
+                return "please define the returntype of the inline function " + function
+    for atomic in add_atomics.keys():
+        # Tokens are not currently stored
+        if isinstance(atomic, Token):
+            continue
+        elif atomic in namespace.atomics.keys():
+            if not namespace.no_conflict(namespace.atomics[atomic], add_atomics[atomic][0], 0)[0] \
+                    and not namespace.no_conflict(add_atomics[atomic][0],
+                                                  namespace.atomics[atomic], 0)[0]:
+                return "The atomic " + atomic + " cannot be both " + add_atomics[atomic][0] + \
+                    " and " + namespace.atomics[atomic] + "."
+    return ""
+
+
+def statement_groups(tokens):
+    """
+    Lists the parenthesized groups of a token stream from lexer.lex, innermost groups first, in
+    the order the parser finishes them. Each group is a list of its items, where nested groups
+    show up as their index in the list. No Tokens are built.
+
+    >>> statement_groups(lexer.lex("forAll x B(x, t1, P)"))
+    [['B', 'x', 't1', 'P'], ['forAll', 'x', 0]]
+
+    :param tokens: token stream
+    :return: list of groups
+    """
+    groups = []
+    stack = []
+    for token in tokens:
+        if token == "(":
+            if stack:
+                stack[-1].append(None)
+            stack.append([])
+        elif token == ")":
+            groups.append(stack.pop())
+            if stack:
+                stack[-1][-1] = len(groups) - 1
+        elif token != ",":
+            stack[-1].append(token)
+    return groups
+
+
+def _pop_quantifier_places(items, sorts, variables):
+    """
+    Finds the items of a group that pop_quantifiers would take out, the same way it does.
+
+    :param items: group from statement_groups
+    :param sorts: sorts of the namespace
+    :param variables: set of the quantified variables so far, the new ones are added to it
+    :return: tuple of the set of places taken out, the variables that are given a sort and the
+        number of quantifiers with their variables in parentheses, a message if a quantifier is
+        not followed by its variables, or None if only the parser can tell
+    """
+    removed = set()
+    typed = []
+    count = 0
+    for place in range(0, len(items)):
+        if items[place] in variables or items[place] not in ["forAll", "exists"]:
+            continue
+        quantifier = items[place]
+        place += 1
+        if place == len(items):
+            return "the quantifier " + quantifier + " is not followed by a variable"
+        if not isinstance(items[place], string_types):
+            # The variables are in parentheses
+            removed.update([place - 1, place])
+            count += 1
+        elif "[" not in items[place]:
+            removed.update([place - 1, place])
+            if items[place] in sorts:
+                place += 1
+                if place == len(items):
+                    return "the quantifier " + quantifier + " is not followed by a variable"
+                if not isinstance(items[place], string_types):
+                    # The parser takes a group for the variable here, only it can tell what
+                    # that turns into
+                    return None
+                removed.add(place)
+                typed.append(items[place])
+            variables.add(items[place])
+        else:
+            removed.add(place - 1)
+            while True:
+                if place == len(items) or not isinstance(items[place], string_types):
+                    return "the variable list of the quantifier " + quantifier + " is not closed"
+                removed.add(place)
+                variable = items[place].strip("[").strip("]")
+                if variable in sorts:
+                    place += 1
+                    if place == len(items) or not isinstance(items[place], string_types):
+                        return "the variable list of the quantifier " + quantifier + \
+                            " is not closed"
+                    removed.add(place)
+                    variable = items[place].strip("[").strip("]")
+                    typed.append(variable)
+                variables.add(variable)
+                place += 1
+                if "]" in items[place - 1]:
+                    break
+    return removed, typed, count
+
+
+def validate_dcec(expression, namespace=None, level=SORTS):
+    """
+    Checks whether a statement is well formed without adding it to anything and without printing.
+    The check stops at the given level:
+        SYNTAX: the parentheses match and the quantifiers are followed by their variables
+        SYMBOLS: every group has a function that is known, or is an inline function definition
+            whose arguments all have sorts
+        SORTS: the statement parses, its overloads resolve, and its atomics and inline functions
+            do not conflict with the namespace, so DCECContainer.add_statement would accept it
+    The first two levels only look at the token stream and build no Tokens, so a statement that
+    fails them is rejected without running the parser. SORTS runs the whole parser on a
+    statement that passes them, so it costs as much as a parse, whether the statement is valid
+    or not. A quantifier whose variable is a group also leaves the syntax to the parser.
+
+    >>> validate_dcec("holds(test, t1)")
+    (True, '')
+    >>> validate_dcec("holds(test, t1))")
+    (False, 'parentheses mismatch')
+    >>> validate_dcec("forAll", level=SYNTAX)
+    (False, 'the quantifier forAll is not followed by a variable')
+    >>> validate_dcec("greet(james, t1)", level=SYMBOLS)
+    (False, 'token "james" is of an unknown type. Please type it.')
+    >>> validate_dcec("(Boolean (greet (Agent jack)))")
+    (True, '')
+    >>> validate_dcec("(iff and not)")
+    (False, '"not" is missing the argument to its right.')
+    >>> validate_dcec("happens(t1, t1)")
+    (False, 'The atomic t1 cannot be both Moment and Event. (This is caused by assigning \
+different sorts to two atomics inline. Did you rely on the parser for sorting?)')
+
+    :param expression: statement to check
+    :param namespace: namespace to check the statement against, defaults to the DCEC* namespace
+    :param level: SYNTAX, SYMBOLS or SORTS
+    :return: tuple of whether the statement is valid and the reason it is not
+    """
+    if namespace is None:
+        namespace = prototypes.Namespace(prototypes.base_namespace())
+    temp = remove_comments(expression)
+    if temp == "()":
+        return True, ""
+    if not cleaning.check_parens(expression):
+        return False, "parentheses mismatch"
+    tokens = lexer.lex(temp, namespace.operators)
+    if not tokens:
+        return False, "parentheses mismatch"
+    groups = statement_groups(tokens)
+    # Syntax: go through the groups top down like the parser, taking out the quantifiers. A
+    # quantifier with its variables in parentheses reads the first subgroup of its group, and the
+    # remaining subgroups fill in the rest of the group in order.
+    args_of = {}
+    typed = set(namespace.atomics)
+    variables = set()
+    deferred = False
+    stack = [len(groups) - 1]
+    while stack:
+        index = stack.pop()
+        group = groups[index]
+        if not group and index != len(groups) - 1:
+            return False, "empty parentheses"
+        popped = _pop_quantifier_places(group, namespace.sorts, variables)
+        if isinstance(popped, string_types):
+            return False, popped
+        if popped is None:
+            deferred = True
+            break
+        removed, quantified, count = popped
+        typed.update(quantified)
+        subgroups = [item for item in group if not isinstance(item, string_types)]
+        if count:
+            variables.update(item for item in groups[subgroups[0]]
+                             if isinstance(item, string_types))
+        args = []
+        for place in range(0, len(group)):
+            if place in removed:
+                continue
+            if isinstance(group[place], string_types):
+                args.append(group[place])
+            elif count == len(subgroups):
+                return False, "the variables of a quantifier take the place of a group"
+            else:
+                args.append(subgroups[count])
+                count += 1
+        args_of[index] = args
+        stack.extend(reversed([arg for arg in args if not isinstance(arg, string_types)]))
+    if level == SYNTAX or deferred:
+        return _parse_check(expression, namespace) if level == SORTS else (True, "")
+    # Symbols: take out the inline sorts, and find the atomics that get a sort, either inline or
+    # as the argument of a function
+    for index in args_of:
+        args = args_of[index]
+        for place in range(0, len(args)):
+            if args[place] in namespace.sorts:
+                if place + 1 == len(args):
+                    return False, "Cannot find something to attach the sort \"" + args[place] + \
+                        "\". Cannot overload sorts."
+                if args[place + 1] in namespace.sorts or args[place + 1] in namespace.functions:
+                    return False, "Cannot assign inline types to basicTypes, keywords, or " \
+                                  "function names"
+                typed.add(args[place + 1])
+        args = [arg for arg in args if arg not in namespace.sorts]
+        if any(arg in namespace.functions or arg in INFIX_KEYWORDS for arg in args):
+            typed.update(arg for arg in args if isinstance(arg, string_types))
+        args_of[index] = args
+    # Then go through the groups bottom up like the parser, and check that each one either has a
+    # function to resolve or is an inline function definition with sorts for all of its args. A
+    # group with a single item is replaced by that item.
+    inline = set()
+    results = {}
+    for index in range(0, len(groups)):
+        if index not in args_of:
+            continue
+        args = [results[arg] if not isinstance(arg, string_types) else arg
+                for arg in args_of[index]]
+        if len(args) < 2:
+            results[index] = args[0] if args else False
+            continue
+        results[index] = True
+        if any(arg in namespace.functions or arg in INFIX_KEYWORDS or arg in inline
+               for arg in args if isinstance(arg, string_types)):
+            continue
+        if not isinstance(args[0], string_types):
+            return False, "a group is not a valid function name. Postfix notation is not " \
+                          "supported when defining inline functions."
+        for arg in args[1:]:
+            if isinstance(arg, string_types) and arg not in typed:
+                return False, "token \"" + arg + "\" is of an unknown type. Please type it."
+            if arg is False:
+                return False, "a group is of an unknown type. Please type it."
+        inline.add(args[0])
+        results[index] = False
+    if level == SYMBOLS:
+        return True, ""
+    return _parse_check(expression, namespace)
+
+
+def _parse_check(expression, namespace):
+    """
+    Runs the parser on a statement with its output captured and the quantifier counter put back,
+    then checks what the statement would add against the namespace.
+
+    :return: tuple of whether the statement is valid and the reason it is not
+    """
+    counter = namespace.quant_map.get("TEMP")
+    try:
+        with messages.Capture() as captured:
+            addee, add_quants, add_atomics, add_functions = tokenize_random_dcec(expression,
+                                                                                 namespace)
+        output = captured.getvalue()
+    finally:
+        if counter is not None:
+            namespace.quant_map["TEMP"] = counter
+    if isinstance(addee, bool) and not addee:
+        errors = messages.find(output)
+        return False, errors[0] if errors else "the statement is not correctly formed"
+    message = check_additions(namespace, add_atomics, add_functions)
+    return not message, message
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
 
     # pylint: disable=invalid-name
     inputin = input("Enter an expression: ")
-    # Make symbols into functions
+    # Remove comments
     inputin = remove_comments(inputin)
     print(inputin)
-    inputin = functorize_symbols(inputin)
-    print(inputin)
-    # Strip comments
-    inputin = cleaning.strip_comments(inputin)
-    print(inputin)
-    # Strip whitespace so you can do the rest of the parsing
-    inputin = cleaning.strip_white_space(inputin)
-    print(inputin)
-    # Tuck the functions inside thier parentheses
-    inputin = cleaning.tuck_functions(inputin)
-    print(inputin)
-    # Consolidate Parentheses
-    inputin = cleaning.consolidate_parens(inputin)
-    print(inputin)
+    # Break the expression into tokens
+    tokens = lexer.lex(inputin)
+    if tokens:
+        print(" ".join(tokens))
     test_namespace = prototypes.Namespace()
     test_namespace.add_basic_dcec()
     test_namespace.add_basic_numerics()
@@ -0,0 +1,400 @@
+"""
+A single pass lexer for DCEC* expressions. It replaces the chain of string rewrites that used to
+run over every statement (functorize_symbols, strip_comments, strip_white_space, tuck_functions,
+strip_white_space and consolidate_parens) with one scan that emits the token stream the parser
+reads directly.
+
+The token stream is a list of strings. Every token is either "(", ")", "," or a name. Infix symbols
+come out as the names of their internal functions, and brackets stay attached to the names of a
+quantifier list (forAll [x,y] gives "[x" and "y]") because that is how the parser reads them.
+Joining the stream gives the same string the old chain of rewrites produced, so the parser builds
+the same trees as before.
+"""
+
+from __future__ import print_function
+import re
+from six.moves import intern  # pylint: disable=locally-disabled,redefined-builtin
+
+# We need to use the first type of import if running this script directly and the second type of
+# import if we're using it in a package (such as for within Talos)
+try:
+    import cleaning
+    import messages
+except ImportError:
+    import DCEC_Library.cleaning as cleaning
+    import DCEC_Library.messages as messages
+
+# Infix symbols and the internal function names they stand for. Symbols that have multiple
+# interpretations in the DCEC syntax (*, -, &, |) are passed through and left to the parser.
+# "===" is not listed: the old rewrite chain replaced "==" first, so "===" always came out as two
+# equals.
+SYMBOL_MAP = {
+    "^": "exponent",
+    "*": "*",
+    "/": "divide",
+    "+": "add",
+    "-": "-",
+    "&": "&",
+    "|": "|",
+    "~": "not",
+    "->": "implies",
+    "<->": "ifAndOnlyIf",
+    ">": "greater",
+    "<": "less",
+    ">=": "greaterOrEqual",
+    "<=": "lessOrEqual",
+    "=": "equals",
+    "==": "equals",
+}
+
+# Symbols the old rewrite chain replaced after a symbol they overlap with, and the text that makes
+# them give way. "==" was replaced before "<=", so "<==" is "<" followed by "==".
+SHADOWED_SYMBOLS = {
+    "<=": "=",
+}
+
+# Characters the lexer splits expressions on, these cannot be part of a symbol
+RESERVED_CHARACTERS = " ,()[];#`"
+
+# Functions whose arguments tuck_functions wrapped in an extra set of parentheses
+WRAPPED_FUNCTIONS = ["not", "negate"]
+
+# Kinds of separators. Soft separators (whitespace) disappear at the ends of the expression,
+# hard separators (commas and the space inserted around brackets) do not.
+_NO_SEP = 0
+_SOFT_SEP = 1
+_HARD_SEP = 2
+
+# Group numbers in the scanner pattern
+_SEPARATOR = 1
+_SYMBOL = 2
+_NAME = 3
+
+
+def _escape(chars):
+    return "".join(char if char.isalnum() else "\\" + char for char in chars)
+
+
+class OperatorTable:
+    """
+    The infix symbols of a namespace and the function names they stand for, kept in a trie so the
+    whole expression can be scanned once with a longest match at every position. The trie is
+    compiled into a regular expression the first time it is needed after a change.
+
+    >>> operators = OperatorTable()
+    >>> operators.replace("a<->b -> c")
+    'a ifAndOnlyIf b  implies  c'
+    >>> operators.add("=>", "implies")
+    True
+    >>> operators.replace("a => b")
+    'a  implies  b'
+    """
+    def __init__(self, symbols=None):
+        if symbols is None:
+            symbols = SYMBOL_MAP
+        # Each node maps the next character to the node below it. A node that ends a symbol maps
+        # the empty string to the name of the symbol's function.
+        self.trie = {}
+        self.symbols = {}
+        self._pattern = None
+        self._scanner = None
+        for symbol in symbols:
+            self.add(symbol, symbols[symbol])
+
+    def add(self, symbol, function_name):
+        """
+        Add an infix symbol to the table. Symbols cannot contain whitespace or any of the
+        characters the lexer uses to split expressions.
+
+        :param symbol: the infix symbol, for example "->"
+        :param function_name: the name of the function the symbol stands for
+        :return: True if the symbol was added, False otherwise
+        """
+        if not symbol or any(char.isspace() or char in RESERVED_CHARACTERS for char in symbol):
+            messages.report("ERROR: \"" + symbol + "\" cannot be used as an infix symbol.")
+            return False
+        node = self.trie
+        for char in symbol:
+            node = node.setdefault(char, {})
+        node[""] = function_name
+        self.symbols[symbol] = function_name
+        self._pattern = None
+        self._scanner = None
+        return True
+
+    def copy(self):
+        """
+        :return: a new table with the same symbols
+        """
+        return OperatorTable(self.symbols)
+
+    def pattern(self):
+        """
+        :return: compiled pattern that matches the longest symbol at a position
+        """
+        if self._pattern is None:
+            self._pattern = re.compile(self._trie_pattern(self.trie, ""))
+        return self._pattern
+
+    def scanner(self):
+        """
+        :return: compiled pattern that splits an expression into separators, symbols, names and
+            single special characters
+        """
+        if self._scanner is None:
+            specials = RESERVED_CHARACTERS + "".join(sorted(key for key in self.trie))
+            self._scanner = re.compile("([ ,]+)|(" + self._trie_pattern(self.trie, "") +
+                                       ")|([^" + _escape(specials) + "]+)|(.)", re.S)
+        return self._scanner
+
+    def replace(self, expression):
+        """
+        Replaces every symbol in the expression with the name of its function, padded with spaces.
+
+        :param expression: expression to scan
+        :return: the expression with the symbols replaced
+        """
+        if not self.trie:
+            return expression
+        return self.pattern().sub(lambda match: " " + self.symbols[match.group()] + " ",
+                                  expression)
+
+    def _trie_pattern(self, node, prefix):
+        # The longer symbols below a node are tried before the symbol that ends at it, and the
+        # regular expression backs off to the shorter one when the longer ones do not match
+        alternatives = [_escape(char) + self._trie_pattern(node[char], prefix + char)
+                        for char in sorted(node) if char]
+        if "" in node:
+            if prefix in SHADOWED_SYMBOLS:
+                alternatives.append("(?!" + _escape(SHADOWED_SYMBOLS[prefix]) + ")")
+            else:
+                alternatives.append("")
+        if len(alternatives) == 1 and prefix:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+# The table for SYMBOL_MAP, used when no namespace is given. Namespaces share it until an
+# operator is added to them.
+DEFAULT_OPERATORS = OperatorTable()
+
+
+def _intern(name):
+    # Names are kept once per process, so the dicts of the parser compare them by identity
+    return intern(name) if isinstance(name, str) else name
+
+
+def _is_name(token):
+    return token not in ("(", ")", ",")
+
+
+def lex(expression, operators=None):
+    """
+    Turns an expression into a stream of tokens in one pass. Comments (everything after a ';' or
+    a '#') are dropped, function applications are tucked inside their parentheses, and superfluous
+    parentheses are removed. The stream is always wrapped in an outer set of parentheses.
+
+    >>> lex("holds(test, t1)")
+    ['(', 'holds', ',', 'test', ',', 't1', ')']
+    >>> lex("B(jack,t1,K(james,t1,P))")
+    ['(', 'B', ',', 'jack', ',', 't1', ',', '(', 'K', ',', 'james', ',', 't1', ',', 'P', ')', ')']
+    >>> lex("a -> b # comment")
+    ['(', 'a', ',', 'implies', ',', 'b', ')']
+    >>> lex("not(A)")
+    ['(', 'not', ',', '(', 'A', ')', ')']
+    >>> lex("forAll [x,y] P(x,y)")
+    ['(', 'forAll', ',', '[x', ',', 'y]', ',', '(', 'P', ',', 'x', ',', 'y', ')', ')']
+    >>> lex("a(b))(")
+    False
+
+    :param expression: expression to lex
+    :param operators: OperatorTable of the infix symbols, defaults to the table for SYMBOL_MAP
+    :return: list of tokens, or False if the parentheses do not match
+    """
+    if operators is None:
+        operators = DEFAULT_OPERATORS
+    symbol_map = operators.symbols
+    scanner = operators.scanner()
+    # Strip the comments and the whitespace around the expression
+    end = len(expression)
+    for mark in ";#":
+        place = expression.find(mark, 0, end)
+        if place != -1:
+            end = place
+    start = 0
+    while start < end and expression[start].isspace():
+        start += 1
+    while end > start and expression[end - 1].isspace():
+        end -= 1
+
+    tokens = []
+    # Open parens that are not closed yet as [index, whether the paren below closes with it]
+    opens = []
+    # Indexes of the pairs of parens that only wrap another pair
+    dropped = []
+    # Index of the open paren matching the last token, when that is a close paren
+    closed = -1
+    # Set when the tokens need the slower clean up passes at the end
+    untidy = False
+    name = ""
+    sep = _NO_SEP
+    # Index of the first token of the name a following paren would turn into a function
+    chunk = 0
+    for match in scanner.finditer(expression, start, end):
+        kind = match.lastindex
+        text = match.group()
+        if kind == _NAME or kind > _NAME and text not in "()[]":
+            # A name, or the first character of a symbol that is not a symbol on its own
+            name += text
+            continue
+        if text == "]":
+            name += text
+        if name:
+            if sep:
+                if tokens[-1] not in ("(", ",") if tokens else sep == _HARD_SEP:
+                    tokens.append(",")
+                    chunk = len(tokens)
+                sep = _NO_SEP
+            tokens.append(_intern(name))
+            name = ""
+        if kind == _SEPARATOR:
+            if "," in text:
+                sep = _HARD_SEP
+            elif not sep:
+                sep = _SOFT_SEP
+        elif kind == _SYMBOL:
+            if tokens[-1] not in ("(", ",") if tokens else sep == _HARD_SEP:
+                tokens.append(",")
+                chunk = len(tokens)
+            tokens.append(symbol_map[text])
+            sep = _SOFT_SEP
+        elif text == "[":
+            sep = _HARD_SEP
+            name = text
+        elif text == "]":
+            sep = _HARD_SEP
+        elif text == ")":
+            sep = _NO_SEP
+            if tokens and tokens[-1] == ",":
+                # An empty application, the comma it left behind is cleaned up at the end
+                untidy = True
+            while True:
+                if not opens:
+                    return False
+                index, also = opens.pop()
+                if tokens[-1] == ")" and closed == index + 1:
+                    dropped.append(index)
+                    dropped.append(len(tokens))
+                closed = index
+                tokens.append(")")
+                if not also:
+                    break
+        elif sep:
+            if tokens[-1] not in ("(", ",") if tokens else sep == _HARD_SEP:
+                tokens.append(",")
+            sep = _NO_SEP
+            opens.append([len(tokens), False])
+            tokens.append("(")
+            chunk = len(tokens)
+        elif tokens and _is_name(tokens[-1]):
+            # A function application, name(args) becomes (name,args)
+            if chunk != len(tokens) - 1:
+                # The name runs back into a group that is already closed
+                untidy = True
+            opens.append([chunk, False])
+            tokens.insert(chunk, "(")
+            tokens.append(",")
+            if chunk == len(tokens) - 3 and tokens[-2] in WRAPPED_FUNCTIONS:
+                opens.append([len(tokens), True])
+                tokens.append("(")
+            chunk = len(tokens)
+        else:
+            if tokens and tokens[-1] == ")":
+                tokens.append(",")
+            opens.append([len(tokens), False])
+            tokens.append("(")
+            chunk = len(tokens)
+    if name:
+        if sep and (tokens[-1] != "(" if tokens else sep == _HARD_SEP):
+            tokens.append(",")
+        tokens.append(_intern(name))
+    elif sep == _HARD_SEP:
+        tokens.append(",")
+    if opens:
+        return False
+    if untidy or "`" in expression:
+        return _consolidate(_split_backticks(tokens))
+    # Wrap the expression in parens unless it already is a single group, and drop the parens
+    # that only wrap another pair
+    wrapped = tokens and tokens[-1] == ")" and closed == 0
+    if dropped:
+        dropped = set(dropped)
+        tokens = [tokens[index] for index in range(0, len(tokens)) if index not in dropped]
+    if not wrapped:
+        tokens.insert(0, "(")
+        tokens.append(")")
+    return tokens
+
+
+def _split_backticks(tokens):
+    """
+    Backticks in names are whitespace once the functions are tucked in. Splits the names on them
+    and cleans up the separators around the pieces the same way as the rest of the expression.
+    """
+    cleaned = []
+    # Indexes of the commas that stand for whitespace
+    soft = set()
+    sep = _NO_SEP
+    for token in tokens:
+        if token == ",":
+            sep = _HARD_SEP
+        elif token == ")":
+            sep = _NO_SEP
+            cleaned.append(token)
+        else:
+            parts = token.split("`")
+            for place in range(0, len(parts)):
+                part = parts[place]
+                if place and not sep:
+                    sep = _SOFT_SEP
+                if not cleaned and sep != _HARD_SEP:
+                    part = part.lstrip()
+                if part:
+                    if sep:
+                        if cleaned[-1] != "(" if cleaned else sep == _HARD_SEP:
+                            if sep == _SOFT_SEP:
+                                soft.add(len(cleaned))
+                            cleaned.append(",")
+                        sep = _NO_SEP
+                    cleaned.append(part)
+    if sep == _HARD_SEP:
+        cleaned.append(",")
+    else:
+        # Whitespace that ends up at the end once the backticks are gone is stripped as well
+        while cleaned and _is_name(cleaned[-1]) and cleaned[-1][-1].isspace():
+            part = cleaned.pop().rstrip()
+            if part:
+                cleaned.append(part)
+                break
+            if len(cleaned) - 1 in soft:
+                cleaned.pop()
+    return cleaned
+
+
+def _consolidate(tokens):
+    """
+    Wraps the tokens in parens and drops every pair of parens that only wraps another pair.
+    """
+    tokens = ["("] + tokens + [")"]
+    closes = cleaning.ParenIndex(tokens).closes
+    dropped = set()
+    for index in range(0, len(tokens) - 1):
+        if closes[index] != -1 and closes[index + 1] != -1 and \
+                closes[index] == closes[index + 1] + 1:
+            dropped.add(index)
+            dropped.add(closes[index])
+    return [tokens[index] for index in range(0, len(tokens)) if index not in dropped]
+
+if __name__ == "__main__":
+    # pylint: disable=wrong-import-position
+    import doctest
+    doctest.testmod()
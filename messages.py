@@ -0,0 +1,113 @@
+"""
+Where the library reports its errors and warnings. They are printed to sys.stdout as print would,
+unless the thread reporting them is inside a Capture, which keeps them instead. sys.stdout is
+never replaced, so a thread capturing what it reports never takes what another thread prints,
+and several threads can parse at once.
+"""
+
+from __future__ import print_function
+import sys
+import threading
+
+# The innermost Capture of each thread
+_LOCAL = threading.local()
+
+
+def report(*args):
+    """
+    Print the args as print does, or keep them if this thread is capturing.
+
+    >>> report("ERROR:", "no such sort")
+    ERROR: no such sort
+    >>> with Capture() as captured:
+    ...     report("WARNING: kept")
+    >>> captured.getvalue()
+    'WARNING: kept\\n'
+    """
+    write(" ".join("%s" % (arg,) for arg in args) + "\n")
+
+
+def write(text):
+    """
+    Write text as it is, such as the output of a Capture that is reported again.
+
+    :param text: string
+    """
+    capture = getattr(_LOCAL, "capture", None)
+    if capture is None:
+        sys.stdout.write(text)
+    else:
+        capture.write(text)
+
+
+class Capture(object):
+    """
+    Keeps what this thread reports while it is entered. Captures can be nested, each keeps what
+    is reported while it is the innermost one.
+    """
+    def __init__(self):
+        self.lines = []
+        self.size = 0
+        self.outer = None
+
+    def __enter__(self):
+        self.outer = getattr(_LOCAL, "capture", None)
+        _LOCAL.capture = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _LOCAL.capture = self.outer
+        return False
+
+    def write(self, text):
+        """
+        Keep text as if it had been reported while the capture was entered.
+
+        :param text: string
+        """
+        self.lines.append(text)
+        self.size += len(text)
+
+    def tell(self):
+        """
+        :return: the length of everything kept so far
+        """
+        return self.size
+
+    def getvalue(self):
+        """
+        :return: everything reported while the capture was entered
+        """
+        return "".join(self.lines)
+
+
+def find(output, kind="ERROR"):
+    """
+    Pick the messages of a kind out of what was reported. The lines after a message that do not
+    start a message of their own are part of it.
+
+    >>> find("ERROR: no such sort\\nWARNING: kept\\nERROR: bad args\\n   you gave: []\\n")
+    ['no such sort', 'bad args\\n   you gave: []']
+    >>> find("WARNING: kept\\n", "WARNING")
+    ['kept']
+
+    :param output: what was reported, such as the value of a Capture
+    :param kind: "ERROR" or "WARNING"
+    :return: list of the messages of that kind, without the kind
+    """
+    found = []
+    current = None
+    for line in output.splitlines():
+        if line.startswith("ERROR: ") or line.startswith("WARNING: "):
+            current = None
+            if line.startswith(kind + ": "):
+                current = [line[len(kind) + 2:]]
+                found.append(current)
+        elif current is not None:
+            current.append(line)
+    return ["\n".join(lines) for lines in found]
+
+if __name__ == "__main__":
+    # pylint: disable=wrong-import-position
+    import doctest
+    doctest.testmod()
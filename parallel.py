@@ -0,0 +1,299 @@
+"""
+Parsing statements on several processes. Each worker gets a copy of the namespace once, when it
+starts, and then parses chunks of statements against it. The workers are kept by the container
+between batches, see WorkerPool, and what the parser reports about each statement comes back with
+it rather than being printed by the worker. The tokens come back in the compact form
+of the snapshot module rather than as pickled Tokens, and are made again as Tokens here. Like any
+parse, they are only kept, in the arena of the container, if the statement is added.
+
+Workers number quantified variables on from the counter of the namespace they were given, without
+knowing how many the statements before their chunk used. The names are moved up to where the
+counter of the container is when each statement is taken, which gives the names add_statement
+would have given them.
+"""
+
+from __future__ import print_function
+import multiprocessing
+import re
+from array import array
+from six import string_types
+
+# We need to use the first type of import if running this script directly and the second type of
+# import if we're using it in a package (such as for within Talos)
+try:
+    import high_level_parsing
+    import messages
+    import prototypes
+    import snapshot
+except ImportError:
+    import DCEC_Library.high_level_parsing as high_level_parsing
+    import DCEC_Library.messages as messages
+    import DCEC_Library.prototypes as prototypes
+    import DCEC_Library.snapshot as snapshot
+
+# The result parse_chunk gives a statement the worker failed on, which the container then parses
+# itself. The others are those of DCECContainer.add_statements.
+REPARSE = None
+
+# The most names the container can add to its namespace before the workers are given the
+# namespace again, see WorkerPool
+STALE_NAMES = 1024
+
+# The namespace of a worker process, see start_worker
+_NAMESPACE = None
+
+# The names of quantified variables in an S expression
+QUANT_NAMES = re.compile(r"(?<![^ (])QUANT[0-9]+(?![^ )])")
+
+
+def start_worker(namespace):
+    """
+    Keep the namespace a worker parses against. Runs once in each worker, when it starts.
+
+    :param namespace: copy of the namespace of the container
+    """
+    global _NAMESPACE
+    _NAMESPACE = namespace
+
+
+def parse_chunk(statements):
+    """
+    Parse a chunk of statements against the namespace of the worker. Every chunk starts from the
+    same quantifier counter, so chunks can be parsed in any order.
+
+    >>> namespace = prototypes.Namespace()
+    >>> namespace.add_basic_dcec()
+    >>> start_worker(namespace)
+    >>> strings, starts, ints, results = parse_chunk(["forAll x holds(x, t1)", "B(jack"])
+    >>> [result[0:4] for result in results]
+    [(0, 0, 1, ''), (-1, 1, 0, 'ERROR: parentheses mismatch error.\\n')]
+    >>> strings
+    ['forAll', 'QUANT0', 'holds', 't1']
+    >>> results[0][7:]
+    (0, '(forAll QUANT0 (holds QUANT0 t1))', True)
+
+    :param statements: strings to parse
+    :return: tuple of the string table, the start of each statement that parsed and the pairs of
+             ints of those statements (see snapshot.dump), and a tuple for each statement of its
+             result code, the counter before it was parsed, how far it moved the counter, what
+             the parser reported, and, if it parsed, its add_quants, add_atomics and
+             add_functions, its index in starts,
+             its S expression and whether check_additions found no conflict. The code is
+             REPARSE if parsing the statement raised an exception.
+    """
+    namespace = _NAMESPACE
+    counter = namespace.quant_map.get("TEMP", 0)
+    tokens = []
+    results = []
+    for statement in statements:
+        start = namespace.quant_map.get("TEMP", 0)
+        captured = messages.Capture()
+        try:
+            with captured:
+                addee, add_quants, add_atomics, add_functions = \
+                    high_level_parsing.tokenize_random_dcec(statement, namespace)
+        except Exception:  # pylint: disable=broad-except
+            # One statement the parser trips over should not lose the rest of the chunk. The
+            # container parses it again, and gets whatever went wrong there.
+            namespace.quant_map["TEMP"] = start
+            results.append((REPARSE, start, 0, ""))
+            continue
+        output = captured.getvalue()
+        moved = namespace.quant_map.get("TEMP", 0) - start
+        if isinstance(addee, bool) and not addee:
+            results.append((high_level_parsing.MALFORMED, start, moved, output))
+        elif addee == "":
+            results.append((high_level_parsing.EMPTY, start, moved, output))
+        else:
+            # Tokens are not currently stored, so they are not sent back
+            atomics = {}
+            for atomic in add_atomics:
+                if isinstance(atomic, string_types):
+                    atomics[atomic] = add_atomics[atomic]
+            if isinstance(addee, string_types):
+                expression = addee
+            else:
+                expression = addee.create_s_expression()
+            checked = not high_level_parsing.check_additions(namespace, add_atomics,
+                                                             add_functions)
+            results.append((high_level_parsing.ACCEPTED, start, moved, output, add_quants,
+                            atomics, add_functions, len(tokens), expression, checked))
+            tokens.append(addee)
+    namespace.quant_map["TEMP"] = counter
+    strings = snapshot.StringTable()
+    starts, ints = snapshot.encode_statements(tokens, strings.id_of)
+    return strings.strings, starts, array("i", ints), results
+
+
+class ParsedChunk(object):
+    """
+    A chunk parsed by parse_chunk, read back one statement at a time, in order.
+    """
+    def __init__(self, parsed, make):
+        strings, self.starts, ints, self.results = parsed
+        self.strings = [prototypes.SYMBOL_TABLE.intern(string) for string in strings]
+        self.decoder = snapshot.Decoder(self.strings, ints, make)
+        # The ids of the strings, made the first time a quantifier is renamed
+        self.ids = None
+        self.place = 0
+
+    def done(self):
+        """
+        :return: True once every statement of the chunk has been taken
+        """
+        return self.place == len(self.results)
+
+    def take(self, namespace):
+        """
+        Take the next statement of the chunk, naming its quantified variables and moving the
+        counter of the namespace on as parsing it there would have.
+
+        :param namespace: namespace of the container the statement is added to
+        :return: the result code, the tuple of the token, add_quants, add_atomics and
+                 add_functions if the code is ACCEPTED, whether the worker found no conflict
+                 in what the statement adds, and what the parser reported. The code is None if
+                 the statement has to be parsed again, because a name it would get is taken or
+                 the worker failed on it.
+        """
+        result = self.results[self.place]
+        self.place += 1
+        code, start, moved, output = result[0:4]
+        if code is REPARSE:
+            return None, None, False, ""
+        counter = namespace.quant_map.get("TEMP", 0)
+        namespace.quant_map["TEMP"] = counter + moved
+        if code != high_level_parsing.ACCEPTED:
+            return code, None, False, output
+        add_quants, add_atomics, add_functions, place, expression, checked = result[4:]
+        if moved == 0 or counter == start:
+            addee = self.decoder.decode(self.starts[place], {})
+            snapshot.keep_expression(addee, expression)
+            return code, (addee, add_quants, add_atomics, add_functions), checked, output
+        names = {}
+        for number in range(0, moved):
+            name = "QUANT" + str(counter + number)
+            if name in namespace.atomics:
+                return None, None, False, ""
+            names["QUANT" + str(start + number)] = prototypes.SYMBOL_TABLE.intern(name)
+        if self.ids is None:
+            self.ids = dict((string, index) for index, string in enumerate(self.strings))
+        strings = list(self.strings)
+        for old, new in names.items():
+            if old in self.ids:
+                strings[self.ids[old]] = new
+        decoder = snapshot.Decoder(strings, self.decoder.ints, self.decoder.make)
+        renamed_quants = {}
+        for key, value in add_quants.items():
+            renamed_quants[names.get(key, key)] = names.get(value, value)
+        renamed_atomics = {}
+        for key, value in add_atomics.items():
+            renamed_atomics[names.get(key, key)] = value
+        addee = decoder.decode(self.starts[place], {})
+        snapshot.keep_expression(addee, QUANT_NAMES.sub(lambda match: names.get(match.group(0),
+                                                                               match.group(0)),
+                                                        expression))
+        return code, (addee, renamed_quants, renamed_atomics, add_functions), checked, output
+
+
+class WorkerPool(object):
+    """
+    The worker processes a container parses batches of statements on, kept from one batch to the
+    next. The workers parse against the copy of the namespace they were given when they started.
+    While the container only adds to its namespace by adding statements, the names those add are
+    kept here and the same workers go on being used: a statement the workers parsed without one
+    of those names is parsed again by the container (see DCECContainer.add_statements). The
+    workers are started again, with the namespace as it is then, once it was changed any other
+    way, or once there are more than STALE_NAMES of those names.
+    """
+    def __init__(self):
+        self.pool = None
+        self.processes = None
+        # The namespace the workers were given a copy of, and the version of it the names are
+        # up to
+        self.source = None
+        self.namespace_version = None
+        # Names added to the namespace since the workers were started
+        self.names = set()
+
+    def start(self, namespace, processes=None):
+        """
+        Make sure there are workers for the namespace, starting them again if theirs is out of
+        date.
+
+        :param namespace: namespace of the container
+        :param processes: number of worker processes, by default one for each CPU
+        :return: set of the names added to the namespace since the workers were given a copy of it
+        """
+        if self.pool is None or processes != self.processes or namespace is not self.source or \
+                namespace.version != self.namespace_version or len(self.names) > STALE_NAMES:
+            self.close()
+            self.pool = multiprocessing.Pool(processes, start_worker, (namespace,))
+            self.processes = processes
+            self.source = namespace
+            self.namespace_version = namespace.version
+            self.names = set()
+        return set(self.names)
+
+    def record(self, namespace, version, names):
+        """
+        Note the names adding a statement added to the namespace.
+
+        :param namespace: namespace of the container
+        :param version: version of the namespace before the statement was added
+        :param names: names of the atomics and inline functions the statement added
+        """
+        if namespace is not self.source or version != self.namespace_version:
+            # Changed some other way, so the workers are started again before the next batch
+            self.source = None
+            return
+        self.names.update(names)
+        self.namespace_version = namespace.version
+
+    def close(self):
+        """
+        Stop the workers.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.source = None
+
+    def parse_statements(self, container, statements, chunksize=256):
+        """
+        Parse statements for a container on the workers, as DCECContainer.parse_captured would
+        parse them one after another. Tokens are not sent to the workers. start has to be called
+        first.
+
+        :param container: DCECContainer the statements are added to
+        :param statements: iterable of strings or Tokens
+        :param chunksize: number of statements sent to a worker at a time
+        :return: iterator of a tuple for each statement of the statement, the quantifier counter
+                 before it was taken, its result code and parse as from parse_statement, whether
+                 a worker found no conflict in what it adds to the namespace it was given, and
+                 what the parser reported about it
+        """
+        statements = list(statements)
+        texts = [statement for statement in statements if isinstance(statement, string_types)]
+        chunks = [texts[place:place + chunksize] for place in range(0, len(texts), chunksize)]
+        namespace = container.namespace
+        parsed_chunks = self.pool.imap(parse_chunk, chunks)
+        chunk = None
+        for statement in statements:
+            counter = namespace.quant_map.get("TEMP")
+            code = None
+            if isinstance(statement, string_types):
+                if chunk is None or chunk.done():
+                    chunk = ParsedChunk(next(parsed_chunks), high_level_parsing.Token)
+                code, parsed, checked, output = chunk.take(namespace)
+                if code is None and counter is not None:
+                    namespace.quant_map["TEMP"] = counter
+            if code is None:
+                code, parsed, output = container.parse_captured(statement)
+                checked = False
+            yield statement, counter, code, parsed, checked, output
+
+if __name__ == "__main__":
+    # pylint: disable=wrong-import-position
+    import doctest
+    doctest.testmod()
@@ -3,15 +3,301 @@
 """
 
 from __future__ import print_function
+import hashlib
+import itertools
+import os
+import pickle
+import threading
 from six import string_types
+from six.moves import intern  # pylint: disable=locally-disabled,redefined-builtin
 from six.moves import input  # pylint: disable=locally-disabled,redefined-builtin
 
 # We need to use the first type of import if running this script directly and the second type of
 # import if we're using it in a package (such as for within Talos)
 try:
     import cleaning
+    import lexer
+    import messages
 except ImportError:
     import DCEC_Library.cleaning as cleaning
+    import DCEC_Library.lexer as lexer
+    import DCEC_Library.messages as messages
+
+try:
+    from collections.abc import KeysView, MutableMapping
+except ImportError:
+    from collections import KeysView, MutableMapping
+
+# Namespace versions are all drawn from this one counter, so a version also tells namespaces apart
+VERSIONS = itertools.count(1)
+
+# The frozen namespaces made by base_namespace, by what was added to them
+BASES = {}
+
+# Goes up whenever the layout of the files written by Namespace.load_prototypes changes
+PROTOTYPE_CACHE_FORMAT = 1
+
+
+class SymbolTable(object):
+    """
+    Gives every sort, function and atomic name a small integer id, and keeps one copy of each
+    name for the whole process. Names that come from the table are the same object wherever they
+    are used, so comparing them and looking them up in dicts only compares pointers. Several
+    threads can give out ids at once.
+
+    >>> table = SymbolTable()
+    >>> table.id_of("Agent"), table.id_of("Moment"), table.id_of("Agent")
+    (0, 1, 0)
+    >>> table.intern("".join(["Age", "nt"])) is table.name_of(0)
+    True
+    """
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def id_of(self, name):
+        """
+        :param name: sort, function or atomic
+        :return: id of the name, giving it the next free id if it does not have one yet
+        """
+        symbol = self.ids.get(name)
+        if symbol is None:
+            with self.lock:
+                # Another thread may have given it an id while this one waited
+                symbol = self.ids.get(name)
+                if symbol is None:
+                    if isinstance(name, str):
+                        name = intern(name)
+                    symbol = len(self.names)
+                    self.names.append(name)
+                    self.ids[name] = symbol
+        return symbol
+
+    def name_of(self, symbol):
+        """
+        :param symbol: id of a name
+        :return: the name
+        """
+        return self.names[symbol]
+
+    def intern(self, name):
+        """
+        :param name: sort, function or atomic
+        :return: the copy of the name kept by the table
+        """
+        return self.names[self.id_of(name)]
+
+# The symbols of every namespace and token in the process
+SYMBOL_TABLE = SymbolTable()
+
+
+class Layer(MutableMapping):
+    """
+    A dict of a namespace that is made on top of the same dict of its base. Lookups fall through
+    to the base, while anything set is kept in the layer, so the base is shared and never copied.
+
+    >>> base = {"Object": [], "Agent": ["Object"]}
+    >>> sorts = Layer(base)
+    >>> sorts["Greeting"] = ["Object"]
+    >>> "Agent" in sorts.keys(), "Greeting" in base
+    (True, False)
+    >>> sorted(sorts)
+    ['Agent', 'Greeting', 'Object']
+    """
+    def __init__(self, base):
+        self.base = base
+        self.local = {}
+
+    def __getitem__(self, key):
+        if key in self.local:
+            return self.local[key]
+        return self.base[key]
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+
+    def __delitem__(self, key):
+        # Only what was set in the layer can be removed, the base stays as it is
+        del self.local[key]
+
+    def __contains__(self, key):
+        return key in self.local or key in self.base
+
+    def __iter__(self):
+        # In the order of the base updated with the layer, as a flat copy would be
+        for key in self.base:
+            yield key
+        for key in self.local:
+            if key not in self.base:
+                yield key
+
+    def __len__(self):
+        return len(self.local) + sum(1 for key in self.base if key not in self.local)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        if key in self.local:
+            return self.local[key]
+        return self.base.get(key, default)
+
+    def keys(self):
+        return KeysView(self)
+
+
+def local_dict(mapping):
+    """
+    :param mapping: dict of a namespace, or a Layer of one
+    :return: the dict that what is set in the mapping is kept in
+    """
+    if isinstance(mapping, Layer):
+        return mapping.local
+    return mapping
+
+
+def base_namespace(dcec=True, logic=False, numerics=False):
+    """
+    Get a frozen namespace with the basic DCEC* sorts and functions, and the logic and numeric
+    functions if asked for. There is one such namespace per process for each set of additions,
+    so making a Namespace on top of one costs the same however much it holds.
+
+    >>> base_namespace(logic=True) is base_namespace(logic=True)
+    True
+    >>> namespace = Namespace(base_namespace(logic=True))
+    >>> namespace.add_code_atomic("jack", "Agent")
+    True
+    >>> "jack" in base_namespace(logic=True).atomics, "and" in namespace.functions
+    (False, True)
+
+    :param dcec: whether to add the DCEC* sorts and functions
+    :param logic: whether to add the logic functions
+    :param numerics: whether to add the numeric functions
+    :return: frozen Namespace
+    """
+    key = (dcec, logic, numerics)
+    if key not in BASES:
+        namespace = Namespace()
+        if dcec:
+            namespace.add_basic_dcec()
+        if logic:
+            namespace.add_basic_logic()
+        if numerics:
+            namespace.add_basic_numerics()
+        BASES[key] = namespace.freeze()
+    return BASES[key]
+
+
+def compile_prototypes(lines, sorts):
+    """
+    Read prototype lines, as add_text_function takes them, all at once. Every typedef is found
+    before the other lines are read, so a line can use a sort that is defined further down, and
+    the sorts are put in an order where each comes after the sorts it inherits from. Blank lines
+    and anything after a ';' or a '#' are skipped.
+
+    >>> compiled, errors = compile_prototypes(["Boolean greet Agent Greeting",
+    ...                                        "typedef Greeting Action", "Greeting hello"],
+    ...                                       ["Object", "Agent", "Event", "Action", "Boolean"])
+    >>> sorts, functions, atomics = compiled
+    >>> sorts, atomics
+    ([('Greeting', ['Action'])], [('hello', 'Greeting')])
+    >>> functions
+    [('greet', 'Boolean', ['Agent', 'Greeting'])]
+    >>> compile_prototypes(["typedef A B", "Boolean"], [])[1]
+    ['line 1: sort B is not defined', 'line 2: The function prototype was not formatted correctly.']
+
+    :param lines: prototype lines
+    :param sorts: the sorts that are already defined
+    :return: tuple of the sorts as (name, inheritance), the functions as (name, return sort,
+             arg sorts) and the atomics as (name, sort), all in the order they should be added,
+             and the list of errors
+    """
+    errors = []
+    rows = []
+    defined = {}
+    for number, line in enumerate(lines, 1):
+        for mark in ";#":
+            line = line.split(mark, 1)[0]
+        if not line.strip():
+            continue
+        temp = line.replace("(", " ").replace(")", " ")
+        args = cleaning.strip_white_space(temp).replace("`", "").split(",")
+        rows.append((number, args))
+        if args[0].lower() == "typedef":
+            if len(args) < 2:
+                errors.append("line " + str(number) + ": Cannot define the sort")
+            elif args[1] not in defined:
+                defined[args[1]] = (number, args[2:])
+    known = set(sorts)
+    known.update(defined)
+    # Order the new sorts so that each comes after the sorts it inherits from
+    order = []
+    state = {}
+    for name in defined:
+        stack = [name]
+        while stack:
+            sort = stack[-1]
+            if state.get(sort) is None:
+                state[sort] = "open"
+                number, parents = defined[sort]
+                for parent in parents:
+                    if parent in defined and state.get(parent) is None:
+                        stack.append(parent)
+                    elif parent in defined and state.get(parent) == "open":
+                        errors.append("line " + str(number) + ": sort " + sort + " inherits from "
+                                      "itself")
+                    elif parent not in known:
+                        errors.append("line " + str(number) + ": sort " + parent + " is not "
+                                      "defined")
+                continue
+            stack.pop()
+            if state[sort] == "open":
+                state[sort] = "done"
+                if sort not in sorts:
+                    order.append((sort, defined[sort][1]))
+    functions = []
+    atomics = []
+    for number, args in rows:
+        if args[0].lower() == "typedef":
+            continue
+        return_type = ""
+        func_name = ""
+        if len(args) == 2:
+            # Find the sort, then the name
+            for arg in args:
+                if arg in known:
+                    return_type = arg
+                    args.remove(arg)
+                    break
+            for arg in args:
+                if arg not in known:
+                    func_name = arg
+                    break
+            if return_type == "" or func_name == "":
+                errors.append("line " + str(number) + ": The atomic prototype was not formatted "
+                              "correctly.")
+            else:
+                atomics.append((func_name, return_type))
+            continue
+        # Find the return sort, then the name, then the sorts of the args
+        if args[0] in known:
+            return_type = args.pop(0)
+        for arg in args:
+            if arg not in known:
+                func_name = arg
+                args.remove(arg)
+                break
+        func_args = [arg for arg in args if arg in known]
+        if return_type == "" or func_name == "" or func_args == []:
+            errors.append("line " + str(number) + ": The function prototype was not formatted "
+                          "correctly.")
+        else:
+            functions.append((func_name, return_type, func_args))
+    return (order, functions, atomics), errors
 
 
 class Namespace:
@@ -25,12 +311,117 @@ class Namespace:
     True
     >>> namespace.add_text_function("Boolean greet Agent Greeting")
     True
+    >>> namespace.add_code_operator("=>", "implies")
+    True
+    >>> version = namespace.version
+    >>> namespace.add_code_atomic("jack", "Agent")
+    True
+    >>> namespace.version > version
+    True
+
+    A namespace can be made on top of a frozen base namespace, which cannot change underneath
+    it. It sees everything in the base but only keeps what is added to it.
+
+    >>> overlay = Namespace(namespace)
+    Traceback (most recent call last):
+    ...
+    ValueError: the base namespace is not frozen, see Namespace.freeze
+    >>> overlay = Namespace(namespace.freeze())
+    >>> overlay.add_code_function("greet", "Boolean", ["Agent", "Object"])
+    True
+    >>> len(overlay.functions["greet"]), len(namespace.functions["greet"])
+    (2, 1)
+    >>> namespace.add_code_atomic("james", "Agent")
+    ERROR: the namespace is frozen, make a Namespace on top of it to add to it.
+    False
     """
-    def __init__(self):
-        self.functions = {}
-        self.atomics = {}
-        self.sorts = {}
+    def __init__(self, base=None):
+        self.base = base
+        self.frozen = False
+        if base is None:
+            self.functions = {}
+            self.atomics = {}
+            self.sorts = {}
+            self.ancestors = {}
+            # The overloads of every function by arity, see add_code_function
+            self.overloads = {}
+            # The ids of the return and arg sorts of every overload, by function
+            self.signatures = {}
+            # Shared until an operator is added, see add_code_operator
+            self.operators = lexer.DEFAULT_OPERATORS
+        else:
+            if not base.frozen:
+                raise ValueError("the base namespace is not frozen, see Namespace.freeze")
+            self.functions = Layer(base.functions)
+            self.atomics = Layer(base.atomics)
+            self.sorts = Layer(base.sorts)
+            self.ancestors = Layer(base.ancestors)
+            self.overloads = Layer(base.overloads)
+            self.signatures = Layer(base.signatures)
+            self.operators = base.operators
         self.quant_map = {"TEMP": 0}
+        # The overloads that fit the arg sorts seen so far, by function. Not shared with the base,
+        # since the sorts seen here may not be in the base.
+        self.resolutions = {}
+        # Goes up whenever an add_code_* call changes the namespace, so anything worked out
+        # from an older version (such as a cached parse) can tell that it is out of date
+        self.version = next(VERSIONS)
+
+    def copy(self):
+        """
+        Copy the namespace, so that adding to either one does not change the other. The base is
+        shared, since it cannot change.
+
+        >>> namespace = Namespace(base_namespace())
+        >>> namespace.add_code_atomic("jack", "Agent")
+        True
+        >>> copied = namespace.copy()
+        >>> copied.add_code_function("greet", "Boolean", ["Agent"])
+        True
+        >>> "greet" in namespace.functions, copied.atomics["jack"]
+        (False, 'Agent')
+
+        :return: new Namespace
+        """
+        namespace = Namespace(self.base)
+        functions = local_dict(namespace.functions)
+        for name, items in local_dict(self.functions).items():
+            functions[name] = list(items)
+        overloads = local_dict(namespace.overloads)
+        for name, arities in local_dict(self.overloads).items():
+            overloads[name] = dict((arity, list(items)) for arity, items in arities.items())
+        signatures = local_dict(namespace.signatures)
+        for name, ids in local_dict(self.signatures).items():
+            signatures[name] = set(ids)
+        # Sorts and atomics are never changed once added, so their values can be shared
+        local_dict(namespace.atomics).update(local_dict(self.atomics))
+        local_dict(namespace.sorts).update(local_dict(self.sorts))
+        local_dict(namespace.ancestors).update(local_dict(self.ancestors))
+        namespace.quant_map = dict(self.quant_map)
+        if self.operators is lexer.DEFAULT_OPERATORS or \
+                (self.base is not None and self.operators is self.base.operators):
+            namespace.operators = self.operators
+        else:
+            namespace.operators = self.operators.copy()
+        return namespace
+
+    def freeze(self):
+        """
+        Stop the namespace from being added to, so that it can be used as the base of others.
+
+        :return: the namespace
+        """
+        self.frozen = True
+        return self
+
+    def is_frozen(self):
+        """
+        :return: True, after printing an error, if the namespace cannot be added to
+        """
+        if self.frozen:
+            messages.report(
+                "ERROR: the namespace is frozen, make a Namespace on top of it to add to it.")
+        return self.frozen
 
     def add_code_sort(self, name, inheritance=None):
         """
@@ -43,16 +434,30 @@ class Namespace:
         if inheritance is None:
             inheritance = []
         if not (isinstance(name, string_types) and isinstance(inheritance, list)):
-            print("ERROR: function addCodeSort takes arguments of the form, string, "
-                  "list of strings")
+            messages.report("ERROR: function addCodeSort takes arguments of the form, string, "
+                            "list of strings")
+            return False
+        if self.is_frozen():
             return False
+        name = SYMBOL_TABLE.intern(name)
+        inheritance = [SYMBOL_TABLE.intern(thing) for thing in inheritance]
         for thing in inheritance:
             if thing not in self.sorts.keys():
-                print("ERROR: sort " + thing + " is not previously defined")
+                messages.report("ERROR: sort " + thing + " is not previously defined")
                 return False
         if name in self.sorts.keys():
             return True
         self.sorts[name] = inheritance
+        # Every sort above the new one and the fewest steps up to it. The sorts it inherits
+        # from are already in the table, so their ancestors only need one more step.
+        ancestors = {}
+        for parent in inheritance:
+            ancestors[parent] = 1
+            for ancestor, distance in self.ancestors[parent].items():
+                if distance + 1 < ancestors.get(ancestor, distance + 2):
+                    ancestors[ancestor] = distance + 1
+        self.ancestors[name] = ancestors
+        self.version = next(VERSIONS)
         return True
 
     def add_text_sort(self, expression):
@@ -71,7 +476,7 @@ class Namespace:
         elif len(args) > 2:
             self.add_code_sort(args[1], args[2:])
         else:
-            print("ERROR: Cannot define the sort")
+            messages.report("ERROR: Cannot define the sort")
             return False
 
     def find_atomic_type(self, name):
@@ -91,16 +496,121 @@ class Namespace:
         :param args_types:
         :return:
         """
+        if self.is_frozen():
+            return False
+        name = SYMBOL_TABLE.intern(name)
+        return_type = SYMBOL_TABLE.intern(return_type)
+        args_types = [SYMBOL_TABLE.intern(arg) for arg in args_types]
         item = [return_type, args_types]
+        signature = tuple(SYMBOL_TABLE.id_of(sort) for sort in [return_type] + args_types)
         if name in self.functions.keys():
-            if item in self.functions[name]:
+            if signature in self.signatures[name]:
                 pass
             else:
+                if self.base is not None and name not in self.functions.local:
+                    # The lists belong to the base namespace, so change copies of them
+                    self.functions[name] = list(self.functions[name])
+                    self.overloads[name] = dict((arity, list(items)) for arity, items
+                                                in self.overloads[name].items())
+                    self.signatures[name] = set(self.signatures[name])
                 self.functions[name].append(item)
+                self.overloads[name].setdefault(len(args_types), []).append(item)
+                self.signatures[name].add(signature)
+                self.resolutions.pop(name, None)
+                self.version = next(VERSIONS)
         else:
             self.functions[name] = [item]
+            self.overloads[name] = {len(args_types): [item]}
+            self.signatures[name] = set([signature])
+            self.version = next(VERSIONS)
         return True
 
+    def max_arity(self, name):
+        """
+        :param name: name of a function in the namespace
+        :return: the most args any overload of the function takes
+        """
+        return max(self.overloads[name])
+
+    def overload_levels(self, item, arg_sorts, fluent_places=()):
+        """
+        Check whether an overload takes args of the given sorts.
+
+        :param item: overload, as a return sort and a list of arg sorts
+        :param arg_sorts: sorts of the args, at least as many as the overload takes
+        :param fluent_places: places of args that can stand in for a Fluent whatever their sort
+        :return: list of how far each arg sort is from the sort the overload takes, or None if
+                 the overload does not fit
+        """
+        levels = []
+        for arg in range(0, len(item[1])):
+            returnthing = self.no_conflict(arg_sorts[arg], item[1][arg], 0)
+            if returnthing[0]:
+                levels.append(returnthing[1])
+            # Fluents are special, they can take bools, etc
+            elif item[1][arg] != "Fluent" or arg not in fluent_places:
+                return None
+        return levels
+
+    def resolve_overloads(self, name, arg_sorts, fluent_places=()):
+        """
+        Find every overload of a function that takes its first args of the given sorts. The
+        answer is kept until an overload is added to the function, so a function is only
+        matched against each set of arg sorts once however many overloads it has.
+
+        >>> namespace = Namespace()
+        >>> namespace.add_basic_dcec()
+        >>> namespace.add_code_function("greet", "Boolean", ["Agent", "Moment"])
+        True
+        >>> namespace.add_code_function("greet", "Boolean", ["Object"])
+        True
+        >>> namespace.resolve_overloads("greet", ("Self", "Moment"))
+        [(['Boolean', ['Agent', 'Moment']], [1, 0]), (['Boolean', ['Object']], [1])]
+
+        :param name: name of a function in the namespace
+        :param arg_sorts: sorts of the args given to the function
+        :param fluent_places: places of args that can stand in for a Fluent whatever their sort
+        :return: list of the overloads that fit, in the order they were added, each with the
+                 list of its overload_levels
+        """
+        key = (tuple(arg_sorts), tuple(fluent_places))
+        resolutions = self.resolutions.setdefault(name, {})
+        if key not in resolutions:
+            fits = []
+            for item in self.functions[name]:
+                if len(item[1]) <= len(arg_sorts):
+                    levels = self.overload_levels(item, arg_sorts, fluent_places)
+                    if levels is not None:
+                        fits.append((item, levels))
+            resolutions[key] = fits
+        return resolutions[key]
+
+    def match_overload(self, name, arg_sorts):
+        """
+        Find the first overload of a function that takes exactly the given args. An arg whose
+        sort is None fits nothing. The answer is kept as in resolve_overloads.
+
+        :param name: name of a function
+        :param arg_sorts: sorts of the args given to the function
+        :return: the overload, or None if the function has none that fits
+        """
+        if name not in self.overloads:
+            return None
+        key = (tuple(arg_sorts), None)
+        resolutions = self.resolutions.setdefault(name, {})
+        if key not in resolutions:
+            match = None
+            for item in self.overloads[name].get(len(arg_sorts), []):
+                for arg in range(0, len(arg_sorts)):
+                    if arg_sorts[arg] is None or \
+                            not self.no_conflict(arg_sorts[arg], item[1][arg], 0)[0]:
+                        break
+                else:
+                    match = item
+                    break
+            resolutions[key] = match
+        return resolutions[key]
+
     def add_text_function(self, expression):
         """
 
@@ -135,7 +645,7 @@ class Namespace:
                 func_args.append(arg)
         # Error Checking
         if return_type == "" or func_name == "" or func_args == []:
-            print("ERROR: The function prototype was not formatted correctly.")
+            messages.report("ERROR: The function prototype was not formatted correctly.")
             return False
         # Add the function
         return self.add_code_function(func_name, return_type, func_args)
@@ -147,16 +657,21 @@ class Namespace:
         :param atomic:
         :return:
         """
+        if self.is_frozen():
+            return False
+        name = SYMBOL_TABLE.intern(name)
+        atomic = SYMBOL_TABLE.intern(atomic)
         if name in self.atomics.keys():
             if atomic in self.atomics[name]:
                 return True
             else:
-                print("ERROR: item " + name + " was previously defined as "
-                      "an " + self.atomics[name] + ", you cannot overload "
-                      "atomics.")
+                messages.report("ERROR: item " + name + " was previously defined as "
+                                "an " + self.atomics[name] + ", you cannot overload "
+                                "atomics.")
                 return False
         else:
             self.atomics[name] = atomic
+            self.version = next(VERSIONS)
         return True
 
     def add_text_atomic(self, expression):
@@ -186,6 +701,120 @@ class Namespace:
                 break
         return self.add_code_atomic(func_name, return_type)
 
+    def add_code_operator(self, symbol, function_name):
+        """
+        Add an infix symbol that the parser rewrites into the given function, for example
+        add_code_operator("=>", "implies") lets statements be written as "a => b".
+
+        :param symbol:
+        :param function_name:
+        :return:
+        """
+        if not (isinstance(symbol, string_types) and isinstance(function_name, string_types)):
+            messages.report(
+                "ERROR: function addCodeOperator takes arguments of the form, string, string")
+            return False
+        if self.is_frozen():
+            return False
+        # The table is shared with the base or the default one until the first operator is added
+        if self.operators is lexer.DEFAULT_OPERATORS or \
+                (self.base is not None and self.operators is self.base.operators):
+            self.operators = self.operators.copy()
+        if not self.operators.add(symbol, function_name):
+            return False
+        self.version = next(VERSIONS)
+        return True
+
+    def add_prototypes(self, lines, compiled=None):
+        """
+        Add many prototypes at once, see compile_prototypes. Nothing is printed, and nothing is
+        added unless every line can be.
+
+        >>> namespace = Namespace()
+        >>> namespace.add_basic_dcec()
+        >>> namespace.add_prototypes(["Agent jack", "Boolean greet Agent Greeting",
+        ...                           "typedef Greeting Action"])
+        []
+        >>> namespace.functions["greet"]
+        [['Boolean', ['Agent', 'Greeting']]]
+        >>> namespace.add_prototypes(["Moment jack", "Boolean wave Agent"])
+        ['item jack was previously defined as an Agent, you cannot overload atomics.']
+        >>> "wave" in namespace.functions
+        False
+
+        :param lines: prototype lines
+        :param compiled: what compile_prototypes gave for the lines, if it is already known
+        :return: list of errors, empty if the prototypes were added
+        """
+        if self.frozen:
+            return ["the namespace is frozen, make a Namespace on top of it to add to it."]
+        if compiled is None:
+            compiled, errors = compile_prototypes(lines, self.sorts)
+            if errors:
+                return errors
+        sorts, functions, atomics = compiled
+        errors = []
+        seen = {}
+        for name, atomic in atomics:
+            previous = self.atomics.get(name, seen.get(name))
+            if previous is not None and atomic not in previous:
+                errors.append("item " + name + " was previously defined as an " + previous +
+                              ", you cannot overload atomics.")
+            seen.setdefault(name, atomic)
+        if errors:
+            return errors
+        for name, inheritance in sorts:
+            self.add_code_sort(name, inheritance)
+        for name, return_type, args_types in functions:
+            self.add_code_function(name, return_type, args_types)
+        for name, atomic in atomics:
+            self.add_code_atomic(name, atomic)
+        return []
+
+    def load_prototypes(self, filename, cache_filename=None):
+        """
+        Add the prototypes in a file, as add_prototypes does. What the lines compile to is written
+        to a cache file, together with a hash of the file and of the sorts it was compiled
+        against, and read back instead of the file the next time while both are the same.
+
+        :param filename: file of prototype lines
+        :param cache_filename: where to keep the compiled prototypes, defaults to the filename with
+                               ".compiled" added. False turns the cache off.
+        :return: list of errors, empty if the prototypes were added
+        """
+        with open(filename, "rb") as source:
+            content = source.read()
+        if cache_filename is None:
+            cache_filename = filename + ".compiled"
+        digest = hashlib.sha1(content)
+        digest.update("\0".join(sorted(self.sorts)).encode("utf-8"))
+        digest = digest.hexdigest()
+        if cache_filename:
+            try:
+                with open(cache_filename, "rb") as cache:
+                    cached = pickle.load(cache)
+                if cached[0] == PROTOTYPE_CACHE_FORMAT and cached[1] == digest:
+                    return self.add_prototypes(None, cached[2])
+            except (IOError, OSError, EOFError, IndexError, TypeError, ValueError,
+                    pickle.UnpicklingError):
+                # A missing or unreadable cache is made again
+                pass
+        if not isinstance(content, str):
+            content = content.decode("utf-8")
+        compiled, errors = compile_prototypes(content.splitlines(), self.sorts)
+        if errors:
+            return errors
+        if cache_filename:
+            try:
+                # Write the whole cache before it replaces the old one, so no one reads half
+                with open(cache_filename + ".tmp", "wb") as cache:
+                    pickle.dump((PROTOTYPE_CACHE_FORMAT, digest, compiled), cache, 2)
+                os.rename(cache_filename + ".tmp", cache_filename)
+            except (IOError, OSError):
+                # The prototypes are still added, they are just compiled again next time
+                pass
+        return self.add_prototypes(None, compiled)
+
     def add_basic_dcec(self):
         """
         This adds the DCEC* sorts and functions to the current namespace
@@ -262,22 +891,29 @@ class Namespace:
         self.add_code_function("equals", "Boolean", ["Numeric", "Numeric"])
 
     def no_conflict(self, type1, type2, level):
-        if type1 == "?":
-            return True, level
-        elif type1 == type2:
+        """
+        Check whether something of sort type1 can be used where sort type2 is expected, using the
+        table of ancestors kept by add_code_sort.
+
+        >>> namespace = Namespace()
+        >>> namespace.add_basic_dcec()
+        >>> namespace.no_conflict("Self", "Object", 0)
+        (True, 1)
+        >>> namespace.no_conflict("Agent", "Moment", 2)
+        (False, 2)
+
+        :param type1: sort of the thing, or "?" if it is not known
+        :param type2: sort that is expected
+        :param level: number the distance is added to
+        :return: whether the sorts fit, and level plus the fewest inheritance steps from type1 up
+                 to type2
+        """
+        if type1 == "?" or type1 == type2:
             return True, level
-        elif type2 in self.sorts[type1]:
-            return True, level + 1
-        else:
-            returnlist = []
-            for i in self.sorts[type1]:
-                recurse_return = self.no_conflict(i, type2, level + 1)
-                if recurse_return[0]:
-                    returnlist.append([recurse_return[1]])
-            if len(returnlist) > 0:
-                return True, min(returnlist)[0]
-            else:
-                return False, level
+        distance = self.ancestors[type1].get(type2)
+        if distance is None:
+            return False, level
+        return True, level + distance
 
     def print_namespace(self):
         """
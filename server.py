@@ -0,0 +1,435 @@
+"""
+A long-running service that keeps named containers in memory and answers requests for them, so
+that tools calling into the library pay for the imports and the basic namespace once rather than
+on every call. Requests and responses are JSON objects, one per line, read from a Unix socket or
+from stdin and written back in the order the requests came in:
+
+    {"id": 1, "op": "add_statement", "container": "talos", "statement": "Agent jack"}
+    {"id": 1, "ok": true, "result": true, "messages": []}
+
+The ops are parse, add_statement, add_statements, sort_of and render, see ContainerService.call.
+A container is made on first use on top of the shared base namespace, or loaded at start with
+--load. Each container has a thread of its own that its requests are parsed and added on, so
+the event loop only moves lines, and reads of statements already added are answered from the
+latest version of the container without waiting for that thread. What the library reports while
+a request is answered is kept on that thread (see messages.Capture) and sent back as the messages
+of the response.
+
+Each connection has at most --queue requests in progress. Once it has that many, the service
+stops reading from it until the oldest is answered, so a client that sends faster than it reads
+is held back by its own socket.
+
+Needs Python 3.5 or later, unlike the rest of the library.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from six import string_types
+
+# We need to use the first type of import if running this script directly and the second type of
+# import if we're using it in a package (such as for within Talos)
+try:
+    import dcec_container
+    import messages
+    import prototypes
+except ImportError:
+    import DCEC_Library.dcec_container as dcec_container
+    import DCEC_Library.messages as messages
+    import DCEC_Library.prototypes as prototypes
+
+# The most requests a connection has in progress before the service stops reading from it
+QUEUE_SIZE = 64
+
+# The longest request line read, in bytes. A socket is read ahead by up to twice this, so it also
+# bounds what a connection holds beyond the requests in progress
+LINE_LIMIT = 1 << 20
+
+
+class ServiceError(Exception):
+    """
+    A request that cannot be answered, sent back as the error of the response.
+    """
+
+
+def error_line(message):
+    """
+    :return: bytes of the response line to a request that could not be read
+    """
+    return (json.dumps({"ok": False, "error": message}) + "\n").encode("utf-8")
+
+
+class ContainerService(object):
+    """
+    The containers the service holds, and the ops that can be asked of them.
+    """
+    def __init__(self, dcec=True, logic=True, numerics=False):
+        self.base = prototypes.base_namespace(dcec, logic, numerics)
+        self.containers = {}
+        self.executors = {}
+
+    def container(self, name):
+        """
+        Get a container by name, making it if there is none.
+
+        :param name: name of the container
+        :return: DCECContainer
+        """
+        if not isinstance(name, string_types):
+            raise ServiceError("the container name " + repr(name) + " is not a string.")
+        if name not in self.containers:
+            self.adopt(name, dcec_container.DCECContainer(prototypes.Namespace(self.base)))
+        return self.containers[name]
+
+    def adopt(self, name, container):
+        """
+        Hold a container under a name, such as one loaded from a file.
+
+        :param name: name of the container
+        :param container: DCECContainer
+        """
+        if container.versions is None:
+            container.enable_versions()
+        self.containers[name] = container
+        if name not in self.executors:
+            self.executors[name] = ThreadPoolExecutor(max_workers=1)
+
+    def call(self, request):
+        """
+        Answer a request. Runs on the thread of the container, except for reads by index.
+
+        >>> service = ContainerService()
+        >>> service.call({"op": "add_statement", "statement": "Agent jack"})
+        True
+        >>> service.call({"op": "parse", "statement": "B(jack, t1, holds(f, t1))"})
+        {'code': 0, 'expression': '(B jack t1 (holds f t1))', 'sort': 'Boolean'}
+        >>> service.call({"op": "sort_of", "statement": "jack"})
+        'Agent'
+        >>> service.call({"op": "add_statements", "statements": ["Agent jack", "B(jack"]})
+        ERROR: parentheses mismatch error.
+        [1, -1]
+        >>> service.call({"op": "render", "index": 0, "notation": "F"})
+        'jack'
+
+        :param request: dict of the op, the container (by default "default") and the arguments
+                        of the op: statement or statements, and index and notation ("S" or "F")
+        :return: what the op gives, which can be sent as JSON
+        """
+        op = request.get("op")
+        container = self.container(request.get("container", "default"))
+        notation = request.get("notation", "S")
+        if op == "add_statement":
+            return container.add_statement(self.statement(request))
+        elif op == "add_statements":
+            statements = request.get("statements")
+            if not isinstance(statements, list) or \
+                    not all(isinstance(statement, string_types) for statement in statements):
+                raise ServiceError("add_statements takes a list of strings.")
+            errors = {}
+            warnings = {}
+            results = container.add_statements(statements, errors, warnings=warnings)
+            # Reported in the order of the statements, as add_statement would have
+            for index in range(0, len(results)):
+                for warning in warnings.get(index, []):
+                    messages.report("WARNING: " + warning)
+                if index in errors:
+                    messages.report("ERROR: " + errors[index])
+            return list(results)
+        elif op == "parse":
+            code, addee, add_quants, atomics = self.parse(container, self.statement(request))
+            if addee is None:
+                return {"code": code, "expression": None, "sort": None}
+            return {"code": code, "expression": self.render(container, addee, add_quants,
+                                                            notation),
+                    "sort": container.sort_of(addee, atomics)}
+        elif op == "sort_of":
+            if "index" in request:
+                return container.pin().sort_of(self.stored(container, request))
+            code, addee, _, atomics = self.parse(container, self.statement(request))
+            if addee is None:
+                raise ServiceError("the statement could not be parsed (code " + str(code) + ").")
+            return container.sort_of(addee, atomics)
+        elif op == "render":
+            if "index" in request:
+                version = container.pin()
+                return self.render(version, self.stored(container, request), {}, notation)
+            code, addee, add_quants = self.parse(container, self.statement(request))[0:3]
+            if addee is None:
+                raise ServiceError("the statement could not be parsed (code " + str(code) + ").")
+            return self.render(container, addee, add_quants, notation)
+        raise ServiceError("unknown op " + repr(op) + ".")
+
+    def statement(self, request):
+        statement = request.get("statement")
+        if not isinstance(statement, string_types):
+            raise ServiceError(str(request.get("op")) + " takes a statement string.")
+        return statement
+
+    def stored(self, container, request):
+        """
+        :return: the statement at the index of the request in the latest version of the container
+        """
+        index = request.get("index")
+        statements = container.pin().statements
+        if not isinstance(index, int) or not -len(statements) <= index < len(statements):
+            raise ServiceError("there is no statement " + repr(index) + ".")
+        return statements[index]
+
+    def parse(self, container, statement):
+        """
+        Parse a statement against a container without adding it or moving the quantifier
+        counter on.
+
+        :return: result code, the token or atomic (or None if it did not parse), add_quants and
+                 the sort of each atomic the statement adds
+        """
+        quant_map = container.namespace.quant_map
+        counter = quant_map.get("TEMP")
+        try:
+            code, parsed = container.parse_statement(statement)
+        finally:
+            if counter is None:
+                quant_map.pop("TEMP", None)
+            else:
+                quant_map["TEMP"] = counter
+        if parsed is None:
+            return code, None, {}, {}
+        atomics = {}
+        for atomic, sorts in parsed[2].items():
+            if isinstance(atomic, string_types):
+                atomics[atomic] = sorts[0]
+        return code, parsed[0], parsed[1], atomics
+
+    def render(self, container, statement, add_quants, notation):
+        if notation not in ("S", "F"):
+            raise ServiceError("invalid notation type " + repr(notation) + ".")
+        text = container.print_statement(statement, notation)
+        # Quantified variables the container does not know yet, as print_statement names them
+        for quant in add_quants.keys():
+            if 'QUANT' in quant:
+                text = text.replace(quant, add_quants[quant])
+        return text
+
+    def answer(self, request):
+        """
+        Answer a request on whichever thread this is called from.
+
+        :return: the response dict
+        """
+        response = {}
+        if "id" in request:
+            response["id"] = request["id"]
+        captured = messages.Capture()
+        try:
+            with captured:
+                result = self.call(request)
+        except ServiceError as error:
+            response.update(ok=False, error=str(error))
+            return response
+        except Exception as error:  # pylint: disable=broad-except
+            # The service outlives any one request
+            response.update(ok=False, error=type(error).__name__ + ": " + str(error))
+            return response
+        reported = [line for line in captured.getvalue().splitlines() if line]
+        response.update(ok=True, result=result, messages=reported)
+        return response
+
+    async def handle_line(self, line, last):
+        """
+        Answer a request line, on the thread of its container if it has to parse. A read by
+        index waits for the requests to the same container before it, so it sees what they added.
+
+        :param line: bytes of the JSON request
+        :param last: dict of the last request of the connection sent to the thread of each
+                     container, by name
+        :return: bytes of the JSON response line
+        """
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError as error:
+            return error_line("the request is not JSON: " + str(error))
+        if not isinstance(request, dict):
+            return error_line("the request is not a JSON object.")
+        name = request.get("container", "default")
+        if request.get("op") in ("sort_of", "render") and "index" in request:
+            before = last.get(name)
+            if before is not None:
+                await asyncio.wait([before])
+            response = self.answer(request)
+        else:
+            try:
+                self.container(name)
+            except ServiceError as error:
+                return error_line(str(error))
+            loop = asyncio.get_event_loop()
+            last[name] = loop.run_in_executor(self.executors[name], self.answer, request)
+            response = await last[name]
+        return (json.dumps(response) + "\n").encode("utf-8")
+
+    async def serve(self, read_line, write_line, queue_size=QUEUE_SIZE):
+        """
+        Answer the requests of one connection, in order, until it sends nothing more.
+
+        :param read_line: coroutine function giving the next line, or b"" at the end
+        :param write_line: coroutine function writing a response line
+        :param queue_size: most requests in progress at once
+        """
+        pending = asyncio.Queue(maxsize=queue_size)
+        closed = []
+        last = {}
+
+        async def respond():
+            while True:
+                answer = await pending.get()
+                if answer is None:
+                    return
+                line = await answer
+                if not closed:
+                    try:
+                        await write_line(line)
+                    except OSError:
+                        # Keep taking answers, so the reader is never left waiting on the queue
+                        closed.append(True)
+
+        responder = asyncio.ensure_future(respond())
+        try:
+            while not closed:
+                try:
+                    line = await read_line()
+                except ValueError:
+                    answer = asyncio.Future()
+                    answer.set_result(error_line("the request line is too long."))
+                    await pending.put(answer)
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(asyncio.ensure_future(self.handle_line(line, last)))
+        except asyncio.CancelledError:
+            # The service is stopping, and the client may not be reading its answers
+            responder.cancel()
+            while not pending.empty():
+                answer = pending.get_nowait()
+                if answer is not None:
+                    answer.cancel()
+            raise
+        await pending.put(None)
+        await responder
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown()
+
+
+def serve_socket(service, path, queue_size=QUEUE_SIZE):
+    """
+    Serve requests on a Unix socket until the process is interrupted or terminated.
+    """
+    connections = set()
+
+    async def serve_connection(reader, writer):
+        async def write_line(line):
+            writer.write(line)
+            await writer.drain()
+        try:
+            await service.serve(reader.readline, write_line, queue_size)
+        finally:
+            writer.close()
+
+    def connected(reader, writer):
+        # Kept, so that the connections still open can be closed when the service stops
+        serving = asyncio.ensure_future(serve_connection(reader, writer))
+        connections.add(serving)
+        serving.add_done_callback(connections.discard)
+
+    if os.path.exists(path):
+        os.remove(path)
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(asyncio.start_unix_server(connected, path,
+                                                               limit=LINE_LIMIT))
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if connections:
+            for serving in connections:
+                serving.cancel()
+            loop.run_until_complete(asyncio.wait(list(connections)))
+        loop.run_until_complete(server.wait_closed())
+        os.remove(path)
+
+
+def serve_stdio(service, queue_size=QUEUE_SIZE):
+    """
+    Serve requests from stdin, writing the responses to stdout, until stdin ends. Lines are read
+    and written on threads of their own, so stdin and stdout can be files, pipes or a terminal.
+    """
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    reading = ThreadPoolExecutor(max_workers=1)
+    writing = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_event_loop()
+
+    async def read_line():
+        line = await loop.run_in_executor(reading, stdin.readline, LINE_LIMIT + 1)
+        if len(line) > LINE_LIMIT:
+            raise ValueError("line too long")
+        return line
+
+    def write(line):
+        stdout.write(line)
+        stdout.flush()
+
+    async def write_line(line):
+        await loop.run_in_executor(writing, write, line)
+
+    try:
+        loop.run_until_complete(service.serve(read_line, write_line, queue_size))
+    finally:
+        reading.shutdown()
+        writing.shutdown()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Serve DCEC* containers over JSON lines.")
+    parser.add_argument("--socket", help="Unix socket to listen on, instead of stdin and stdout")
+    parser.add_argument("--load", action="append", default=[], metavar="NAME=FILENAME",
+                        help="load a saved container (see DCECContainer.save) as NAME")
+    parser.add_argument("--queue", type=int, default=QUEUE_SIZE,
+                        help="most requests a connection has in progress at once")
+    parser.add_argument("--no-logic", action="store_true",
+                        help="leave the logic functions out of the base namespace")
+    parser.add_argument("--numerics", action="store_true",
+                        help="add the numeric functions to the base namespace")
+    options = parser.parse_args(args)
+    service = ContainerService(logic=not options.no_logic, numerics=options.numerics)
+    for item in options.load:
+        name, _, filename = item.partition("=")
+        container = dcec_container.DCECContainer(prototypes.Namespace(service.base))
+        try:
+            loaded = filename and container.load(filename)
+        except (IOError, OSError) as error:
+            parser.error("could not load " + repr(item) + ": " + str(error))
+        if not loaded:
+            parser.error("could not load " + repr(item) + ".")
+        service.adopt(name, container)
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    try:
+        if options.socket:
+            serve_socket(service, options.socket, options.queue)
+        else:
+            serve_stdio(service, options.queue)
+    finally:
+        service.close()
+        asyncio.get_event_loop().close()
+
+
+if __name__ == "__main__":
+    main()
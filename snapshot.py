@@ -0,0 +1,845 @@
+"""
+A binary file format for saving a DCECContainer and loading it back. Everything in the file is a
+run of 32 bit little endian ints, apart from blocks of UTF-8 text. Nothing in the file names a
+Python class, so files keep working when the code around them moves. Loading a whole file adds
+every node to the arena of the container in one pass over the ints, which takes about as long as
+unpickling the same container, and writing one takes a little longer than pickling it. What the
+layout buys is that a file can be mapped and its statements decoded one at a time (see map_file),
+and that a container can be added to with a journal rather than saved again (see Journal).
+
+The file is laid out as
+    the magic bytes "DCEC" and the format version
+    the length in bytes of every string, then all of the strings as one block of UTF-8
+    the sorts, in the order they were defined, as the string ids of the sort, the number of
+        sorts it inherits from and those sorts
+    the functions, as the string ids of the name and the number of overloads, then for each
+        overload the return sort, the number of args and the arg sorts
+    the atomics, as pairs of the string ids of the atomic and its sort
+    the quantifier map, as its counter and then pairs of string ids
+    the infix symbols that are not in lexer.SYMBOL_MAP, as pairs of string ids
+    the index of the pair each statement starts at
+    the statements, each written out in preorder as pairs of the string id of the function name
+        or atomic and the number of args, with -1 for an atomic. A token that was already
+        written, by this statement or an earlier one, is written as the pair of the index of the
+        pair it was first written at and -2.
+    the length in bytes of the S expression of every statement, then the S expressions as one
+        block of UTF-8, so they need not be worked out again
+Every section of ints starts with the number of ints in it.
+"""
+
+from __future__ import print_function
+import io
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6 has no OrderedDict, the backport is installed there (see requirements.txt)
+    from ordereddict import OrderedDict
+from six import PY2, string_types
+
+try:
+    from collections.abc import MutableMapping, Sequence
+except ImportError:
+    from collections import MutableMapping, Sequence
+
+# We need to use the first type of import if running this script directly and the second type of
+# import if we're using it in a package (such as for within Talos)
+try:
+    import arena
+    import high_level_parsing
+    import lexer
+    import messages
+    import prototypes
+except ImportError:
+    import DCEC_Library.arena as arena
+    import DCEC_Library.high_level_parsing as high_level_parsing
+    import DCEC_Library.lexer as lexer
+    import DCEC_Library.messages as messages
+    import DCEC_Library.prototypes as prototypes
+
+MAGIC = b"DCEC"
+# Goes up whenever the layout of the file changes
+FORMAT_VERSION = 2
+# Number of args written for an atomic, and for a token that was written before
+ATOMIC = -1
+SHARED = -2
+
+HEADER = struct.Struct("<4sI")
+LENGTH = struct.Struct("<I")
+
+JOURNAL_MAGIC = b"DCEJ"
+JOURNAL_VERSION = 1
+# The length and the CRC-32 of a record of a journal
+RECORD = struct.Struct("<II")
+# The smallest size a journal grows to before the container is saved again
+JOURNAL_LIMIT = 1 << 20
+# The array type code of a 32 bit int
+INT = "i" if array("i").itemsize == 4 else "l"
+# Whether ints can be read in place out of a mapped file, which needs memoryview.cast (Python 3.3)
+try:
+    CAST_INTS = sys.byteorder == "little" and hasattr(memoryview, "cast")
+except NameError:
+    # Python 2.6 has no memoryview at all
+    CAST_INTS = False
+
+
+def _write_ints(stream, ints):
+    ints = array(INT, ints)
+    if sys.byteorder != "little":
+        ints.byteswap()
+    stream.write(LENGTH.pack(len(ints)))
+    stream.write(ints.tobytes() if hasattr(ints, "tobytes") else ints.tostring())
+
+
+def _write_strings(stream, strings):
+    encoded = [string.encode("utf-8") for string in strings]
+    _write_ints(stream, [len(string) for string in encoded])
+    stream.write(b"".join(encoded))
+
+
+def _read_strings(data, offset):
+    lengths, offset = _read_ints(data, offset)
+    end = offset + sum(lengths)
+    if end > len(data):
+        raise ValueError("the file is cut short")
+    block = data[offset:end]
+    if PY2:
+        # Native strings, which are what the SymbolTable interns
+        text = block
+    else:
+        # The whole block is decoded at once. The lengths are in bytes, so it can only be cut up
+        # by them when every character is one byte.
+        text = block.decode("utf-8")
+        if len(text) != len(block):
+            text = None
+    strings = []
+    offset = 0
+    for length in lengths:
+        if text is None:
+            strings.append(block[offset:offset + length].decode("utf-8"))
+        else:
+            strings.append(text[offset:offset + length])
+        offset += length
+    return strings, end
+
+
+def _read_ints(data, offset):
+    count = LENGTH.unpack_from(data, offset)[0]
+    offset += LENGTH.size
+    if offset + 4 * count > len(data):
+        raise ValueError("the file is cut short")
+    ints = array(INT)
+    chunk = data[offset:offset + 4 * count]
+    if hasattr(ints, "frombytes"):
+        ints.frombytes(chunk)
+    else:
+        ints.fromstring(chunk)
+    if sys.byteorder != "little":
+        ints.byteswap()
+    return ints, offset + 4 * count
+
+
+def dump(container, stream):
+    """
+    Write the namespace and statements of a container to a binary stream.
+
+    >>> import io
+    >>> import dcec_container
+    >>> container = dcec_container.DCECContainer()
+    >>> container.namespace.add_basic_dcec()
+    >>> container.namespace.add_basic_logic()
+    >>> container.add_statement("and(holds(f, t1), holds(f, t2))")
+    True
+    >>> stream = io.BytesIO()
+    >>> dump(container, stream)
+    >>> stream.getvalue()[:4] == MAGIC
+    True
+    >>> copy = dcec_container.DCECContainer()
+    >>> load(io.BytesIO(stream.getvalue()), copy)
+    True
+    >>> copy.print_statement(copy.statements[0])
+    '(and (holds f t1) (holds f t2))'
+    >>> copy.namespace.atomics["t2"], copy.namespace.functions["and"]
+    ('Moment', [['Boolean', ['Boolean', 'Boolean']]])
+
+    :param container: DCECContainer to write
+    :param stream: binary stream to write to
+    """
+    strings = StringTable()
+    sections = _encode_namespace(container.namespace, strings.id_of)
+    sections.extend(encode_statements(container.statements, strings.id_of))
+    expressions = [statement if isinstance(statement, string_types)
+                   else statement.create_s_expression() for statement in container.statements]
+
+    stream.write(HEADER.pack(MAGIC, FORMAT_VERSION))
+    _write_strings(stream, strings.strings)
+    for section in sections:
+        _write_ints(stream, section)
+    _write_strings(stream, expressions)
+
+
+class StringTable(object):
+    """
+    The strings of a file and their ids, in the order they were first used.
+    """
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def id_of(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+
+def _encode_namespace(namespace, string_id):
+    # Sorts only inherit from sorts that were defined before them, so following the parents of
+    # each sort before the sort gives an order they can be defined in again
+    sorts = []
+    written = set()
+    for sort in namespace.sorts:
+        stack = [sort]
+        while stack:
+            name = stack[-1]
+            parents = [parent for parent in namespace.sorts[name] if parent not in written]
+            if name in written:
+                stack.pop()
+            elif parents:
+                stack.extend(parents)
+            else:
+                stack.pop()
+                written.add(name)
+                sorts.append(string_id(name))
+                sorts.append(len(namespace.sorts[name]))
+                sorts.extend(string_id(parent) for parent in namespace.sorts[name])
+    functions = _encode_functions(namespace.functions, string_id)
+    atomics = []
+    for name in namespace.atomics:
+        atomics.append(string_id(name))
+        atomics.append(string_id(namespace.atomics[name]))
+    quants = _encode_quants(namespace.quant_map, string_id)
+    operators = []
+    for symbol, function_name in namespace.operators.symbols.items():
+        if lexer.SYMBOL_MAP.get(symbol) != function_name:
+            operators.append(string_id(symbol))
+            operators.append(string_id(function_name))
+    return [sorts, functions, atomics, quants, operators]
+
+
+def _encode_functions(functions, string_id):
+    ints = []
+    for name in functions:
+        ints.append(string_id(name))
+        ints.append(len(functions[name]))
+        for return_type, args_types in functions[name]:
+            ints.append(string_id(return_type))
+            ints.append(len(args_types))
+            ints.extend(string_id(arg) for arg in args_types)
+    return ints
+
+
+def _encode_quants(quant_map, string_id):
+    ints = [quant_map.get("TEMP", 0)]
+    for quant in quant_map:
+        if isinstance(quant_map[quant], string_types):
+            ints.append(string_id(quant))
+            ints.append(string_id(quant_map[quant]))
+    return ints
+
+
+def encode_statements(statements, string_id):
+    """
+    Write statements out as pairs of ints, as dump does.
+
+    :param statements: list of Tokens, ArenaTerms and atomics, or a TermArena
+    :param string_id: function that gives the id of a string, such as StringTable.id_of
+    :return: list of the index of the pair each statement starts at, and list of the pairs
+    """
+    if isinstance(statements, arena.TermArena):
+        return _encode_arena(statements, string_id)
+    starts = []
+    ints = []
+    append = ints.append
+    # The pair every token was first written at. Tokens compare by identity and views by node.
+    tokens = {}
+    for statement in statements:
+        starts.append(len(ints) // 2)
+        stack = [statement]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, string_types):
+                append(string_id(item))
+                append(ATOMIC)
+                continue
+            first = tokens.get(item)
+            if first is not None:
+                append(first)
+                append(SHARED)
+            else:
+                tokens[item] = len(ints) // 2
+                append(string_id(item.function_name))
+                append(len(item.args))
+                stack.extend(reversed(item.args))
+    return [starts, ints]
+
+
+def _encode_arena(terms, string_id):
+    # As encode_statements, but straight from the columns of the arena
+    starts = []
+    ints = []
+    append = ints.append
+    names = prototypes.SYMBOL_TABLE.names
+    symbol, arity, first, children = terms.symbol, terms.arity, terms.first, terms.children
+    # The string id of every symbol, and the pair every node was first written at or -1
+    ids = {}
+    written = array("i", [-1]) * terms.node_count()
+    for root in terms.roots:
+        starts.append(len(ints) // 2)
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            count = arity[node]
+            if count != arena.ATOMIC and written[node] >= 0:
+                append(written[node])
+                append(SHARED)
+                continue
+            string = ids.get(symbol[node])
+            if string is None:
+                string = ids[symbol[node]] = string_id(names[symbol[node]])
+            append(string)
+            if count == arena.ATOMIC:
+                append(ATOMIC)
+                continue
+            written[node] = len(ints) // 2
+            append(count)
+            if count:
+                stack.extend(reversed(children[first[node]:first[node] + count]))
+    return [starts, ints]
+
+
+def load(stream, container):
+    """
+    Read a binary stream written by dump into a container. The container gets a new namespace
+    and the statements of the stream in place of its own, in a new TermArena. No Tokens are
+    made, and subterms the statements share are added once, since the file writes them once.
+
+    :param stream: binary stream to read from
+    :param container: DCECContainer to read into
+    :return: True if the stream was read, False otherwise
+    """
+    data = stream.read()
+    try:
+        parts = _read_parts(data)
+        if not parts:
+            return False
+        namespace, starts, offset, count, expressions = parts
+        ints, _ = _read_ints(data, offset - LENGTH.size)
+        decoder = Decoder(namespace[0], ints.tolist(), high_level_parsing.Token)
+        statements = arena.TermArena()
+        statements.roots.extend(decoder.decode_all(starts, statements))
+    except (struct.error, ValueError, IndexError, UnicodeDecodeError) as error:
+        messages.report("ERROR: the file could not be read, " + str(error) + ".")
+        return False
+    container.namespace = namespace[1]
+    container.statements = statements
+    container.checkMap = arena.ArenaCheckMap(statements)
+    for index, expression in enumerate(expressions):
+        container.checkMap[expression] = statements[index]
+    return True
+
+
+def map_file(filename, container, cache_size=1024):
+    """
+    Open a file written by dump through mmap. The namespace is read at once, but each statement
+    is only decoded into Tokens when it is first asked for, through the statements or checkMap
+    of the container, and then kept in a cache of at most cache_size statements. Processes that
+    map the same file share the pages of it that the operating system has cached.
+
+    :param filename: file written by dump
+    :param container: DCECContainer to read into
+    :param cache_size: most statements to keep decoded at once
+    :return: True if the file was opened, False otherwise
+    """
+    with open(filename, "rb") as source:
+        try:
+            data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            # Empty files cannot be mapped
+            messages.report("ERROR: the file is not a saved DCEC container.")
+            return False
+    try:
+        parts = _read_parts(data)
+        if not parts:
+            return False
+        namespace, starts, offset, count, expressions = parts
+        # Statements are only made into Tokens when they are asked for, see SavedStatements
+        decoder = Decoder(namespace[0], _map_ints(data, offset, count), high_level_parsing.Token)
+    except (struct.error, ValueError, IndexError, UnicodeDecodeError) as error:
+        messages.report("ERROR: the file could not be read, " + str(error) + ".")
+        return False
+    container.namespace = namespace[1]
+    container.statements = SavedStatements(decoder, starts, expressions, cache_size)
+    container.checkMap = SavedCheckMap(container.statements, expressions)
+    return True
+
+
+def _read_parts(data):
+    # Everything but the statements themselves, which are left where they are
+    magic, version = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        messages.report("ERROR: the file is not a saved DCEC container.")
+        return None
+    if version != FORMAT_VERSION:
+        messages.report("ERROR: the file was saved in version " + str(version) + " of the format, "
+                        "but only version " + str(FORMAT_VERSION) + " can be read.")
+        return None
+    strings, offset = _read_strings(data, HEADER.size)
+    strings = [prototypes.SYMBOL_TABLE.intern(string) for string in strings]
+    sections = []
+    for _ in range(0, 6):
+        section, offset = _read_ints(data, offset)
+        sections.append(section)
+    count = LENGTH.unpack_from(data, offset)[0]
+    offset += LENGTH.size
+    if offset + 4 * count > len(data):
+        raise ValueError("the file is cut short")
+    expressions = _read_strings(data, offset + 4 * count)[0]
+    starts = sections[5].tolist()
+    if len(expressions) != len(starts) or any(start >= count // 2 for start in starts):
+        raise ValueError("the statements do not match their index")
+    return (strings, _read_namespace(strings, *sections[:5])), starts, offset, count, expressions
+
+
+def _map_ints(data, offset, count):
+    # Ints straight out of the mapped file where the platform allows it, copies of them otherwise
+    if CAST_INTS:
+        return memoryview(data)[offset:offset + 4 * count].cast(INT)
+    return _read_ints(data, offset - LENGTH.size)[0]
+
+
+def keep_expression(statement, expression):
+    """
+    Fill in the S expression a statement that was read back was saved with, so that it is not
+    worked out again.
+
+    :param statement: Token or atomic
+    :param expression: its S expression
+    """
+    if not isinstance(statement, string_types) and statement.s_expression is None:
+        # Tokens cannot be changed, but their cached S expression can be filled in
+        object.__setattr__(statement, "s_expression", expression)
+
+
+class Decoder(object):
+    """
+    Turns the statements of a file back into Tokens, one at a time.
+    """
+    def __init__(self, strings, ints, make):
+        self.strings = strings
+        self.ints = ints
+        # Makes a token from a function name and args, such as Token
+        self.make = make
+
+    def decode(self, place, memo):
+        """
+        Decode the statement or token that starts at a pair of the statements. A token written
+        as a reference to an earlier one is decoded from where the earlier one was written, so
+        any statement can be decoded without the ones before it.
+
+        :param place: index of the pair the statement starts at
+        :param memo: tokens already decoded, by the index of their pair
+        :return: Token or atomic
+        """
+        strings = self.strings
+        ints = self.ints
+        make = self.make
+        # Tokens whose args are still being read, as their args, number of args, function name
+        # and pair
+        stack = []
+        # Where to carry on from after a reference, and how many tokens were being read then
+        returns = []
+        while True:
+            symbol = ints[2 * place]
+            count = ints[2 * place + 1]
+            start = place
+            place += 1
+            if count == ATOMIC:
+                item = strings[symbol]
+            elif count == SHARED:
+                if symbol >= start:
+                    raise ValueError("a token refers to a later one")
+                if symbol not in memo:
+                    returns.append((place, len(stack)))
+                    place = symbol
+                    continue
+                item = memo[symbol]
+            elif count > 0:
+                stack.append(([], count, strings[symbol], start))
+                continue
+            else:
+                item = make(strings[symbol], [])
+                memo[start] = item
+            # Hand the finished item up to the tokens that are waiting for it
+            while True:
+                while returns and returns[-1][1] == len(stack):
+                    # The item is the token a reference was to, and stands in for it
+                    place = returns.pop()[0]
+                if not stack:
+                    return item
+                args, count, name, start = stack[-1]
+                args.append(item)
+                if len(args) < count:
+                    break
+                stack.pop()
+                item = make(name, args)
+                memo[start] = item
+
+    def decode_all(self, starts, terms):
+        """
+        Decode every statement into a TermArena, in one pass over the pairs, without making any
+        Tokens. The statements have to be all of the pairs, one after the other, as dump writes
+        them.
+
+        :param starts: index of the pair each statement starts at
+        :param terms: TermArena to add the nodes of the statements to
+        :return: list of the nodes of the statements
+        """
+        symbols = [prototypes.SYMBOL_TABLE.id_of(string) for string in self.strings]
+        ints = self.ints
+        add_node = terms.add_node
+        # The node of the token first written at each pair, and of each atomic by string id
+        tokens = [None] * (len(ints) // 2)
+        atomics = [None] * len(symbols)
+        # The finished statements, followed by the args read so far of the tokens being read
+        items = []
+        # The token being read as where its args end and start in items and the pair it was
+        # written at, and the ones it is an arg of below it. The statements are below them all.
+        end, begin, written = -1, 0, -1
+        outer = []
+        # Looked up once rather than for every pair
+        append = items.append
+        atomic = ATOMIC
+        shared = SHARED
+        for place, (symbol, count) in enumerate(zip(ints[0::2], ints[1::2])):
+            if count == atomic:
+                node = atomics[symbol]
+                if node is None:
+                    node = atomics[symbol] = add_node(symbols[symbol], arena.ATOMIC, ())
+                append(node)
+            elif count == shared:
+                token = tokens[symbol]
+                if token is None:
+                    raise ValueError("a token refers to one that is not before it")
+                append(token)
+            elif count > 0:
+                outer.append((end, begin, written))
+                begin = len(items)
+                end = begin + count
+                written = place
+                continue
+            else:
+                token = tokens[place] = add_node(symbols[symbol], 0, ())
+                append(token)
+            while len(items) == end:
+                token = tokens[written] = add_node(symbols[ints[2 * written]], end - begin,
+                                                   items[begin:])
+                del items[begin:]
+                append(token)
+                end, begin, written = outer.pop()
+        if outer or len(items) != len(starts):
+            raise ValueError("the statements do not match their index")
+        return items
+
+
+class SavedStatements(Sequence):
+    """
+    The statements of a mapped file, as a list that decodes each statement the first time it is
+    asked for. Statements added after the file was opened are kept as they are.
+    """
+    def __init__(self, decoder, starts, expressions, cache_size):
+        # The decoder reads straight from the mapped file, which stays open while it is used
+        self.decoder = decoder
+        self.starts = starts
+        self.expressions = expressions
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.added = []
+
+    def __len__(self):
+        return len(self.starts) + len(self.added)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[place] for place in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("statement index out of range")
+        if index >= len(self.starts):
+            return self.added[index - len(self.starts)]
+        # Other threads may be reading versions of the container at the same time (see
+        # DCECContainer.pin), so the cache is changed in steps that cannot fail halfway
+        statement = self.cache.pop(index, None)
+        if statement is None:
+            try:
+                statement = self.decoder.decode(self.starts[index], {})
+            except IndexError:
+                # Not an IndexError, which would quietly end a loop over the statements
+                raise ValueError("statement " + str(index) + " of the file is damaged")
+            keep_expression(statement, self.expressions[index])
+        if self.cache_size > 0:
+            self.cache[index] = statement
+            while len(self.cache) > self.cache_size:
+                try:
+                    self.cache.popitem(last=False)
+                except KeyError:
+                    break
+        return statement
+
+    def append(self, statement):
+        self.added.append(statement)
+
+
+class SavedCheckMap(MutableMapping):
+    """
+    The checkMap of a mapped file. The S expressions are read at once, and each maps to a
+    statement that is only decoded when it is looked up.
+    """
+    def __init__(self, statements, expressions):
+        self.statements = statements
+        self.index = {}
+        for place, expression in enumerate(expressions):
+            self.index[expression] = place
+        self.added = {}
+
+    def __getitem__(self, key):
+        if key in self.added:
+            return self.added[key]
+        return self.statements[self.index[key]]
+
+    def __setitem__(self, key, value):
+        self.added[key] = value
+
+    def __delitem__(self, key):
+        if key in self.added:
+            del self.added[key]
+        else:
+            del self.index[key]
+
+    def __contains__(self, key):
+        return key in self.added or key in self.index
+
+    def __iter__(self):
+        for key in self.index:
+            if key not in self.added:
+                yield key
+        for key in self.added:
+            yield key
+
+    def __len__(self):
+        return len(self.index) + sum(1 for key in self.added if key not in self.index)
+
+
+class Journal(object):
+    """
+    An append-only log of what was added to a container since it was last saved. Each record
+    holds one statement and what adding it changed in the namespace, so writing a record costs as
+    much as the statement rather than the whole container. A record is its length, its CRC-32 and
+    then the same string table and sections of ints as a saved file, with the index of the
+    statement in the container in front. Records the saved file already holds are skipped when
+    the journal is replayed, and a record cut short by a crash is dropped.
+    """
+    def __init__(self, filename, sync=False):
+        self.filename = filename
+        # If True, every record is forced to disk before add_statement returns
+        self.sync = sync
+        self.stream = None
+        # The version of the namespace the records have caught up with
+        self.version = None
+        # The size the journal can grow to before the container is saved again
+        self.limit = JOURNAL_LIMIT
+
+    def replay(self, container):
+        """
+        Add the records of the journal to a container, and open the journal to add more.
+
+        :param container: DCECContainer the journal was kept for
+        :return: number of statements added, or False if the journal could not be read
+        """
+        try:
+            with open(self.filename, "rb") as source:
+                data = source.read()
+        except (IOError, OSError):
+            data = b""
+        added = 0
+        offset = len(data)
+        if data:
+            try:
+                magic, version = HEADER.unpack_from(data, 0)
+                if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION:
+                    messages.report(
+                        "ERROR: " + self.filename + " is not a journal this version can read.")
+                    return False
+                offset = HEADER.size
+                while offset + RECORD.size <= len(data):
+                    length, checksum = RECORD.unpack_from(data, offset)
+                    payload = data[offset + RECORD.size:offset + RECORD.size + length]
+                    if len(payload) < length or zlib.crc32(payload) & 0xffffffff != checksum:
+                        break
+                    added += self._apply(container, payload)
+                    offset += RECORD.size + length
+            except (struct.error, ValueError, IndexError, UnicodeDecodeError) as error:
+                messages.report("ERROR: the journal could not be read, " + str(error) + ".")
+                return False
+        if offset < len(data):
+            # Drop the record that was cut short, so new records follow the last whole one
+            with open(self.filename, "r+b") as target:
+                target.truncate(offset)
+        self.stream = open(self.filename, "ab")
+        if not data:
+            self._write(HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+        self.version = container.namespace.version
+        return added
+
+    def _apply(self, container, payload):
+        strings, offset = _read_strings(payload, 0)
+        strings = [prototypes.SYMBOL_TABLE.intern(string) for string in strings]
+        sections = []
+        for _ in range(0, 8):
+            section, offset = _read_ints(payload, offset)
+            sections.append(section)
+        _merge_namespace(container.namespace, strings, *sections[1:6])
+        index = sections[0][0]
+        if index < 0 or index < len(container.statements):
+            return 0
+        if index > len(container.statements):
+            raise ValueError("statement " + str(len(container.statements)) + " is missing")
+        statement = Decoder(strings, sections[7].tolist(), high_level_parsing.Token).decode(0, {})
+        container.statements.append(statement)
+        if isinstance(statement, string_types):
+            container.checkMap[statement] = statement
+        else:
+            container.checkMap[statement.create_s_expression()] = container.statements[-1]
+        return 1
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+        if self.sync:
+            os.fsync(self.stream.fileno())
+
+    def _record(self, index, sections, strings, namespace):
+        payload = io.BytesIO()
+        _write_strings(payload, strings.strings)
+        for section in [[index]] + sections:
+            _write_ints(payload, section)
+        payload = payload.getvalue()
+        self._write(RECORD.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload)
+        self.version = namespace.version
+
+    def record_namespace(self, namespace):
+        """
+        Write the whole namespace, if it was changed other than by adding statements since the
+        last record.
+
+        :param namespace: namespace of the container
+        """
+        if namespace.version != self.version:
+            strings = StringTable()
+            self._record(-1, _encode_namespace(namespace, strings.id_of) + [[], []], strings,
+                         namespace)
+
+    def record_statement(self, container, statement, functions, atomics, quants):
+        """
+        Write a statement that was just added to a container.
+
+        :param container: DCECContainer the statement was added to
+        :param statement: Token or atomic
+        :param functions: inline functions of the statement, as add_statement got them
+        :param atomics: list of the atomics the statement added, as pairs of name and sort
+        :param quants: quantifier names the statement added to the quant_map
+        """
+        strings = StringTable()
+        namespace = container.namespace
+        new_atomics = []
+        for name, sort in atomics:
+            new_atomics.append(strings.id_of(name))
+            new_atomics.append(strings.id_of(sort))
+        quant_map = {"TEMP": namespace.quant_map.get("TEMP", 0)}
+        quant_map.update(quants)
+        sections = [[], _encode_functions(functions, strings.id_of), new_atomics,
+                    _encode_quants(quant_map, strings.id_of), []]
+        sections.extend(encode_statements([statement], strings.id_of))
+        self._record(len(container.statements) - 1, sections, strings, namespace)
+
+    def reset(self, namespace, saved_size):
+        """
+        Empty the journal, once the container has been saved with everything in it.
+
+        :param namespace: namespace of the container
+        :param saved_size: size of the saved file, which the journal can grow to before the
+                           container is saved again
+        """
+        self.close()
+        self.stream = open(self.filename, "wb")
+        self._write(HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION))
+        self.version = namespace.version
+        self.limit = max(JOURNAL_LIMIT, saved_size)
+
+    def size(self):
+        """
+        :return: size of the journal in bytes
+        """
+        return self.stream.tell()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+def _read_namespace(strings, sorts, functions, atomics, quants, operators):
+    return _merge_namespace(prototypes.Namespace(), strings, sorts, functions, atomics, quants,
+                            operators)
+
+
+def _merge_namespace(namespace, strings, sorts, functions, atomics, quants, operators):
+    # Everything is added through the add_code_* calls, which skip what is already there
+    place = 0
+    while place < len(sorts):
+        count = sorts[place + 1]
+        namespace.add_code_sort(strings[sorts[place]],
+                                [strings[parent] for parent in sorts[place + 2:place + 2 + count]])
+        place += 2 + count
+    place = 0
+    while place < len(functions):
+        name = strings[functions[place]]
+        overloads = functions[place + 1]
+        place += 2
+        for _ in range(0, overloads):
+            count = functions[place + 1]
+            namespace.add_code_function(name, strings[functions[place]],
+                                        [strings[arg] for arg in
+                                         functions[place + 2:place + 2 + count]])
+            place += 2 + count
+    for place in range(0, len(atomics), 2):
+        namespace.add_code_atomic(strings[atomics[place]], strings[atomics[place + 1]])
+    namespace.quant_map["TEMP"] = max(namespace.quant_map.get("TEMP", 0), quants[0])
+    for place in range(1, len(quants), 2):
+        namespace.quant_map[strings[quants[place]]] = strings[quants[place + 1]]
+    for place in range(0, len(operators), 2):
+        namespace.add_code_operator(strings[operators[place]], strings[operators[place + 1]])
+    return namespace
+
+
+if __name__ == "__main__":
+    # pylint: disable=wrong-import-position
+    import doctest
+    doctest.testmod()
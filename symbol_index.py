@@ -0,0 +1,205 @@
+"""
+An inverted index from symbols to the statements they are in, so that finding every statement
+about an agent, an atomic or a function looks only at the statements that have it rather than at
+every token of every statement.
+
+Statements are known by their place in the list of statements of the container. For each symbol
+the index keeps an array of the places of the statements it is in, in order, and an array for
+each position it is found at: the function it is an arg of and which arg it is. The function of a
+whole statement, or a statement that is only an atomic, is at slot ROOT of no function.
+
+Statements are only ever added to the end of the list, so the arrays are kept sorted by just
+appending to them. Lookups for several symbols intersect or merge those arrays, starting from the
+shortest.
+"""
+
+from __future__ import print_function
+import heapq
+from array import array
+from bisect import bisect_left
+from six import string_types
+
+# We need to use the first type of import if running this script directly and the second type of
+# import if we're using it in a package (such as for within Talos)
+try:
+    import high_level_parsing
+except ImportError:
+    import DCEC_Library.high_level_parsing as high_level_parsing
+
+# The slot of the function of a whole statement, or of a statement that is only an atomic
+ROOT = -1
+
+# What a symbol that is in no statement matches
+NOTHING = array("i")
+
+
+class SymbolIndex(object):
+    """
+    The statements each symbol is in, and where in them.
+
+    >>> Token = high_level_parsing.Token
+    >>> statements = [Token("B", ["james", "t1", Token("holds", ["f", "t1"])]),
+    ...               Token("holds", ["f", "t2"]), "james"]
+    >>> index = SymbolIndex()
+    >>> index.update(statements)
+    >>> list(index.match_all(["james", "t1"]))
+    [0]
+    >>> list(index.match_any([("f", "holds", 0), "james"]))
+    [0, 1, 2]
+    >>> list(index.match_all([("james", None, ROOT)])), list(index.match_all([("holds", "B")]))
+    ([2], [0])
+    >>> sorted(index.positions("t1"))
+    [('B', 1), ('holds', 1)]
+    """
+    def __init__(self, statements=None):
+        # The list of statements indexed, and how many of them are
+        self.source = statements
+        self.size = 0
+        # The places of the statements each symbol is in, and of those it is in at each position
+        self.statements = {}
+        self.slots = {}
+
+    def __len__(self):
+        return self.size
+
+    def update(self, statements):
+        """
+        Index the statements that are not indexed yet. The index starts again if statements is
+        not the list it was made from, such as after the container is loaded.
+
+        :param statements: list of the statements of the container
+        """
+        if statements is not self.source:
+            self.source = statements
+            self.size = 0
+            self.statements = {}
+            self.slots = {}
+        for place in range(self.size, len(statements)):
+            self.add(statements[place])
+
+    def add(self, statement):
+        """
+        Index the statement that comes after the ones already indexed.
+
+        :param statement: Token or atomic
+        """
+        place = self.size
+        self.size += 1
+        if isinstance(statement, string_types):
+            self.note(statement, None, ROOT, place)
+            return
+        self.note(statement.function_name, None, ROOT, place)
+        # A token can be shared by several args (see arena.TermArena), and its own args are the
+        # same wherever it is, so they are only looked at once. Tokens compare by identity, and
+        # views of the arena by node.
+        seen = set()
+        stack = [statement]
+        while stack:
+            token = stack.pop()
+            if token in seen:
+                continue
+            seen.add(token)
+            for slot, arg in enumerate(token.args):
+                if isinstance(arg, string_types):
+                    self.note(arg, token.function_name, slot, place)
+                else:
+                    self.note(arg.function_name, token.function_name, slot, place)
+                    stack.append(arg)
+
+    def note(self, symbol, function, slot, place):
+        places = self.statements.get(symbol)
+        if places is None:
+            places = self.statements[symbol] = array("i")
+            self.slots[symbol] = {}
+        if not places or places[-1] != place:
+            places.append(place)
+        slots = self.slots[symbol]
+        places = slots.get((function, slot))
+        if places is None:
+            places = slots[(function, slot)] = array("i")
+        if not places or places[-1] != place:
+            places.append(place)
+
+    def positions(self, symbol):
+        """
+        :param symbol: name of a function or atomic
+        :return: the function and slot of every position the symbol is found at
+        """
+        return list(self.slots.get(symbol, {}).keys())
+
+    def places(self, term):
+        """
+        :param term: a symbol, which matches it anywhere, or a tuple of a symbol, the function it
+                     is an arg of and the slot of that arg (counting from 0, or ROOT), where
+                     either can be left out or None to match any
+        :return: sorted array of the places of the statements the term matches
+        """
+        if isinstance(term, string_types):
+            return self.statements.get(term, NOTHING)
+        symbol, function, slot = (tuple(term) + (None, None))[0:3]
+        slots = self.slots.get(symbol)
+        if not slots:
+            return NOTHING
+        if function is None and slot is None:
+            return self.statements[symbol]
+        if slot is not None and (function is not None or slot == ROOT):
+            return slots.get((function, slot), NOTHING)
+        return merge([places for (at, number), places in slots.items()
+                      if (function is None or at == function) and (slot is None or number == slot)])
+
+    def match_all(self, terms):
+        """
+        Find the statements every term matches. Only the places of the term with the fewest are
+        gone through, and looked for in the others.
+
+        :param terms: iterable of terms, see places
+        :return: sorted array of the places of the statements
+        """
+        lists = sorted((self.places(term) for term in terms), key=len)
+        found = array("i")
+        if not lists:
+            return found
+        others = lists[1:]
+        # Where each of the other lists was last looked in, since the places only go up
+        starts = [0] * len(others)
+        for place in lists[0]:
+            for number, places in enumerate(others):
+                start = bisect_left(places, place, starts[number])
+                starts[number] = start
+                if start == len(places):
+                    return found
+                if places[start] != place:
+                    break
+            else:
+                found.append(place)
+        return found
+
+    def match_any(self, terms):
+        """
+        Find the statements any of the terms match.
+
+        :param terms: iterable of terms, see places
+        :return: sorted array of the places of the statements
+        """
+        # A copy, since a single list is one the index still appends to
+        return array("i", merge([self.places(term) for term in terms]))
+
+
+def merge(lists):
+    """
+    :param lists: list of sorted arrays of places
+    :return: sorted array of every place in any of them, each once
+    """
+    lists = [places for places in lists if places]
+    if len(lists) == 1:
+        return lists[0]
+    merged = array("i")
+    for place in heapq.merge(*lists):
+        if not merged or merged[-1] != place:
+            merged.append(place)
+    return merged
+
+if __name__ == "__main__":
+    # pylint: disable=wrong-import-position
+    import doctest
+    doctest.testmod()